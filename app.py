@@ -1,13 +1,14 @@
 import os
 from flask import Flask, render_template, redirect, url_for, flash, request
 from flask_login import LoginManager, current_user
-from models import db, User
+from models import db, User, upgrade_schema
 from config import Config
 import routes.auth
 import routes.pdf
 import routes.chat
 import routes.admin
 import routes.profile
+from utils.ingest import requeue_unfinished, queue_stale_rechunks, queue_fulltext_backfill
 from datetime import datetime
 
 def create_app(config_class=Config):
@@ -24,8 +25,13 @@ def create_app(config_class=Config):
     def load_user(user_id):
         return User.query.get(int(user_id))
     
-    # Create upload directory if it doesn't exist
+    # Bring databases created by an older version up to the current columns
+    with app.app_context():
+        upgrade_schema()
+    
+    # Create upload and index directories if they don't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['INDEX_FOLDER'], exist_ok=True)
     
     # Register blueprints
     app.register_blueprint(routes.auth.bp)
@@ -39,6 +45,14 @@ def create_app(config_class=Config):
     def inject_now():
         return {'now': datetime.utcnow()}
     
+    @app.cli.command('rechunk')
+    def rechunk_command():
+        """Rebuild chunks built with parameters other than the current config"""
+        futures = queue_stale_rechunks(app)
+        for future in futures:
+            future.result()
+        print(f"Re-chunked {len(futures)} documents.")
+    
     @app.route('/')
     def index():
         if current_user.is_authenticated:
@@ -51,4 +65,10 @@ if __name__ == '__main__':
     app = create_app()
     with app.app_context():
         db.create_all()
+    # Resume ingestion of PDFs left unfinished by the previous run
+    requeue_unfinished(app)
+    # Bring chunks in line with the current chunking settings in the background
+    queue_stale_rechunks(app)
+    # Index PDFs processed before full-text search existed
+    queue_fulltext_backfill(app)
     app.run(debug=True) 
\ No newline at end of file
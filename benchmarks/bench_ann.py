@@ -0,0 +1,79 @@
+"""
+IVF approximate search vs exact search: recall@k and query latency
+
+Usage:
+    python -m benchmarks.bench_ann [--vectors 100000] [--dim 384] [--queries 200] [--k 10]
+
+Vectors are synthetic: normalized points scattered around random topic
+centres, which is roughly how chunk embeddings of a document library cluster.
+"""
+import argparse
+import time
+import numpy as np
+from utils.ann_index import IVFIndex, num_lists_for
+
+def clustered_vectors(rng, count, dim, topics=500, spread=0.7):
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    # Noise of norm ~spread around unit-length centres
+    noise = rng.standard_normal((count, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+    vectors = centres[rng.integers(0, topics, count)] + noise
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def percentile_ms(samples, q):
+    return np.percentile(samples, q) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vectors', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--per-pdf', type=int, default=100, help='Vectors per simulated PDF')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(rng, args.vectors, args.dim)
+    queries = clustered_vectors(rng, args.queries, args.dim)
+
+    # Insert PDF by PDF, as uploads would
+    index = IVFIndex(args.dim)
+    start = time.perf_counter()
+    for key, offset in enumerate(range(0, args.vectors, args.per_pdf)):
+        index.add(key, vectors[offset:offset + args.per_pdf])
+    insert_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.train(num_lists_for(args.vectors))
+    train_seconds = time.perf_counter() - start
+    print(f"{args.vectors} vectors x {args.dim} dims, {index.num_lists} lists "
+          f"(insert {insert_seconds:.2f}s, train {train_seconds:.2f}s)\n")
+
+    # Exact search: one matrix-vector product over everything
+    exact, exact_times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores = vectors @ query
+        best = np.argpartition(-scores, args.k - 1)[:args.k]
+        exact_times.append(time.perf_counter() - start)
+        exact.append(set(best.tolist()))
+
+    print(f"{'method':<12} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':<12} {1.0:>10.3f} {percentile_ms(exact_times, 50):>8.2f} {percentile_ms(exact_times, 95):>8.2f}")
+
+    nprobe = 1
+    while nprobe <= index.num_lists:
+        hits, times = 0, []
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            results = index.search(query, args.k, nprobe)
+            times.append(time.perf_counter() - start)
+            found = {key * args.per_pdf + row for _, key, row in results}
+            hits += len(found & truth)
+        recall = hits / (args.k * len(queries))
+        print(f"{'nprobe=' + str(nprobe):<12} {recall:>10.3f} {percentile_ms(times, 50):>8.2f} "
+              f"{percentile_ms(times, 95):>8.2f}")
+        nprobe *= 2
+
+if __name__ == '__main__':
+    main()
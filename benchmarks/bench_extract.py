@@ -0,0 +1,46 @@
+"""
+Serial vs parallel page-range extraction speed by page count
+
+Usage:
+    python -m benchmarks.bench_extract [--workers 4] [--pages 10 40 160 640]
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.synthetic_pdf import write_random_pdf
+from utils.pdf_processor import extract_text_from_pdf
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 40, 160, 640])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'serial s':>10} {'parallel s':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_pages in args.pages:
+            path = os.path.join(tmp, f"bench_{num_pages}.pdf")
+            write_random_pdf(path, num_pages)
+
+            serial, serial_text = best_time(
+                lambda: extract_text_from_pdf(path, workers=1), args.repeat)
+            # min_pages=0 forces the parallel path so small files show the overhead too
+            parallel, parallel_text = best_time(
+                lambda: extract_text_from_pdf(path, workers=args.workers, min_pages=0), args.repeat)
+
+            assert serial_text == parallel_text, "parallel extraction changed the page order"
+            print(f"{num_pages:>6} {serial:>10.3f} {parallel:>11.3f} {serial / parallel:>7.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Full-text search latency (SQLite FTS5) on a large synthetic library
+
+Usage:
+    python -m benchmarks.bench_fulltext [--docs 10000] [--chunks 20] [--users 5] [--queries 200]
+
+Fills a temporary database with the chunks of --docs PDFs owned by --users
+users (the first user owns half of them) and times /pdf/search queries of the
+first user. Words follow a Zipf distribution over a large vocabulary whose
+most frequent words are English stopwords, as in real text, so queries range
+from rare terms to words found in most chunks.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from flask import Flask
+from sqlalchemy import text
+from models import db
+from utils.bm25 import STOPWORDS
+from utils.fulltext import FTS_TABLE, CHUNK_BITS, fulltext_available, search_chunks
+
+def make_vocabulary(rng, size):
+    """Stopwords first (the most frequent ranks), then random made-up words"""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = sorted(STOPWORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return words
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--chunks', type=int, default=20, help='Chunks per PDF')
+    parser.add_argument('--words', type=int, default=120, help='Words per chunk')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    vocabulary = make_vocabulary(rng, args.vocabulary)
+    # Zipf-like word frequencies: word r is drawn with probability ~ 1 / r
+    weights = 1.0 / np.arange(1, args.vocabulary + 1)
+    weights /= weights.sum()
+
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.sqlite')
+    db.init_app(app)
+    try:
+        with app.app_context():
+            if not fulltext_available():
+                print("SQLite FTS5 is not available in this Python build.")
+                return
+
+            start = time.perf_counter()
+            insert = text(f"INSERT INTO {FTS_TABLE}(rowid, text, owner, page) VALUES (:rowid, :text, :owner, :page)")
+            for pdf_id in range(1, args.docs + 1):
+                # The first user owns half of the library, the rest is spread over the others
+                user_id = 1 if pdf_id % 2 or args.users == 1 else 2 + pdf_id % (args.users - 1)
+                words = np_rng.choice(args.vocabulary, size=(args.chunks, args.words), p=weights)
+                db.session.execute(insert, [{
+                    'rowid': (pdf_id << CHUNK_BITS) + chunk,
+                    'text': ' '.join(vocabulary[w] for w in row),
+                    'owner': f'u{user_id}',
+                    'page': chunk // 2 + 1,
+                } for chunk, row in enumerate(words)])
+                if pdf_id % 1000 == 0:
+                    db.session.commit()
+            db.session.commit()
+            rows = args.docs * args.chunks
+            print(f"{args.docs} PDFs, {rows} chunks indexed in {time.perf_counter() - start:.1f}s\n")
+
+            # Queries of one to three words by frequency band; 'question' adds two
+            # stopwords to them, 'stopwords' has nothing else (the slowest case)
+            stop = len(STOPWORDS)
+            bands = [
+                ('question', stop, 2000, 2),
+                ('frequent', stop, stop + 200, 0),
+                ('medium', stop + 200, 2000, 0),
+                ('rare', 2000, args.vocabulary, 0),
+                ('stopwords', 0, stop, 0),
+            ]
+            print(f"{'words':<10} {'queries':>8} {'avg hits':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+            for band, low, high, extra in bands:
+                times, hits = [], 0
+                for n in range(args.queries):
+                    words = [vocabulary[rng.randrange(low, high)] for _ in range(1 + n % 3)]
+                    words += [vocabulary[rng.randrange(stop)] for _ in range(extra)]
+                    query = ' '.join(words)
+                    begin = time.perf_counter()
+                    hits += len(search_chunks(1, query))
+                    times.append(time.perf_counter() - begin)
+                times = np.array(times) * 1000
+                print(f"{band:<10} {args.queries:>8} {hits / args.queries:>9.1f} {np.percentile(times, 50):>8.2f} "
+                      f"{np.percentile(times, 95):>8.2f} {times.max():>8.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
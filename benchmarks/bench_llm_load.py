@@ -0,0 +1,73 @@
+"""
+LLM backend latency under concurrent load
+
+Usage:
+    python -m benchmarks.bench_llm_load [--provider fake] [--concurrency 1 4 16] [--requests 32]
+
+Sends --requests streamed chat requests per concurrency level, at most that
+many in flight at once, through the provider's asyncio path (utils.llm_providers).
+Reports time to first token and to the full answer (p50/p95) and the overall
+throughput in tokens per second. The default 'fake' provider needs no model
+server; its speed and parallelism follow the FAKE_LLM_* settings.
+"""
+import argparse
+import asyncio
+import random
+import time
+import numpy as np
+from config import Config
+from benchmarks.synthetic_pdf import random_page_text
+from utils.llm_api import generation_options
+from utils.llm_providers import get_provider
+
+async def timed_request(provider, messages, options):
+    """Return (seconds to the first token, seconds to the end, tokens)"""
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    async for _ in provider.astream(messages, options):
+        if first is None:
+            first = time.perf_counter() - start
+        tokens += 1
+    return first or 0.0, time.perf_counter() - start, tokens
+
+async def run_level(provider, prompts, concurrency, options):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited(messages):
+        async with slots:
+            return await timed_request(provider, messages, options)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(limited(messages) for messages in prompts))
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--provider', default='fake', choices=['ollama', 'openai', 'fake'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=32, help='Requests per concurrency level')
+    args = parser.parse_args()
+
+    provider = get_provider(args.provider)
+    rng = random.Random(0)
+    prompts = [[
+        {"role": "system", "content": "Answer from the document only."},
+        {"role": "user", "content": f"{random_page_text(rng)}\n\nQuestion: what is this page about?"},
+    ] for _ in range(args.requests)]
+    options = generation_options(0.0)
+
+    print(f"provider {provider.name}" + (f" (latency {Config.FAKE_LLM_LATENCY}s, "
+                                         f"{Config.FAKE_LLM_TOKENS_PER_SECOND:g} tokens/s, "
+                                         f"{Config.FAKE_LLM_PARALLEL} parallel)" if args.provider == 'fake' else ''))
+    print(f"{'concurrency':>11} {'ttft p50':>9} {'ttft p95':>9} {'total p50':>10} {'total p95':>10} {'tokens/s':>9}")
+    for concurrency in args.concurrency:
+        results, seconds = asyncio.run(run_level(provider, prompts, concurrency, options))
+        first = np.array([r[0] for r in results])
+        total = np.array([r[1] for r in results])
+        tokens = sum(r[2] for r in results)
+        print(f"{concurrency:>11} {np.percentile(first, 50):>8.2f}s {np.percentile(first, 95):>8.2f}s "
+              f"{np.percentile(total, 50):>9.2f}s {np.percentile(total, 95):>9.2f}s {tokens / seconds:>9.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Retrieval quality and latency on synthetic PDFs with planted facts
+
+Usage:
+    python -m benchmarks.bench_retrieval [--sizes 1 5 20] [--pages 20] [--facts 30]
+                                         [--distractors 4] [--modes bm25 hybrid] [--budget 2000]
+                                         [--output bench_retrieval.json] [--compare previous.json]
+
+For each corpus size, generates that many PDFs of filler text with one-sentence
+facts planted on random pages ("The <attribute> of the <name> unit is <value>."),
+runs them through the real ingestion path (extraction, sentence segmentation,
+chunking, BM25 index, embeddings) and asks one question per fact. Each fact
+comes with distractors sharing its name or its attribute, so lexical overlap
+alone does not single out the answer.
+
+Reported per corpus size and retrieval mode:
+    recall@k        the chunk holding the answer is among the top k ranked chunks
+    context recall  the answer made it into the packed prompt context
+    context tokens  tokens of document context put into the prompt
+    p50/p95 ms      latency of context selection and packing per question
+
+Runs offline: the local hashing embedder stands in for Ollama and the
+retrieval cache is disabled. Results are written as JSON; --compare prints
+the change against an earlier run.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from config import Config
+from benchmarks.synthetic_pdf import build_pdf, random_page_text
+from utils.chunk_store import build_chunks, chunk_params, RecordSet
+from utils.context import chunk_text, pack_chunks
+from utils.retrieval import rank_chunks, select_chunks
+
+RECALL_AT = (1, 5, 10, 20)
+
+ATTRIBUTES = [
+    'serial code', 'inspection interval', 'maximum load', 'firmware version', 'storage bay',
+    'calibration constant', 'supplier reference', 'access code', 'rated voltage', 'batch number',
+]
+
+SYLLABLES = 'ka lo mi ren tas vor quen dru sil max pel zor bix tum gal ny'.split()
+
+def made_up_name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(3)).capitalize()
+
+def plant_facts(rng, num_facts, distractors):
+    """
+    Return ([(fact sentence, question, answer)], distractor sentences) with unique names and answers
+    """
+    facts, sentences, names = [], [], set()
+
+    def new_name():
+        while True:
+            name = made_up_name(rng)
+            if name not in names:
+                names.add(name)
+                return name
+
+    def new_value():
+        return f"{rng.randint(100, 999)}-{made_up_name(rng)[:4].upper()}{len(facts)}{len(sentences)}"
+
+    for _ in range(num_facts):
+        name, attribute, answer = new_name(), rng.choice(ATTRIBUTES), new_value()
+        facts.append((f"The {attribute} of the {name} unit is {answer}.",
+                      f"What is the {attribute} of the {name} unit?",
+                      answer))
+        for number in range(distractors):
+            # Alternately the same unit with another attribute, and another unit with the same attribute
+            if number % 2 == 0:
+                other = rng.choice([a for a in ATTRIBUTES if a != attribute])
+                sentences.append(f"The {other} of the {name} unit is {new_value()}.")
+            else:
+                sentences.append(f"The {attribute} of the {new_name()} unit is {new_value()}.")
+    return facts, sentences
+
+def build_corpus(rng, directory, num_pdfs, pages, sentences, params):
+    """
+    Write and ingest num_pdfs PDFs holding the sentences; return (chunk handles, seconds spent ingesting)
+    """
+    pdf_pages = [[random_page_text(rng) for _ in range(pages)] for _ in range(num_pdfs)]
+    for sentence in sentences:
+        page_texts = rng.choice(pdf_pages)
+        page = rng.randrange(len(page_texts))
+        page_texts[page] = f"{page_texts[page]} {sentence}"
+
+    chunks = []
+    start = time.perf_counter()
+    for number, page_texts in enumerate(pdf_pages):
+        file_path = os.path.join(directory, f'{number}.pdf')
+        with open(file_path, 'wb') as pdf_file:
+            pdf_file.write(build_pdf(page_texts))
+        content_directory = os.path.join(directory, f'content{number}')
+        os.makedirs(content_directory)
+        build_chunks(file_path, content_directory, 1, params)
+        chunks.extend(RecordSet(content_directory).handles())
+    return chunks, time.perf_counter() - start
+
+def normalized(text):
+    return ' '.join(text.split())
+
+def evaluate(chunks, facts, mode, budget):
+    """
+    Ask every question against chunks in one retrieval mode and aggregate the metrics
+    """
+    texts = [normalized(chunk.text) for chunk in chunks]
+    hits = {k: 0 for k in RECALL_AT}
+    context_hits, context_tokens, times = 0, [], []
+    for _, question, answer in facts:
+        answer_positions = {position for position, text in enumerate(texts) if answer in text}
+
+        ranked = rank_chunks(question, chunks, mode=mode)
+        for k in RECALL_AT:
+            hits[k] += bool(answer_positions & set(ranked[:k]))
+
+        start = time.perf_counter()
+        selected = select_chunks(question, chunks, budget, mode=mode)
+        packed = pack_chunks([chunks[i] for i in selected], budget)
+        times.append(time.perf_counter() - start)
+
+        context = normalized(' '.join(chunk_text(content) for _, content in packed))
+        context_hits += answer in context
+        context_tokens.append(sum(chunks[selected[rank]].tokens for rank, _ in packed))
+
+    result = {f'recall@{k}': round(hits[k] / len(facts), 4) for k in RECALL_AT}
+    result.update({
+        'context_recall': round(context_hits / len(facts), 4),
+        'context_tokens_mean': round(float(np.mean(context_tokens)), 1),
+        'selection_ms_p50': round(float(np.percentile(times, 50)) * 1000, 3),
+        'selection_ms_p95': round(float(np.percentile(times, 95)) * 1000, 3),
+    })
+    return result
+
+def print_comparison(results, previous_path):
+    with open(previous_path) as previous_file:
+        previous = {(r['pdfs'], r['mode']): r for r in json.load(previous_file)['results']}
+    print(f"\nChange against {previous_path}:")
+    print(f"{'pdfs':>5} {'mode':<8} {'recall@5':>9} {'ctx recall':>11} {'ctx tokens':>11} {'p50 ms':>8}")
+    for result in results:
+        before = previous.get((result['pdfs'], result['mode']))
+        if before is None:
+            continue
+        print(f"{result['pdfs']:>5} {result['mode']:<8} "
+              f"{result['recall@5'] - before['recall@5']:>+9.3f} "
+              f"{result['context_recall'] - before['context_recall']:>+11.3f} "
+              f"{result['context_tokens_mean'] - before['context_tokens_mean']:>+11.1f} "
+              f"{result['selection_ms_p50'] - before['selection_ms_p50']:>+8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 20], help='PDFs per corpus')
+    parser.add_argument('--pages', type=int, default=20, help='Pages per PDF')
+    parser.add_argument('--facts', type=int, default=30, help='Planted facts (and questions) per corpus')
+    parser.add_argument('--distractors', type=int, default=4, help='Similar sentences planted per fact')
+    parser.add_argument('--modes', nargs='+', default=['bm25', 'hybrid'], choices=['bm25', 'semantic', 'hybrid'])
+    parser.add_argument('--budget', type=int, default=2000, help='Token budget for document context')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_retrieval.json')
+    parser.add_argument('--compare', help='Earlier JSON output to compare against')
+    args = parser.parse_args()
+
+    # Offline and uncached, so runs are comparable
+    Config.EMBEDDER = 'hashing'
+    Config.RETRIEVAL_CACHE_BYTES = 0
+    params = chunk_params({name: getattr(Config, name) for name in
+                           ('CHUNK_SIZE', 'CHUNK_OVERLAP', 'SENTENCE_SEGMENTER', 'TOKENIZER', 'EMBEDDER')})
+
+    print(f"{'pdfs':>5} {'chunks':>7} {'mode':<8} " + ' '.join(f"{'R@' + str(k):>6}" for k in RECALL_AT) +
+          f" {'ctx rec':>8} {'ctx tok':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    results = []
+    for size in args.sizes:
+        rng = random.Random(args.seed * 1000 + size)
+        facts, distractors = plant_facts(rng, args.facts, args.distractors)
+        directory = tempfile.mkdtemp()
+        try:
+            chunks, ingest_seconds = build_corpus(rng, directory, size, args.pages,
+                                                  [fact[0] for fact in facts] + distractors, params)
+            for mode in args.modes:
+                result = {'pdfs': size, 'pages': size * args.pages, 'chunks': len(chunks), 'mode': mode,
+                          'ingest_seconds': round(ingest_seconds, 3)}
+                result.update(evaluate(chunks, facts, mode, args.budget))
+                results.append(result)
+                print(f"{size:>5} {len(chunks):>7} {mode:<8} " +
+                      ' '.join(f"{result['recall@' + str(k)]:>6.2f}" for k in RECALL_AT) +
+                      f" {result['context_recall']:>8.2f} {result['context_tokens_mean']:>8.0f}"
+                      f" {result['selection_ms_p50']:>8.2f} {result['selection_ms_p95']:>8.2f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    with open(args.output, 'w') as output_file:
+        json.dump({
+            'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'settings': {**params, 'pages_per_pdf': args.pages, 'facts': args.facts,
+                         'distractors': args.distractors,
+                         'budget': args.budget, 'seed': args.seed,
+                         'top_k': Config.RETRIEVAL_TOP_K, 'mmr_diversity': Config.MMR_DIVERSITY},
+            'results': results,
+        }, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+if __name__ == '__main__':
+    main()
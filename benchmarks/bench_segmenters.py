@@ -0,0 +1,74 @@
+"""
+Sentence segmenter throughput (MB/s) on a PDF corpus
+
+Usage:
+    python -m benchmarks.bench_segmenters [PDF or directory ...] [--repeat 3]
+
+Without paths, every PDF under the configured UPLOAD_FOLDER is used, falling
+back to synthetic text when there are none.
+"""
+import argparse
+import os
+import random
+import time
+from config import Config
+from benchmarks.synthetic_pdf import random_page_text
+from utils.pdf_processor import iter_pages, preprocess_text
+from utils.segmenters import SEGMENTERS
+
+def find_pdfs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith('.pdf'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def load_corpus(paths):
+    """
+    Return the cleaned page texts of every readable PDF under paths
+    """
+    texts = []
+    for pdf_path in find_pdfs(paths):
+        try:
+            texts.extend(preprocess_text(text) for _, text in iter_pages(pdf_path))
+        except Exception as e:
+            print(f"Skipping {pdf_path}: {e}")
+    return [text for text in texts if text]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.paths or [Config.UPLOAD_FOLDER])
+    if not texts:
+        print("No PDFs found, using synthetic text")
+        rng = random.Random(0)
+        texts = [random_page_text(rng) for _ in range(500)]
+
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / (1024 * 1024)
+    print(f"Corpus: {len(texts)} pages, {megabytes:.2f} MB\n")
+    print(f"{'segmenter':<10} {'sentences':>10} {'seconds':>9} {'MB/s':>8}")
+
+    for name, segment in SEGMENTERS.items():
+        try:
+            segment("Warm up. Loads any lazy resources.")
+        except Exception as e:
+            reason = str(e).strip('*\n ').splitlines()[0]
+            print(f"{name:<10} unavailable: {reason}")
+            continue
+
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            sentences = sum(len(segment(text)) for text in texts)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:<10} {sentences:>10} {best:>9.3f} {megabytes / best:>8.2f}")
+
+if __name__ == '__main__':
+    main()
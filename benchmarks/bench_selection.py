@@ -0,0 +1,118 @@
+"""
+Context selection: greedy top-ranked packing vs hybrid retrieval with MMR
+
+Usage:
+    python -m benchmarks.bench_selection [--budget 600] [--duplicates 8] [--runs 50]
+
+Builds a synthetic document whose answer is spread over several distinct
+passages, one of which is repeated with small variations (as happens with
+boilerplate, revisions and overlapping chunks). Reports how many distinct
+passages each selector fits into the token budget and how long selection takes.
+Uses the local hashing embedder, so no Ollama server is needed.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from config import Config
+from benchmarks.synthetic_pdf import random_page_text
+from utils.bm25 import IndexBuilder
+from utils.chunk_store import RecordWriter, RecordSet, CHUNKS
+from utils.context import pack_chunks
+from utils.embeddings import get_embedder, write_embeddings
+from utils.retrieval import rank_chunks, select_chunks
+
+QUERY = "What does the zorblax calibration procedure require?"
+
+FACTS = [
+    "The zorblax calibration procedure requires a torque wrench set to 40 newton metres.",
+    "Zorblax calibration must be repeated after every firmware update of the controller.",
+    "During zorblax calibration the coolant pump has to stay switched off.",
+    "A zorblax calibration record is signed by two certified technicians.",
+    "The zorblax calibration procedure requires the reference gauge kit from bay four.",
+]
+
+def build_chunks(rng, duplicates, filler):
+    """
+    Return (chunk texts, fact number of each chunk or None)
+    """
+    texts, facts = [], []
+    for _ in range(filler):
+        texts.append(random_page_text(rng, sentences=8))
+        facts.append(None)
+    # The first fact appears many times with small edits
+    context = random_page_text(rng, sentences=2)
+    for copy in range(duplicates):
+        texts.append(f"{FACTS[0]} {context} Revision {copy + 1}.")
+        facts.append(0)
+    for number, fact in enumerate(FACTS[1:], 1):
+        texts.append(f"{random_page_text(rng, sentences=3)} {fact}")
+        facts.append(number)
+    order = list(range(len(texts)))
+    rng.shuffle(order)
+    return [texts[i] for i in order], [facts[i] for i in order]
+
+def store_chunks(directory, texts):
+    """
+    Write texts as a chunk set with its BM25 index and embeddings, and return handles
+    """
+    writer = RecordWriter(directory, CHUNKS, Config.TOKENIZER)
+    builder = IndexBuilder()
+    for text in texts:
+        writer.add(text, 1)
+        builder.add(text)
+    writer.close()
+    builder.save(directory)
+    write_embeddings(directory, iter(texts), len(texts), get_embedder())
+    return RecordSet(directory).handles()
+
+def greedy(chunks, budget):
+    """The previous selector: rank, then take chunks in rank order while they fit"""
+    ranked = rank_chunks(QUERY, chunks, mode='bm25')
+    return [ranked[i] for i, _ in pack_chunks([chunks[i] for i in ranked], budget)]
+
+def hybrid(chunks, budget, diversity):
+    selected = select_chunks(QUERY, chunks, budget, mode='hybrid', diversity=diversity)
+    return [selected[i] for i, _ in pack_chunks([chunks[i] for i in selected], budget)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget', type=int, default=600, help='Token budget for chunks')
+    parser.add_argument('--duplicates', type=int, default=8)
+    parser.add_argument('--filler', type=int, default=300, help='Unrelated chunks')
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+
+    # Offline embedder, so the benchmark runs without an Ollama server
+    Config.EMBEDDER = 'hashing'
+    rng = random.Random(0)
+    texts, facts = build_chunks(rng, args.duplicates, args.filler)
+    directory = tempfile.mkdtemp()
+    try:
+        chunks = store_chunks(directory, texts)
+        print(f"{len(chunks)} chunks, {len(FACTS)} distinct answer passages "
+              f"(one repeated {args.duplicates}x), budget {args.budget} tokens\n")
+        print(f"{'selector':<22} {'chunks':>6} {'answer':>7} {'distinct':>9} {'p50 ms':>8} {'p95 ms':>8}")
+
+        selectors = [('greedy (bm25)', lambda: greedy(chunks, args.budget))]
+        for diversity in (0.0, 0.3, 0.5):
+            selectors.append((f'hybrid mmr={diversity}',
+                              lambda diversity=diversity: hybrid(chunks, args.budget, diversity)))
+
+        for name, selector in selectors:
+            selector()  # Warm up caches
+            times = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                selected = selector()
+                times.append(time.perf_counter() - start)
+            answer = [facts[i] for i in selected if facts[i] is not None]
+            print(f"{name:<22} {len(selected):>6} {len(answer):>7} {len(set(answer)):>9} "
+                  f"{np.percentile(times, 50) * 1000:>8.2f} {np.percentile(times, 95) * 1000:>8.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
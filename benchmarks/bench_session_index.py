@@ -0,0 +1,71 @@
+"""
+Chat session scoring: keyword loop vs per-PDF BM25 indexes vs the session's merged index
+
+Usage:
+    python -m benchmarks.bench_session_index [--pdfs 20] [--chunks 300] [--queries 100]
+
+Each simulated PDF gets its own BM25 index, as ingestion builds them; the
+session index merges them into one term-document matrix (utils.session_index).
+"""
+import argparse
+import random
+import time
+import numpy as np
+from benchmarks.synthetic_pdf import random_page_text, WORDS
+from utils.bm25 import InvertedIndex, merge_arrays, search
+
+def keyword_scores(query, texts):
+    """The original scoring: substring matches of each query word in each chunk"""
+    keywords = query.lower().split()
+    return sorted(((sum(1 for keyword in keywords if keyword in text.lower()), i) for i, text in enumerate(texts)),
+                  reverse=True)
+
+def percentile_ms(samples, q):
+    return np.percentile(samples, q) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pdfs', type=int, default=20)
+    parser.add_argument('--chunks', type=int, default=300, help='Chunks per PDF')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pdfs = [[random_page_text(rng, sentences=6) for _ in range(args.chunks)] for _ in range(args.pdfs)]
+    texts = [text for pdf in pdfs for text in pdf]
+    queries = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))) for _ in range(args.queries)]
+
+    indexes = [InvertedIndex.from_texts(pdf) for pdf in pdfs]
+    start = time.perf_counter()
+    merged = InvertedIndex(**merge_arrays(indexes))
+    merge_seconds = time.perf_counter() - start
+    print(f"{args.pdfs} PDFs x {args.chunks} chunks = {len(texts)} chunks "
+          f"(session index merged in {merge_seconds * 1000:.1f} ms)\n")
+
+    offsets = np.cumsum([0] + [len(index) for index in indexes])
+    methods = [
+        ('keyword loop', lambda query: keyword_scores(query, texts)),
+        ('per-PDF BM25', lambda query: [int(offsets[n]) + doc_id
+                                        for _, n, doc_id in search(query, indexes, args.top_k)]),
+        ('session BM25', lambda query: [doc_id for _, _, doc_id in search(query, [merged], args.top_k)]),
+    ]
+
+    print(f"{'method':<14} {'p50 ms':>8} {'p95 ms':>8}")
+    results = {}
+    for name, method in methods:
+        method(queries[0])  # Warm up
+        times = []
+        results[name] = []
+        for query in queries:
+            start = time.perf_counter()
+            results[name].append(method(query))
+            times.append(time.perf_counter() - start)
+        print(f"{name:<14} {percentile_ms(times, 50):>8.2f} {percentile_ms(times, 95):>8.2f}")
+
+    # The merged index must rank exactly like the PDFs' indexes searched together
+    same = sum(a == b for a, b in zip(results['per-PDF BM25'], results['session BM25']))
+    print(f"\nsession ranking identical to per-PDF ranking for {same}/{len(queries)} queries")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import random
+import textwrap
+
+WORDS = (
+    "analysis system document report policy section method result data value "
+    "process model review table figure design control safety quality measure "
+    "standard procedure equipment operator maintenance schedule budget risk"
+).split()
+
+def random_sentence(rng, min_words=6, max_words=18):
+    """
+    Build a random filler sentence from a small vocabulary
+    """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+def random_page_text(rng, sentences=40):
+    """
+    Build the filler text of one page
+    """
+    return " ".join(random_sentence(rng) for _ in range(sentences))
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def build_pdf(pages, line_width=95):
+    """
+    Build a minimal, valid PDF with one Helvetica text stream per page
+
+    Args:
+        pages (list): Text of each page
+        line_width (int, optional): Characters per rendered line. Defaults to 95.
+
+    Returns:
+        bytes: The PDF file contents
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages))).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = textwrap.wrap(text, line_width) or [""]
+        operations = ["BT /F1 9 Tf 36 806 Td 11 TL"]
+        operations.extend(f"({_escape(line)}) Tj T*" for line in lines)
+        operations.append("ET")
+        stream = "\n".join(operations).encode("latin-1", "replace")
+        objects.append((
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            "/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        ).encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref_offset)
+    return bytes(output)
+
+def write_random_pdf(path, num_pages, seed=0, sentences_per_page=40):
+    """
+    Write a PDF of random filler text to path and return the page texts
+    """
+    rng = random.Random(seed)
+    pages = [random_page_text(rng, sentences_per_page) for _ in range(num_pages)]
+    with open(path, "wb") as file:
+        file.write(build_pdf(pages))
+    return pages
@@ -13,5 +13,134 @@ class Config:
     # File upload configuration
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     ALLOWED_EXTENSIONS = {'pdf'}
+    # Archives whose PDFs are imported one by one
+    ARCHIVE_EXTENSIONS = {'zip'}
+    
+    # Processed document data (chunk store and search indexes), one directory per file content
+    INDEX_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'index')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload 
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max request body
+
+    # Resumable uploads: files are sent as a sequence of parts, each one request
+    UPLOAD_PART_SIZE = 8 * 1024 * 1024  # Part size suggested to clients (must stay under MAX_CONTENT_LENGTH)
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024))  # Per file or archive
+    MAX_ARCHIVE_FILES = int(os.environ.get('MAX_ARCHIVE_FILES', 1000))  # PDFs imported from one ZIP
+    UPLOAD_SESSION_TTL = 24 * 60 * 60  # Seconds before an unfinished upload is discarded
+
+    # Background PDF ingestion (number of extraction worker processes)
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+    # Processes used to extract a single large PDF (1 = always serial)
+    PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', min(4, os.cpu_count() or 1)))
+
+    # Chunking parameters. Processed PDFs are re-chunked from their cached page text
+    # when these change (on startup or with `flask --app app rechunk`).
+    # Sentence segmenter: 'regex' (fast, built in) or 'nltk' (punkt, loaded lazily)
+    SENTENCE_SEGMENTER = os.environ.get('SENTENCE_SEGMENTER', 'regex')
+    CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 2000))  # Characters
+    # Characters shared with the previous chunk; at most half of CHUNK_SIZE (larger values are clamped)
+    CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', 0))
+
+    # LLM backend (utils/llm_providers.py): 'ollama', 'openai' (any OpenAI-compatible chat
+    # completions API, with LLM_API_KEY if it needs one) or 'fake' (deterministic in-process
+    # model for development and load tests, no GPU needed)
+    LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'ollama')
+    LLM_MODEL = os.environ.get('LLM_MODEL', 'b-aser/jkug3-v1')
+    OLLAMA_API_URL = os.environ.get('OLLAMA_API_URL', 'http://localhost:11434/api/chat')
+    OPENAI_API_URL = os.environ.get('OPENAI_API_URL', 'http://localhost:8000/v1/chat/completions')
+    LLM_API_KEY = os.environ.get('LLM_API_KEY', '')
+    # Fake model: seconds before the first token, tokens per second, requests generating at
+    # once (the rest wait for a slot) and answer length in tokens
+    FAKE_LLM_LATENCY = float(os.environ.get('FAKE_LLM_LATENCY', 0.2))
+    FAKE_LLM_TOKENS_PER_SECOND = float(os.environ.get('FAKE_LLM_TOKENS_PER_SECOND', 50))
+    FAKE_LLM_PARALLEL = int(os.environ.get('FAKE_LLM_PARALLEL', 1))
+    FAKE_LLM_ANSWER_TOKENS = int(os.environ.get('FAKE_LLM_ANSWER_TOKENS', 64))
+
+    # Token budgeting. TOKENIZER is 'heuristic' (built in, slightly overestimates)
+    # or the path of a HuggingFace tokenizer.json for the served model.
+    TOKENIZER = os.environ.get('TOKENIZER', 'heuristic')
+    # Context window per model (passed to Ollama as num_ctx) and tokens kept free for the answer
+    MODEL_CONTEXT_TOKENS = {
+        'b-aser/jkug3-v1': 8192,
+    }
+    DEFAULT_CONTEXT_TOKENS = 4096
+    ANSWER_RESERVE_TOKENS = 1024
+
+    # HTTP client shared by all LLM calls (utils/llm_client.py): keep-alive pool size per host,
+    # (connect, read) timeouts in seconds, retries of failed connections and 429/5xx responses
+    # with jittered exponential backoff, and a circuit breaker that refuses calls for
+    # LLM_BREAKER_RESET seconds after LLM_BREAKER_FAILURES failed calls in a row
+    LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', 16))
+    LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 3.05))
+    LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT', 300))
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+    LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 0.5))  # Seconds, doubled per retry
+    LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 8))
+    LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', 5))
+    LLM_BREAKER_RESET = float(os.environ.get('LLM_BREAKER_RESET', 30))
+
+    # LLM admission control (utils/llm_gateway.py), per worker process: requests generating at
+    # once (match the model server's parallelism, e.g. OLLAMA_NUM_PARALLEL), requests allowed to
+    # wait in total and per user (beyond that they get 503 / 429), and the longest wait in seconds
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 2))
+    LLM_QUEUE_SIZE = int(os.environ.get('LLM_QUEUE_SIZE', 32))
+    LLM_QUEUE_PER_USER = int(os.environ.get('LLM_QUEUE_PER_USER', 4))
+    LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 120))
+
+    # Retrieval: chunks selected for each chat message before packing.
+    # RETRIEVAL_MODE is 'hybrid' (BM25 and embedding rankings fused), 'semantic' or 'bm25';
+    # without embeddings every mode falls back to BM25.
+    RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+    RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 50))  # Candidates per ranking
+    # Maximal marginal relevance: 0 = relevance only, higher values skip near-duplicate chunks
+    MMR_DIVERSITY = float(os.environ.get('MMR_DIVERSITY', 0.3))
+
+    # Cache of ranked candidates per (PDF contents, normalized query): in-process LRU of at most
+    # RETRIEVAL_CACHE_BYTES (0 disables it), plus an optional SQLite file shared by all workers
+    RETRIEVAL_CACHE_BYTES = int(os.environ.get('RETRIEVAL_CACHE_BYTES', 32 * 1024 * 1024))
+    RETRIEVAL_CACHE_DB = os.environ.get('RETRIEVAL_CACHE_DB', '')
+
+    # Chat session indexes: sessions with more chunks than this are indexed in the background
+    # when the chat is created, and loaded session indexes are kept in memory up to a byte cap
+    SESSION_INDEX_BACKGROUND_CHUNKS = int(os.environ.get('SESSION_INDEX_BACKGROUND_CHUNKS', 20000))
+    SESSION_INDEX_CACHE_BYTES = int(os.environ.get('SESSION_INDEX_CACHE_BYTES', 256 * 1024 * 1024))
+
+    # Summaries of documents longer than one prompt are built map-reduce style: sections are
+    # summarized concurrently (SUMMARY_WORKERS requests at a time; raise OLLAMA_NUM_PARALLEL on the
+    # server to match) in at most SUMMARY_PART_TOKENS tokens each, then combined. Partial summaries
+    # are cached in memory up to SUMMARY_CACHE_BYTES, plus an optional SQLite file shared by workers,
+    # for SUMMARY_CACHE_TTL seconds (0 keeps them until their PDF is deleted or re-chunked).
+    SUMMARY_WORKERS = int(os.environ.get('SUMMARY_WORKERS', 4))
+    SUMMARY_PART_TOKENS = int(os.environ.get('SUMMARY_PART_TOKENS', 512))
+    SUMMARY_CACHE_BYTES = int(os.environ.get('SUMMARY_CACHE_BYTES', 16 * 1024 * 1024))
+    SUMMARY_CACHE_DB = os.environ.get('SUMMARY_CACHE_DB', '')
+    SUMMARY_CACHE_TTL = int(os.environ.get('SUMMARY_CACHE_TTL', 7 * 24 * 60 * 60))
+
+    # Responses to deterministic LLM requests (summaries, questions about one PDF): in-process
+    # LRU of LLM_CACHE_BYTES in front of a SQLite file shared by workers and kept across
+    # restarts ('' disables it). Entries expire after LLM_CACHE_TTL seconds, and the oldest
+    # are deleted once the file holds more than LLM_CACHE_DB_BYTES.
+    LLM_CACHE_BYTES = int(os.environ.get('LLM_CACHE_BYTES', 16 * 1024 * 1024))
+    LLM_CACHE_DB = os.environ.get('LLM_CACHE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               'instance', 'llm_cache.sqlite'))
+    LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 60 * 60))
+    LLM_CACHE_DB_BYTES = int(os.environ.get('LLM_CACHE_DB_BYTES', 256 * 1024 * 1024))
+
+    # Full-text search (/pdf/search): queries matching more chunks than this rank only the newest ones
+    FULLTEXT_RANK_WINDOW = int(os.environ.get('FULLTEXT_RANK_WINDOW', 5000))
+
+    # Chunk embeddings, computed at ingest. EMBEDDER is 'ollama' (EMBEDDING_MODEL
+    # through the embed endpoint) or 'hashing' (local and deterministic, for offline use)
+    EMBEDDER = os.environ.get('EMBEDDER', 'ollama')
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'nomic-embed-text')
+    OLLAMA_EMBED_URL = os.environ.get('OLLAMA_EMBED_URL', 'http://localhost:11434/api/embed')
+    EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 32))  # Chunks per embedding request
+    HASHING_EMBEDDING_DIM = 1024
+    # Embeddings missing at query time are computed in the background; a content whose
+    # embedding failed is not tried again for this many seconds (BM25 is used meanwhile)
+    EMBED_RETRY_SECONDS = float(os.environ.get('EMBED_RETRY_SECONDS', 300))
+
+    # Library-wide search: IVF approximate nearest-neighbour index over all of a user's chunks.
+    # Cells probed per query (more = better recall, slower), and when to start clustering.
+    ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 32))
+    ANN_MIN_TRAIN_SIZE = int(os.environ.get('ANN_MIN_TRAIN_SIZE', 4096))  # Chunks; exact search below
+    ANN_MAX_LISTS = 1024
@@ -22,6 +22,12 @@ class User(db.Model, UserMixin):
         return check_password_hash(self.password_hash, password)
 
 class PDF(db.Model):
+    # Ingestion status values
+    STATUS_QUEUED = 'queued'
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(100), nullable=False)
     original_filename = db.Column(db.String(100), nullable=False)
@@ -29,14 +35,36 @@ class PDF(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     is_processed = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(20), default=STATUS_QUEUED)
+    status_message = db.Column(db.String(255))
+    content_hash = db.Column(db.String(64), index=True)
     chat_sessions = db.relationship('PDFChatSession', backref='pdf', lazy=True)
     
+    @property
+    def processing_status(self):
+        # Rows created before status tracking only have is_processed
+        if self.status:
+            return self.status
+        return self.STATUS_READY if self.is_processed else self.STATUS_QUEUED
+
     def __repr__(self):
         return f'<PDF {self.original_filename}>'
 
+class UploadSession(db.Model):
+    # A resumable upload in progress; the data lives in UPLOAD_FOLDER/.incoming/<id>.part
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger)  # Declared by the client, checked on completion
+    received_size = db.Column(db.BigInteger, default=0)
+    next_part = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class ChatSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), default="New Chat")
+    search_library = db.Column(db.Boolean, default=False)  # Retrieve from all of the user's PDFs
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade="all, delete-orphan")
@@ -52,4 +80,35 @@ class ChatMessage(db.Model):
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, default=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False) 
\ No newline at end of file
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False) 
+
+# Columns added to existing tables after they were first created, as (table, column).
+# db.create_all() only creates missing tables, so upgrade_schema() adds these to
+# databases created by an older version.
+ADDED_COLUMNS = [
+    ('pdf', 'content_hash'),
+    ('pdf', 'status'),
+    ('pdf', 'status_message'),
+    ('chat_session', 'search_library'),
+]
+
+def upgrade_schema():
+    """
+    Add the columns in ADDED_COLUMNS that are missing from existing tables (safe to run on every start)
+    """
+    inspector = db.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table_name, column_name in ADDED_COLUMNS:
+        if table_name not in tables:
+            continue  # db.create_all() creates it with every column
+        if column_name in {column['name'] for column in inspector.get_columns(table_name)}:
+            continue
+        table = db.metadata.tables[table_name]
+        column = table.c[column_name]
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            # Existing rows get NULL; the model's legacy paths handle it
+            connection.execute(db.text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+            for index in table.indexes:
+                if column_name in index.columns:
+                    index.create(bind=connection, checkfirst=True)
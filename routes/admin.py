@@ -1,8 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
-from models import db, User, PDF, ChatSession, PDFChatSession
+from models import db, User, PDF, ChatSession, PDFChatSession, UploadSession
 from datetime import datetime, timedelta
+from utils.blob_store import release_blob
+from utils.chunk_store import delete_chunks
+from utils.ann_index import drop_library
+from utils.fulltext import unindex_pdf
+from utils.retrieval_cache import cache_stats
+from utils.summarizer import summary_cache_stats
+from utils.llm_client import llm_stats
+from utils.llm_cache import llm_cache_stats
+from utils.llm_gateway import gateway_stats
+from utils.session_index import delete_session_index
+from utils.uploads import drop_upload, remove_upload_data
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -81,24 +92,34 @@ def delete_user(user_id):
         # Delete the chat session itself
         db.session.delete(chat)
     
-    # Delete user's PDFs from storage
+    # Delete user's PDF records and their full-text rows
     pdfs = PDF.query.filter_by(user_id=user_id).all()
     for pdf in pdfs:
-        try:
-            import os
-            os.remove(pdf.file_path)
-        except (OSError, FileNotFoundError):
-            pass
-        # Delete the PDF record
         db.session.delete(pdf)
+        unindex_pdf(pdf.id)
     
-    # Commit changes to delete related records first
-    db.session.commit()
+    # Unfinished uploads go with the user
+    upload_sessions = UploadSession.query.filter_by(user_id=user_id).all()
+    for upload_session in upload_sessions:
+        drop_upload(upload_session)
     
-    # Now delete the user
+    # Delete related records first, then the user, in one transaction
+    db.session.flush()
     db.session.delete(user)
     db.session.commit()
     
+    # Files and indexes are removed only once the rows are gone, so a failed
+    # commit leaves the user intact
+    for chat in chat_sessions:
+        delete_session_index(chat.id)
+    for pdf in pdfs:
+        # The file and chunks stay if another upload shares the content
+        if release_blob(pdf) and pdf.content_hash:
+            delete_chunks(pdf.content_hash)
+    for upload_session in upload_sessions:
+        remove_upload_data(upload_session, current_app.config)
+    drop_library(user_id)
+    
     flash(f'User {user.username} has been deleted.', 'success')
     return redirect(url_for('admin.users'))
 
@@ -120,4 +141,22 @@ def stats():
     
     return render_template('admin/stats.html', 
                            user_docs=user_docs,
-                           user_chats=user_chats) 
\ No newline at end of file
+                           user_chats=user_chats,
+                           retrieval_cache=cache_stats(),
+                           llm=llm_stats())
+
+@bp.route('/stats/cache')
+@login_required
+@admin_required
+def cache_statistics():
+    # Hit/miss counters for monitoring
+    return jsonify({'retrieval': cache_stats(), 'summaries': summary_cache_stats(),
+                    'llm_responses': llm_cache_stats()})
+
+@bp.route('/stats/llm')
+@login_required
+@admin_required
+def llm_statistics():
+    # LLM client counters, latency percentiles, circuit breakers and connection pool of this
+    # worker, and its admission gateway (slots in use, requests waiting, rejections)
+    return jsonify({**llm_stats(), 'gateway': gateway_stats()}) 
\ No newline at end of file
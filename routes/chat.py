@@ -1,31 +1,35 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from models import db, PDF, ChatSession, PDFChatSession, ChatMessage
-from utils.pdf_processor import process_pdf
-from utils.groq_api import ask_question, summarize_text, chat_with_pdfs
-import os
+from utils.chunk_store import get_chunks, open_chunks
+from utils.ann_index import search_library
+from utils.ingest import queue_session_index
+from utils.session_index import linked_pdfs, sync_session_index, delete_session_index
+from utils.llm_gateway import get_gateway, GatewayRejected
+from config import Config
+from utils.llm_api import ask_question, summarize_text, chat_messages, chat_with_pdfs, stream_chat
 import json
 import re
+import time
 
 bp = Blueprint('chat', __name__, url_prefix='/chat')
 
-# Maximum number of chunks to process per PDF
-MAX_CHUNKS_PER_PDF = 5
-
 @bp.route('/new', methods=['GET', 'POST'])
 @login_required
 def new_chat():
     if request.method == 'POST':
         pdf_ids = request.form.getlist('pdf_ids')
+        search_library = request.form.get('search_library') == 'on'
         
-        if not pdf_ids:
+        if not pdf_ids and not search_library:
             flash('Please select at least one PDF to chat with.', 'danger')
             return redirect(url_for('chat.new_chat'))
         
         # Create a new chat session
         chat_session = ChatSession(
             user_id=current_user.id,
-            title="New Chat"
+            title="New Chat",
+            search_library=search_library
         )
         db.session.add(chat_session)
         db.session.flush()  # This gets the chat_session.id
@@ -41,6 +45,8 @@ def new_chat():
                 db.session.add(pdf_chat)
         
         db.session.commit()
+        build_session_index(chat_session.id)
+        
         return redirect(url_for('chat.view_chat', chat_id=chat_session.id))
     
     pdfs = PDF.query.filter_by(user_id=current_user.id, is_processed=True).all()
@@ -53,10 +59,15 @@ def view_chat(chat_id):
     pdf_sessions = PDFChatSession.query.filter_by(chat_session_id=chat_id).all()
     pdfs = [ps.pdf for ps in pdf_sessions]
     messages = ChatMessage.query.filter_by(session_id=chat_id).order_by(ChatMessage.timestamp).all()
+    # PDFs that can still be added to the chat
+    linked_ids = {pdf.id for pdf in pdfs}
+    available_pdfs = [pdf for pdf in PDF.query.filter_by(user_id=current_user.id, is_processed=True).all()
+                      if pdf.id not in linked_ids]
     
     return render_template('chat/view_chat.html', 
                           chat_session=chat_session, 
                           pdfs=pdfs, 
+                          available_pdfs=available_pdfs,
                           messages=messages)
 
 @bp.route('/<int:chat_id>/message', methods=['POST'])
@@ -68,7 +79,180 @@ def send_message(chat_id):
     if not message_content:
         return jsonify({'error': 'Message cannot be empty'}), 400
     
-    # Save user message
+    # Check admission first: a refused message is answered at once and not saved
+    try:
+        get_gateway().check(current_user.id)
+    except GatewayRejected as e:
+        return rejection_response(e)
+    return answer_message(chat_session, message_content)
+
+def answer_message(chat_session, message_content):
+    """Save a message, get the AI's answer and return it as the JSON response"""
+    save_user_message(chat_session.id, message_content)
+    
+    try:
+        arguments, ai_response = reply_arguments(chat_session, message_content)
+    except ReplyError as e:
+        return jsonify({'error': str(e)}), 500
+    
+    # Get AI response; only the model call itself holds a gateway slot
+    if arguments is not None:
+        try:
+            ai_response = chat_with_pdfs(message_content, user_id=current_user.id, **arguments)
+        except GatewayRejected as e:
+            # The queue filled up since the check: the saved question still gets an answer
+            ai_response = str(e)
+        except Exception as e:
+            ai_response = f"I encountered an error while processing your request: {str(e)}"
+    
+    processed_response = save_ai_message(chat_session, message_content, ai_response)
+    
+    return jsonify({
+        'status': 'success',
+        'message': processed_response
+    })
+
+@bp.route('/<int:chat_id>/message/stream', methods=['POST'])
+@login_required
+def stream_message(chat_id):
+    """
+    Answer a message as server-sent events: 'queued' events with the message's
+    position while it waits for the model, 'token' events with the pieces of
+    the answer as the model produces them, then one 'done' event with the
+    saved message rendered to HTML
+    """
+    chat_session = ChatSession.query.filter_by(id=chat_id, user_id=current_user.id).first_or_404()
+    message_content = request.form.get('message')
+    
+    if not message_content:
+        return jsonify({'error': 'Message cannot be empty'}), 400
+    
+    # Check admission first: a refused message is answered at once and not saved
+    gateway = get_gateway()
+    try:
+        gateway.check(current_user.id)
+    except GatewayRejected as e:
+        return rejection_response(e)
+    
+    save_user_message(chat_id, message_content)
+    try:
+        arguments, ai_response = reply_arguments(chat_session, message_content)
+    except ReplyError as e:
+        return jsonify({'error': str(e)}), 500
+    
+    # Retrieval and prompt packing are done before the message queues, so a
+    # granted slot is used by the model straight away
+    messages = None
+    if arguments is not None:
+        try:
+            messages = chat_messages(message_content, **arguments)
+        except Exception as e:
+            print(f"Error in stream_message: {e}")
+            ai_response = f"I encountered an error while processing your request: {str(e)}"
+    user_id = current_user.id
+    
+    def wait_for_slot(ticket):
+        """Yield the queue position as it changes until the model is free; False if it never was"""
+        deadline = time.monotonic() + Config.LLM_QUEUE_TIMEOUT
+        position = gateway.position(ticket)
+        if position:
+            yield sse_event('queued', {'position': position})
+        while not gateway.wait(ticket, min(1.0, max(deadline - time.monotonic(), 0))):
+            if time.monotonic() >= deadline:
+                gateway.timed_out(ticket)
+                return False
+            current = gateway.position(ticket)
+            if current and current != position:
+                position = current
+                yield sse_event('queued', {'position': position})
+        return True
+    
+    def reply_tokens():
+        started = False
+        try:
+            for token in stream_chat(messages):
+                started = True
+                yield token
+        except Exception as e:
+            print(f"Error in stream_message: {e}")
+            # Keep what was already shown and append the error after it
+            yield ("\n\n" if started else "") + f"I encountered an error while processing your request: {str(e)}"
+    
+    def generate():
+        tokens = []
+        ticket = None
+        try:
+            if messages is None:
+                # Nothing to ask the model
+                tokens.append(ai_response)
+                yield sse_event('token', {'token': ai_response})
+            else:
+                # The queue place is taken only once the body streams, so a client that
+                # goes away first never holds one
+                try:
+                    ticket = gateway.enqueue(user_id)
+                    granted = yield from wait_for_slot(ticket)
+                    busy = "The model is busy right now. Please try again shortly."
+                except GatewayRejected as e:
+                    # The queue filled up since the check: the saved question still gets an answer
+                    granted, busy = False, str(e)
+                if not granted:
+                    tokens.append(busy)
+                    yield sse_event('token', {'token': busy})
+                else:
+                    for token in reply_tokens():
+                        tokens.append(token)
+                        yield sse_event('token', {'token': token})
+        finally:
+            # Free the model for the next request, then save the answer when the stream
+            # ends, or as far as it got if the client went away
+            if ticket is not None:
+                gateway.release(ticket)
+            processed_response = save_ai_message(chat_session, message_content, ''.join(tokens))
+        yield sse_event('done', {'message': processed_response})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+class ReplyError(Exception):
+    """The documents a reply draws on could not be loaded"""
+
+def reply_arguments(chat_session, message_content):
+    """
+    Gather the chunks and history the model needs to answer a message
+    
+    Returns:
+        tuple: (chat_with_pdfs keyword arguments, or None when no model call is
+            needed; the reply to give instead)
+    
+    Raises:
+        ReplyError: If the chat's documents could not be searched or loaded
+    """
+    chat_id = chat_session.id
+    if chat_session.search_library:
+        # Retrieve from the user's whole library through the ANN index
+        try:
+            pdf_contents, pdf_sources = library_chunks(message_content)
+        except Exception as e:
+            raise ReplyError(f'Error searching your library: {str(e)}')
+        
+        if not pdf_contents:
+            return None, "Your library has no processed PDFs to search yet."
+        return {'pdf_contents': pdf_contents, 'chat_history': recent_history(chat_id),
+                'pdf_sources': pdf_sources, 'presorted': True}, None
+    
+    if not PDFChatSession.query.filter_by(chat_session_id=chat_id).first():
+        return None, "No PDFs associated with this chat. Please restart with selected PDFs."
+    
+    # Load the session's chunk list and merged term index (updated if its PDFs changed)
+    try:
+        session_index = sync_session_index(chat_id)
+    except Exception as e:
+        raise ReplyError(f'Error processing PDF: {str(e)}')
+    return {'pdf_contents': session_index.chunks, 'chat_history': recent_history(chat_id),
+            'pdf_sources': session_index.sources, 'term_index': session_index.term_index}, None
+
+def save_user_message(chat_id, message_content):
     user_message = ChatMessage(
         content=message_content,
         is_user=True,
@@ -76,71 +260,113 @@ def send_message(chat_id):
     )
     db.session.add(user_message)
     db.session.commit()
+
+def save_ai_message(chat_session, message_content, ai_response):
+    """
+    Save the AI's answer (markdown rendered to HTML) and title the chat after its first question
     
-    # Get PDFs associated with this chat
-    pdf_sessions = PDFChatSession.query.filter_by(chat_session_id=chat_id).all()
-    pdfs = [ps.pdf for ps in pdf_sessions]
-    
-    if not pdfs:
-        ai_response = "No PDFs associated with this chat. Please restart with selected PDFs."
-    else:
-        # Get recent chat history (last 10 messages)
-        history = ChatMessage.query.filter_by(session_id=chat_id).order_by(
-            ChatMessage.timestamp.desc()).limit(10).all()
-        history.reverse()  # Chronological order
-        
-        chat_history = [{'is_user': msg.is_user, 'content': msg.content} for msg in history]
-        
-        # Get PDF contents
-        pdf_contents = []
-        pdf_sources = []  # Track which PDF each chunk belongs to
-        
-        for i, pdf in enumerate(pdfs):
-            # Process the PDF if it hasn't been processed yet
-            if not pdf.is_processed:
-                try:
-                    process_pdf(pdf.file_path)
-                    pdf.is_processed = True
-                    db.session.commit()
-                except Exception as e:
-                    return jsonify({'error': f'Error processing PDF: {str(e)}'}), 500
-            
-            # Extract text
-            chunks = process_pdf(pdf.file_path)
-            if chunks:
-                # Limit to a reasonable number of chunks per PDF to avoid overloading the API
-                limited_chunks = chunks[:MAX_CHUNKS_PER_PDF]
-                pdf_contents.extend(limited_chunks)
-                # Track the source PDF index for each chunk
-                pdf_sources.extend([i] * len(limited_chunks))
-        
-        # Get AI response
-        try:
-            ai_response = chat_with_pdfs(message_content, pdf_contents, chat_history, pdf_sources)
-        except Exception as e:
-            ai_response = f"I encountered an error while processing your request: {str(e)}"
-    
+    Returns:
+        str: The saved message
+    """
     # Process markdown in AI response
     processed_response = process_markdown(ai_response)
     
-    # Save AI response
     ai_message = ChatMessage(
         content=processed_response,
         is_user=False,
-        session_id=chat_id
+        session_id=chat_session.id
     )
     db.session.add(ai_message)
     db.session.commit()
     
     # If this is the first message, update the chat title
-    if ChatMessage.query.filter_by(session_id=chat_id).count() <= 2:  # Just the first Q&A
+    if ChatMessage.query.filter_by(session_id=chat_session.id).count() <= 2:  # Just the first Q&A
         chat_session.title = message_content[:50] + ('...' if len(message_content) > 50 else '')
         db.session.commit()
     
-    return jsonify({
-        'status': 'success',
-        'message': processed_response
-    })
+    return processed_response
+
+def rejection_response(error):
+    """JSON error for a request the LLM gateway refused (429 or 503)"""
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def busy_page(error, template, **context):
+    """Render a page with the LLM gateway's refusal flashed, as a 429 or 503 with Retry-After"""
+    flash(str(error), "warning")
+    return render_template(template, **context), error.status, {'Retry-After': str(error.retry_after)}
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route('/<int:chat_id>/pdfs', methods=['POST'])
+@login_required
+def add_pdf(chat_id):
+    chat_session = ChatSession.query.filter_by(id=chat_id, user_id=current_user.id).first_or_404()
+    pdf = PDF.query.filter_by(id=request.form.get('pdf_id', type=int), user_id=current_user.id).first_or_404()
+    
+    if not PDFChatSession.query.filter_by(chat_session_id=chat_id, pdf_id=pdf.id).first():
+        db.session.add(PDFChatSession(pdf_id=pdf.id, chat_session_id=chat_session.id))
+        db.session.commit()
+        # The new PDF's chunks are appended to the session index
+        build_session_index(chat_id)
+        flash(f'Added {pdf.original_filename} to this chat.', 'success')
+    return redirect(url_for('chat.view_chat', chat_id=chat_id))
+
+@bp.route('/<int:chat_id>/pdfs/<int:pdf_id>/remove', methods=['POST'])
+@login_required
+def remove_pdf(chat_id, pdf_id):
+    ChatSession.query.filter_by(id=chat_id, user_id=current_user.id).first_or_404()
+    PDFChatSession.query.filter_by(chat_session_id=chat_id, pdf_id=pdf_id).delete()
+    db.session.commit()
+    # The PDF's chunks are cut out of the session index
+    build_session_index(chat_id)
+    flash('PDF removed from this chat.', 'success')
+    return redirect(url_for('chat.view_chat', chat_id=chat_id))
+
+def build_session_index(chat_id):
+    """Bring a chat's session index up to date, in the background if the session is large"""
+    try:
+        linked = linked_pdfs(chat_id)
+        if sum(len(chunk_set) for _, chunk_set in linked) > Config.SESSION_INDEX_BACKGROUND_CHUNKS:
+            queue_session_index(current_app._get_current_object(), chat_id)
+        else:
+            sync_session_index(chat_id, linked)
+    except Exception as e:
+        print(f"Error indexing chat session {chat_id}: {e}")
+
+def recent_history(chat_id):
+    """Return the last 10 messages of a chat, oldest first"""
+    history = ChatMessage.query.filter_by(session_id=chat_id).order_by(
+        ChatMessage.timestamp.desc()).limit(10).all()
+    history.reverse()  # Chronological order
+    
+    return [{'is_user': msg.is_user, 'content': msg.content} for msg in history]
+
+def library_chunks(query):
+    """
+    Find the chunks of all the user's PDFs most similar to query
+    
+    Returns:
+        tuple: (chunk handles, best first; index of the source PDF of each chunk)
+    """
+    pdf_contents = []
+    pdf_sources = []
+    source_numbers = {}
+    pdfs = {}
+    for _, pdf_id, row in search_library(current_user.id, query, Config.RETRIEVAL_TOP_K):
+        if pdf_id not in pdfs:
+            pdfs[pdf_id] = PDF.query.filter_by(id=pdf_id, user_id=current_user.id).first()
+        pdf = pdfs[pdf_id]
+        chunk_set = open_chunks(pdf.content_hash) if pdf else None
+        if chunk_set is None or row >= len(chunk_set):
+            continue
+        pdf_contents.append(chunk_set.handle(row))
+        pdf_sources.append(source_numbers.setdefault(pdf_id, len(source_numbers)))
+    return pdf_contents, pdf_sources
 
 def process_markdown(text):
     """Process markdown text to HTML"""
@@ -179,28 +405,37 @@ def delete_chat(chat_id):
     db.session.delete(chat_session)
     
     db.session.commit()
+    delete_session_index(chat_id)
     
     flash('Chat deleted successfully.', 'success')
     return redirect(url_for('pdf.dashboard'))
 
+def not_ready_message(pdf):
+    """Explain why a PDF has no chunks to work with"""
+    if pdf.processing_status in (PDF.STATUS_QUEUED, PDF.STATUS_PROCESSING):
+        return "This PDF is still being processed. Please try again in a moment."
+    return "Could not extract text from the PDF."
+
 @bp.route('/summarize/<int:pdf_id>')
 @login_required
 def summarize_pdf(pdf_id):
     pdf = PDF.query.filter_by(id=pdf_id, user_id=current_user.id).first_or_404()
     
     try:
-        chunks = process_pdf(pdf.file_path)
+        chunks = get_chunks(pdf)
         if not chunks:
-            flash("Could not extract text from the PDF.", "danger")
+            flash(not_ready_message(pdf), "danger")
             return redirect(url_for('pdf.view_pdf', pdf_id=pdf_id))
         
-        text = " ".join(chunks)
-        summary = summarize_text(text)
+        # Long documents are summarized section by section, then the sections combined
+        summary = summarize_text(chunks, tags=[pdf.content_hash], user_id=current_user.id)
         
         # Process markdown in summary to render bold text properly
         processed_summary = process_markdown(summary)
         
         return render_template('pdf/summary.html', pdf=pdf, summary=processed_summary)
+    except GatewayRejected as e:
+        return busy_page(e, 'pdf/view.html', pdf=pdf)
     except Exception as e:
         flash(f"Error generating summary: {str(e)}", "danger")
         return redirect(url_for('pdf.view_pdf', pdf_id=pdf_id))
@@ -217,13 +452,12 @@ def ask_pdf_question(pdf_id):
             return redirect(url_for('chat.ask_pdf_question', pdf_id=pdf_id))
         
         try:
-            chunks = process_pdf(pdf.file_path)
+            chunks = get_chunks(pdf)
             if not chunks:
-                flash("Could not extract text from the PDF.", "danger")
+                flash(not_ready_message(pdf), "danger")
                 return redirect(url_for('chat.ask_pdf_question', pdf_id=pdf_id))
             
-            text = " ".join(chunks)
-            answer = ask_question(question, text)
+            answer = ask_question(question, chunks, tags=[pdf.content_hash], user_id=current_user.id)
             
             # Process markdown in answer to render bold text properly
             processed_answer = process_markdown(answer)
@@ -232,6 +466,8 @@ def ask_pdf_question(pdf_id):
                                    pdf=pdf, 
                                    question=question, 
                                    answer=processed_answer)
+        except GatewayRejected as e:
+            return busy_page(e, 'pdf/ask_question.html', pdf=pdf)
         except Exception as e:
             flash(f"Error processing question: {str(e)}", "danger")
             return redirect(url_for('chat.ask_pdf_question', pdf_id=pdf_id))
@@ -1,10 +1,16 @@
 import os
-import uuid
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, send_from_directory
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from models import db, PDF, ChatSession, PDFChatSession
-from utils.pdf_processor import process_pdf
+from models import db, PDF, ChatSession, PDFChatSession, UploadSession
+from utils.blob_store import save_blob, release_blob
+from utils.chunk_store import delete_chunks
+from utils.ingest import start_processing, queue_archive_import
+from utils.ann_index import library_remove_pdf
+from utils.fulltext import unindex_pdf, search_chunks
+from utils.retrieval_cache import invalidate_content
+from utils.uploads import (UploadError, add_pdf, check_pdf, is_archive, spool_archive, start_upload,
+                           write_part, complete_upload, discard_upload)
 
 bp = Blueprint('pdf', __name__, url_prefix='/pdf')
 
@@ -19,6 +25,48 @@ def dashboard():
     chat_sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.created_at.desc()).all()
     return render_template('pdf/dashboard.html', pdfs=pdfs, chat_sessions=chat_sessions)
 
+@bp.route('/search')
+@login_required
+def search():
+    """Full-text search across the user's PDFs: ranked snippets with PDF id and page"""
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    results = search_chunks(current_user.id, query, limit) if query else []
+    
+    # Attach filenames; results of PDFs deleted meanwhile are dropped
+    pdf_ids = {result['pdf_id'] for result in results}
+    filenames = dict(PDF.query.with_entities(PDF.id, PDF.original_filename).filter(
+        PDF.id.in_(pdf_ids), PDF.user_id == current_user.id).all()) if pdf_ids else {}
+    for result in results:
+        result['filename'] = filenames.get(result['pdf_id'])
+    
+    return jsonify({
+        'query': query,
+        'results': [result for result in results if result['filename'] is not None]
+    })
+
+@bp.route('/status')
+@login_required
+def status():
+    """Report the ingestion status of the user's PDFs (optionally filtered by ?ids=1,2,3)"""
+    query = PDF.query.filter_by(user_id=current_user.id)
+    ids = request.args.get('ids')
+    if ids:
+        pdf_ids = [int(pdf_id) for pdf_id in ids.split(',') if pdf_id.strip().isdigit()]
+        query = query.filter(PDF.id.in_(pdf_ids))
+    
+    return jsonify({
+        'pdfs': [
+            {
+                'id': pdf.id,
+                'filename': pdf.original_filename,
+                'status': pdf.processing_status,
+                'message': pdf.status_message
+            }
+            for pdf in query.all()
+        ]
+    })
+
 @bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
@@ -35,45 +83,120 @@ def upload():
             if file.filename == '':
                 continue
                 
-            if file and allowed_file(file.filename):
+            if file and is_archive(file.filename, current_app.config):
+                # Each PDF inside the archive becomes its own record, once it is unpacked in the background
+                try:
+                    zip_path = spool_archive(file.stream, current_app.config)
+                except UploadError as e:
+                    flash(f'{file.filename}: {e}', 'danger')
+                    continue
+                queue_archive_import(current_app._get_current_object(), zip_path, current_user.id)
+                flash(f'Received {file.filename}. The PDFs inside it will appear on your dashboard shortly.', 'success')
+            elif file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                # Generate a unique filename to prevent collisions
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-                
-                file.save(file_path)
+                # A file that is not a PDF at all is refused here rather than failing in ingestion
+                try:
+                    check_pdf(file.stream)
+                except UploadError as e:
+                    flash(f'{file.filename}: {e}', 'danger')
+                    continue
+                file.stream.seek(0)
+                # Store by content hash so identical files are kept (and processed) once
+                content_hash, file_path = save_blob(file.stream, current_app.config['UPLOAD_FOLDER'])
                 
                 # Create PDF record in the database
-                new_pdf = PDF(
-                    filename=unique_filename,
-                    original_filename=filename,
-                    file_path=file_path,
-                    user_id=current_user.id,
-                    is_processed=False
-                )
-                
-                db.session.add(new_pdf)
-                uploaded_files.append(new_pdf)
+                uploaded_files.append(add_pdf(current_user.id, filename, content_hash, file_path))
             else:
-                flash(f'Invalid file type for {file.filename}. Only PDF files are allowed.', 'danger')
+                flash(f'Invalid file type for {file.filename}. Only PDF files and ZIP archives are allowed.', 'danger')
         
         if uploaded_files:
             db.session.commit()
-            # Process PDFs in background (in a real app, this would be a celery task)
-            for pdf in uploaded_files:
-                try:
-                    # Process the PDF
-                    process_pdf(pdf.file_path)
-                    pdf.is_processed = True
-                    db.session.commit()
-                except Exception as e:
-                    flash(f'Error processing {pdf.original_filename}: {str(e)}', 'danger')
+            queue_uploaded(uploaded_files)
             
-            flash(f'Successfully uploaded {len(uploaded_files)} PDF files.', 'success')
+            flash(f'Successfully uploaded {len(uploaded_files)} PDF files. They will be ready for chat once processing finishes.', 'success')
             
         return redirect(url_for('pdf.dashboard'))
         
-    return render_template('pdf/upload.html')
+    return render_template('pdf/upload.html',
+                           part_size=current_app.config['UPLOAD_PART_SIZE'],
+                           max_upload_size=current_app.config['MAX_UPLOAD_SIZE'])
+
+def queue_uploaded(pdfs):
+    """Start processing committed uploads; content processed before is searchable right away"""
+    # Extraction happens in the background worker pool; the dashboard polls for progress
+    start_processing(current_app._get_current_object(), pdfs)
+
+def upload_session_json(session):
+    return {
+        'upload_id': session.id,
+        'filename': session.filename,
+        'received_size': session.received_size,
+        'total_size': session.total_size,
+        'next_part': session.next_part,
+        'part_size': current_app.config['UPLOAD_PART_SIZE']
+    }
+
+def get_upload_session(upload_id):
+    session = UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first()
+    if session is None:
+        raise UploadError('Unknown upload', 404)
+    return session
+
+@bp.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify({'error': str(e)}), e.status_code
+
+@bp.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """Open a resumable upload: JSON {filename, size}"""
+    data = request.get_json(silent=True) or {}
+    size = data.get('size')
+    if size is not None and not isinstance(size, int):
+        raise UploadError('size must be an integer')
+    
+    session = start_upload(current_user.id, data.get('filename'), size, current_app.config)
+    return jsonify(upload_session_json(session)), 201
+
+@bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Report how much of an upload has been received, so an interrupted client can resume"""
+    return jsonify(upload_session_json(get_upload_session(upload_id)))
+
+@bp.route('/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+@login_required
+def upload_part(upload_id, part_number):
+    """Store one part; the raw request body is the part data"""
+    session = get_upload_session(upload_id)
+    write_part(session, part_number, request.stream, current_app.config)
+    return jsonify(upload_session_json(session))
+
+@bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def finish_upload(upload_id):
+    """Turn a fully received upload into a PDF record (or an archive import) and queue it for processing"""
+    session = get_upload_session(upload_id)
+    pdfs, archive_path = complete_upload(session, current_app.config)
+    db.session.commit()
+    queue_uploaded(pdfs)
+    if archive_path:
+        # Archives are unpacked in the background; their PDFs show up on the dashboard
+        queue_archive_import(current_app._get_current_object(), archive_path, current_user.id)
+    
+    return jsonify({
+        'pdfs': [
+            {'id': pdf.id, 'filename': pdf.original_filename, 'status': pdf.processing_status}
+            for pdf in pdfs
+        ],
+        'importing': archive_path is not None
+    }), 202 if archive_path else 200
+
+@bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    discard_upload(get_upload_session(upload_id), current_app.config)
+    return '', 204
 
 @bp.route('/delete/<int:pdf_id>', methods=['POST'])
 @login_required
@@ -83,16 +206,20 @@ def delete_pdf(pdf_id):
     # Delete related PDFChatSession records first
     PDFChatSession.query.filter_by(pdf_id=pdf_id).delete()
     
-    # Delete the file from storage
-    try:
-        os.remove(pdf.file_path)
-    except OSError:
-        pass
-    
-    # Remove from database
+    # Remove from database; the full-text rows live there too and go in the same transaction
     db.session.delete(pdf)
+    unindex_pdf(pdf.id)
     db.session.commit()
     
+    # Only once the deletion is committed: a failed commit must leave the PDF intact
+    library_remove_pdf(pdf)
+    # Chats over this PDF now search a different set of contents
+    invalidate_content(pdf.content_hash)
+    
+    # Delete the file and its chunks unless another upload shares the content
+    if release_blob(pdf) and pdf.content_hash:
+        delete_chunks(pdf.content_hash)
+    
     flash('PDF deleted successfully.', 'success')
     return redirect(url_for('pdf.dashboard'))
 
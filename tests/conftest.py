@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+# The modules under test import each other as top-level packages (utils, config, models)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+@pytest.fixture
+def app(tmp_path):
+    """The application on a fresh SQLite database, with uploads and indexes under tmp_path"""
+    from app import create_app
+    from models import db
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'app.sqlite')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        INDEX_FOLDER = str(tmp_path / 'index')
+        EMBEDDER = 'hashing'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
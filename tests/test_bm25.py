@@ -0,0 +1,80 @@
+import numpy as np
+from utils.bm25 import IndexBuilder, InvertedIndex, merge_arrays, drop_range, search, tokenize
+
+TEXTS_A = ["solar panels convert sunlight", "wind turbines and solar farms"]
+TEXTS_B = ["battery storage for wind power", "grid storage", "solar storage battery"]
+
+def postings(index):
+    """Every (term, chunk number, tf) triple of an index"""
+    triples = set()
+    for term in index.vocabulary:
+        doc_ids, tfs = index.postings(term)
+        triples.update((term, int(doc), int(tf)) for doc, tf in zip(doc_ids, tfs))
+    return triples
+
+def test_tokenize_drops_stopwords_and_long_tokens():
+    assert tokenize("The Solar and the WIND " + "x" * 41) == ["solar", "wind"]
+
+def test_builder_postings_are_ascending_per_term():
+    index = InvertedIndex.from_texts(TEXTS_B)
+    doc_ids, tfs = index.postings("storage")
+    assert list(doc_ids) == [0, 1, 2] and list(tfs) == [1, 1, 1]
+    assert index.df("battery") == 2 and index.postings("missing") is None
+    assert list(index.doc_lengths) == [4, 2, 3]
+
+def test_merge_arrays_matches_one_index_over_all_texts():
+    merged = InvertedIndex(**merge_arrays([InvertedIndex.from_texts(TEXTS_A), InvertedIndex.from_texts(TEXTS_B)]))
+    whole = InvertedIndex.from_texts(TEXTS_A + TEXTS_B)
+    assert list(merged.terms) == list(whole.terms)
+    assert list(merged.indptr) == list(whole.indptr)
+    assert list(merged.doc_ids) == list(whole.doc_ids)
+    assert postings(merged) == postings(whole)
+    assert list(merged.doc_lengths) == list(whole.doc_lengths)
+
+def test_merge_arrays_of_nothing_is_empty():
+    merged = InvertedIndex(**merge_arrays([]))
+    assert len(merged) == 0 and len(merged.terms) == 0
+
+def test_drop_range_matches_an_index_without_those_chunks():
+    texts = TEXTS_A + TEXTS_B
+    index = InvertedIndex.from_texts(texts)
+    dropped = InvertedIndex(**drop_range(index, 1, 3))
+    expected = InvertedIndex.from_texts(texts[:1] + texts[3:])
+    assert postings(dropped) == postings(expected)
+    assert list(dropped.terms) == list(expected.terms)
+    assert list(dropped.doc_lengths) == list(expected.doc_lengths)
+    # Terms only found in the dropped chunks are gone
+    assert "turbines" not in dropped.vocabulary and "power" not in dropped.vocabulary
+
+def test_drop_then_merge_round_trips():
+    index_a, index_b = InvertedIndex.from_texts(TEXTS_A), InvertedIndex.from_texts(TEXTS_B)
+    merged = InvertedIndex(**merge_arrays([index_a, index_b]))
+    restored = InvertedIndex(**drop_range(merged, 0, len(index_a)))
+    assert postings(restored) == postings(index_b)
+
+def test_search_ranks_across_indexes_as_one_corpus():
+    indexes = [InvertedIndex.from_texts(TEXTS_A), InvertedIndex.from_texts(TEXTS_B)]
+    results = search("battery storage", indexes, top_k=10)
+    # Chunks with both terms first, chunks with neither left out
+    assert {(n, chunk) for _, n, chunk in results[:2]} == {(1, 0), (1, 2)}
+    assert (0, 0) not in {(n, chunk) for _, n, chunk in results}
+    scores = [score for score, _, _ in results]
+    assert scores == sorted(scores, reverse=True)
+    # Searching the merged index gives the same scores
+    merged = InvertedIndex(**merge_arrays(indexes))
+    merged_scores = sorted(score for score, _, _ in search("battery storage", [merged], top_k=10))
+    assert np.allclose(sorted(scores), merged_scores)
+
+def test_search_top_k_and_empty_inputs():
+    index = InvertedIndex.from_texts(TEXTS_A + TEXTS_B)
+    assert len(search("solar storage", [index], top_k=2)) == 2
+    assert search("nothing matches", [index]) == []
+    assert search("solar", []) == []
+
+def test_saved_index_loads_back(tmp_path):
+    builder = IndexBuilder()
+    for text in TEXTS_B:
+        builder.add(text)
+    builder.save(str(tmp_path))
+    loaded = InvertedIndex.load(str(tmp_path / "bm25.npz"))
+    assert postings(loaded) == postings(builder.build())
@@ -0,0 +1,74 @@
+import os
+from utils.chunk_store import (RecordWriter, RecordSet, CHUNKS, PAGES, chunk_params, chunk_stamp,
+                               read_stamp, rechunk, open_chunks, has_chunks, content_version)
+
+CONTENT_HASH = "ab" + "0" * 62
+
+def params(**overrides):
+    config = {'CHUNK_SIZE': 60, 'CHUNK_OVERLAP': 0, 'SENTENCE_SEGMENTER': 'regex',
+              'TOKENIZER': 'heuristic', 'EMBEDDER': 'hashing'}
+    config.update(overrides)
+    return chunk_params(config)
+
+def write_records(directory, name, records, tokenizer=None):
+    writer = RecordWriter(str(directory), name, tokenizer)
+    for text, page in records:
+        writer.add(text, page)
+    return writer.close()
+
+def test_records_round_trip_with_multibyte_text(tmp_path):
+    records = [("plain ascii", 1), ("", 1), ("naïve café — 東京", 2), ("last", None)]
+    assert write_records(tmp_path, CHUNKS, records, 'heuristic') == 4
+    chunk_set = RecordSet(str(tmp_path))
+    assert len(chunk_set) == 4
+    assert chunk_set.texts() == [text for text, _ in records]
+    # Offsets and lengths count bytes, not characters
+    assert list(chunk_set.index['offset']) == [0, 11, 11, 11 + len("naïve café — 東京".encode('utf-8'))]
+    assert list(chunk_set.records()) == [(1, "plain ascii"), (1, ""), (2, "naïve café — 東京"), (0, "last")]
+    assert chunk_set.tokens(0) == 2
+    handle = chunk_set.handle(2)
+    assert handle.text == "naïve café — 東京" and handle.page == 2
+
+def test_empty_record_set(tmp_path):
+    assert write_records(tmp_path, PAGES, []) == 0
+    assert len(RecordSet(str(tmp_path), PAGES)) == 0
+
+def test_abort_publishes_nothing(tmp_path):
+    writer = RecordWriter(str(tmp_path), CHUNKS)
+    writer.add("never published", 1)
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+def test_chunk_params_clamps_the_overlap():
+    assert params(CHUNK_OVERLAP=10)['overlap'] == 10
+    assert params(CHUNK_OVERLAP=500)['overlap'] == 30
+    assert params(CHUNK_OVERLAP=-5)['overlap'] == 0
+
+def test_rechunk_from_cached_pages(tmp_path):
+    directory = tmp_path / CONTENT_HASH[:2] / CONTENT_HASH
+    pages = [("First sentence here. Second sentence follows.", 1), ("Third one is on page two. And a fourth.", 2)]
+    write_records(directory, PAGES, pages)
+    count = rechunk(str(directory), params())
+    assert count > 1
+    assert read_stamp(str(directory)) == chunk_stamp(params())
+    assert has_chunks(CONTENT_HASH, str(tmp_path))
+
+    chunk_set = open_chunks(CONTENT_HASH, str(tmp_path))
+    assert len(chunk_set) == count
+    text = " ".join(chunk_set.texts())
+    assert "First sentence here." in text and "And a fourth." in text
+    assert chunk_set.handles()[-1].page == 2
+
+    # Bigger chunks: fewer of them, a new stamp and a new content version
+    version = content_version(CONTENT_HASH, str(tmp_path))
+    # The version is a modification time, which a fast rebuild could otherwise repeat
+    os.utime(directory / (CHUNKS + '.npy'), ns=(1, 1))
+    assert rechunk(str(directory), params(CHUNK_SIZE=2000)) == 1
+    assert read_stamp(str(directory)) == chunk_stamp(params(CHUNK_SIZE=2000))
+    assert content_version(CONTENT_HASH, str(tmp_path)) != version
+    assert len(open_chunks(CONTENT_HASH, str(tmp_path))) == 1
+
+def test_missing_content(tmp_path):
+    assert open_chunks(CONTENT_HASH, str(tmp_path)) is None
+    assert not has_chunks(CONTENT_HASH, str(tmp_path))
+    assert content_version(CONTENT_HASH, str(tmp_path)) == (None, None)
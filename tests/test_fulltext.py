@@ -0,0 +1,65 @@
+import pytest
+from models import db, User, PDF
+from utils.chunk_store import RecordWriter, CHUNKS, content_dir
+from utils.fulltext import (CHUNK_BITS, _rowid_range, fulltext_available, index_pdf, unindex_pdf,
+                            is_indexed, match_expression, search_chunks)
+
+def add_user(name):
+    user = User(username=name, email=f'{name}@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def add_pdf(user, content_hash, chunks):
+    writer = RecordWriter(content_dir(content_hash), CHUNKS)
+    for text, page in chunks:
+        writer.add(text, page)
+    writer.close()
+    pdf = PDF(filename=f'{content_hash[:8]}.pdf', original_filename='doc.pdf', file_path='unused',
+              user_id=user.id, content_hash=content_hash)
+    db.session.add(pdf)
+    db.session.commit()
+    return pdf
+
+@pytest.fixture
+def library(app):
+    if not fulltext_available():
+        pytest.skip('SQLite was built without FTS5')
+    reader, other = add_user('reader'), add_user('other')
+    first = add_pdf(reader, 'a' * 64, [("Turbines feed the power grid.", 1), ("Solar panels on roofs.", 2)])
+    second = add_pdf(reader, 'b' * 64, [("The grid operator balances load.", 1)])
+    foreign = add_pdf(other, 'c' * 64, [("Another grid, owned by someone else.", 3)])
+    for pdf in (first, second, foreign):
+        index_pdf(pdf)
+    return reader, first, second, foreign
+
+def test_rowid_ranges_of_neighbouring_pdfs_do_not_overlap():
+    first, last = _rowid_range(1)
+    assert (first, last) == (1 << CHUNK_BITS, (2 << CHUNK_BITS) - 1)
+    assert _rowid_range(2)[0] == last + 1
+
+def test_match_expression_quotes_words_and_filters_by_owner():
+    assert match_expression('grid OR "power"', 7) == 'owner : "u7" AND text : ("grid" "power")'
+    assert match_expression('  ', 7) is None
+
+def test_search_returns_only_the_users_chunks(library):
+    reader, first, second, foreign = library
+    results = search_chunks(reader.id, 'grid')
+    assert {(result['pdf_id'], result['chunk']) for result in results} == {(first.id, 0), (second.id, 0)}
+    assert all('<mark>' in result['snippet'] for result in results)
+    solar = search_chunks(reader.id, 'solar panels')
+    assert [(result['pdf_id'], result['chunk'], result['page']) for result in solar] == [(first.id, 1, 2)]
+
+def test_unindex_removes_one_pdf_only(library):
+    reader, first, second, foreign = library
+    unindex_pdf(first.id)
+    db.session.commit()
+    assert not is_indexed(first.id)
+    assert is_indexed(second.id) and is_indexed(foreign.id)
+    assert [result['pdf_id'] for result in search_chunks(reader.id, 'grid')] == [second.id]
+
+def test_reindexing_replaces_the_rows(library):
+    reader, first, second, foreign = library
+    index_pdf(first)
+    assert len(search_chunks(reader.id, 'turbines')) == 1
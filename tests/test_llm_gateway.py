@@ -0,0 +1,108 @@
+import threading
+import pytest
+from utils.llm_gateway import Gateway, GatewayRejected
+
+def test_free_slots_are_granted_at_once():
+    gateway = Gateway(2, 10, 5)
+    first, second = gateway.enqueue(1), gateway.enqueue(1)
+    assert first.granted and second.granted
+    assert not gateway.enqueue(1).granted
+    assert gateway.stats()['active'] == 2
+
+def test_round_robin_between_users():
+    gateway = Gateway(1, 10, 5)
+    busy = gateway.enqueue(0)
+    burst = [gateway.enqueue(1) for _ in range(3)]
+    other = gateway.enqueue(2)
+    gateway.release(busy)
+    assert burst[0].granted and not other.granted
+    gateway.release(burst[0])
+    # User 2 is served before the rest of user 1's burst
+    assert other.granted and not burst[1].granted
+    gateway.release(other)
+    assert burst[1].granted
+
+def test_position_counts_turns_across_users():
+    gateway = Gateway(1, 10, 5)
+    gateway.enqueue(0)
+    a1, a2, a3 = (gateway.enqueue(1) for _ in range(3))
+    b1 = gateway.enqueue(2)
+    assert [gateway.position(ticket) for ticket in (a1, b1, a2, a3)] == [1, 2, 3, 4]
+
+def test_position_is_zero_once_granted():
+    gateway = Gateway(1, 10, 5)
+    ticket = gateway.enqueue(1)
+    assert gateway.position(ticket) == 0
+
+def test_release_is_idempotent():
+    gateway = Gateway(1, 10, 5)
+    ticket = gateway.enqueue(1)
+    waiting = gateway.enqueue(2)
+    gateway.release(ticket)
+    gateway.release(ticket)
+    assert gateway.stats()['active'] == 1 and waiting.granted
+    gateway.release(waiting)
+    gateway.release(waiting)
+    assert gateway.stats()['active'] == 0
+
+def test_releasing_a_waiting_ticket_gives_up_its_place():
+    gateway = Gateway(1, 10, 5)
+    busy = gateway.enqueue(0)
+    first, second = gateway.enqueue(1), gateway.enqueue(1)
+    gateway.release(first)
+    assert gateway.position(second) == 1 and gateway.stats()['waiting'] == 1
+    gateway.release(busy)
+    assert second.granted and not first.granted
+
+def test_rejections():
+    gateway = Gateway(1, 3, 2)
+    gateway.enqueue(0)
+    gateway.enqueue(1)
+    gateway.enqueue(1)
+    with pytest.raises(GatewayRejected) as per_user:
+        gateway.enqueue(1)
+    assert per_user.value.status == 429
+    gateway.enqueue(2)
+    with pytest.raises(GatewayRejected) as full:
+        gateway.enqueue(3)
+    assert full.value.status == 503
+    stats = gateway.stats()
+    assert stats['rejected_user'] == 1 and stats['rejected_full'] == 1
+
+def test_check_takes_nothing():
+    gateway = Gateway(1, 10, 1)
+    gateway.check(1)
+    assert gateway.stats()['active'] == 0
+    busy = gateway.enqueue(0)
+    gateway.enqueue(1)
+    with pytest.raises(GatewayRejected):
+        gateway.check(1)
+    gateway.check(2)
+    assert gateway.stats()['waiting'] == 1
+    gateway.release(busy)
+
+def test_slot_times_out():
+    gateway = Gateway(1, 10, 5)
+    busy = gateway.enqueue(0)
+    with pytest.raises(GatewayRejected) as timeout:
+        with gateway.slot(1, timeout=0.01):
+            pass
+    assert timeout.value.status == 503
+    stats = gateway.stats()
+    assert stats['timeouts'] == 1 and stats['waiting'] == 0
+    gateway.release(busy)
+
+def test_slot_waits_for_a_place_in_a_full_queue():
+    gateway = Gateway(1, 10, 1)
+    busy = gateway.enqueue(0)
+    queued = gateway.enqueue(1)
+    with pytest.raises(GatewayRejected):
+        with gateway.slot(1, timeout=1):
+            pass
+    # Frees the queue place, then the slot
+    releaser = threading.Timer(0.05, lambda: (gateway.release(busy), gateway.release(queued)))
+    releaser.start()
+    with gateway.slot(1, timeout=5, wait_for_place=True) as ticket:
+        assert ticket.granted
+    releaser.join()
+    assert gateway.stats()['active'] == 0
@@ -0,0 +1,95 @@
+import random
+import pytest
+from utils import summarizer
+from utils.summarizer import group_items, summarize_document, invalidate_summaries, text_hash, ANCHOR_HASH_SPACE
+
+WORDS = "alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega".split()
+
+def make_items(count, seed=0):
+    rng = random.Random(seed)
+    return [(f"item {i} " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))), rng.randint(10, 60))
+            for i in range(count)]
+
+def is_anchor(item, budget):
+    text, tokens = item
+    return int(text_hash(text)[:8], 16) * budget < (tokens + 1) * ANCHOR_HASH_SPACE
+
+def as_texts(groups):
+    return [tuple(text for text, _ in group) for group in groups]
+
+def test_groups_keep_order_and_fit_the_budget():
+    items = make_items(300)
+    groups = group_items(items, 400)
+    assert [item for group in groups for item in group] == items
+    for group in groups:
+        assert sum(tokens + 1 for _, tokens in group) <= 400 or len(group) == 1
+
+def test_anchors_end_their_group():
+    items = make_items(300)
+    groups = group_items(items, 400)
+    anchors = [item for item in items if is_anchor(item, 400)]
+    assert anchors
+    for group in groups:
+        # An anchor is only ever the last item of a group
+        assert not any(is_anchor(item, 400) for item in group[:-1])
+
+def test_oversized_item_forms_its_own_group():
+    items = [("small one", 5), ("huge", 1000), ("small two", 5)]
+    groups = group_items(items, 100)
+    assert ("huge", 1000) in [group[0] for group in groups if len(group) == 1]
+
+def test_an_edit_only_moves_nearby_boundaries():
+    items = make_items(400)
+    edited = list(items)
+    # Change one item's text and size in the middle, and grow the one after it a lot
+    edited[200] = ("a rewritten paragraph", 55)
+    edited[201] = (edited[201][0], 200)
+    before, after = as_texts(group_items(items, 400)), as_texts(group_items(edited, 400))
+    unchanged = set(before) & set(after)
+    assert len(unchanged) >= len(before) - 4
+    # Everything before the edit is grouped identically
+    first_changed = next(i for i, group in enumerate(before) if group not in set(after))
+    assert before[:first_changed] == after[:first_changed]
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(summarizer.Config, 'SUMMARY_CACHE_DB', '')
+    monkeypatch.setattr(summarizer, '_cache', None)
+    yield
+    summarizer._cache = None
+
+def recording_summarizer(calls):
+    def summarize(kind, text):
+        calls.append(kind)
+        return f"{kind} summary of {len(text)} characters"
+    return summarize
+
+BUDGETS = {'document': 300, 'section': 300, 'merge': 300, 'final': 300}
+
+def test_short_document_is_summarized_in_one_call(fresh_cache):
+    calls = []
+    summary = summarize_document(["one short chunk", "and another"], recording_summarizer(calls), BUDGETS, ['ns'])
+    assert calls == ['document'] and summary.startswith('document summary')
+
+def test_long_document_reuses_cached_sections(fresh_cache):
+    chunks = [text for text, _ in make_items(120, seed=1)]
+    calls = []
+    summary = summarize_document(chunks, recording_summarizer(calls), BUDGETS, ['ns'], workers=2, tags=['hash-a'])
+    assert summary.startswith('final summary') and 'section' in calls
+    sections = calls.count('section')
+
+    calls.clear()
+    summarize_document(chunks, recording_summarizer(calls), BUDGETS, ['ns'], workers=2, tags=['hash-a'])
+    # Partial summaries come from the cache; only the final summary is asked for again
+    assert calls == ['final']
+
+    # Another namespace (model or prompts) does not share them
+    calls.clear()
+    summarize_document(chunks, recording_summarizer(calls), BUDGETS, ['other'], workers=2)
+    assert calls.count('section') == sections
+
+    # Invalidating the document drops its partial summaries
+    invalidate_summaries('hash-a')
+    calls.clear()
+    summarize_document(chunks, recording_summarizer(calls), BUDGETS, ['ns'], workers=2, tags=['hash-a'])
+    assert calls.count('section') == sections
@@ -0,0 +1,30 @@
+from utils.tokenizer import count_tokens, heuristic_truncate
+
+def test_latin_words():
+    assert count_tokens("the cat sat on the mat") == 6
+    # Long words and numbers split into several tokens
+    assert count_tokens("internationalization") == 4
+    assert count_tokens("1234567") == 3
+
+def test_cjk_counts_every_character():
+    # No spaces: each character is at least one token, never one token per run
+    text = "自然言語処理は人工知能の一分野です"
+    assert count_tokens(text) >= len(text)
+    assert count_tokens(text + "。") == count_tokens(text) + 1
+
+def test_mixed_scripts():
+    assert count_tokens("Привет") == 6
+    # Accented Latin letters count like plain ones
+    assert count_tokens("café") == count_tokens("cafe")
+    assert count_tokens("東京abc") == 3
+
+def test_truncate_latin_keeps_whole_words():
+    assert heuristic_truncate("hello wonderful world", 3) == "hello wonderful"
+    assert heuristic_truncate("hello wonderful world", 2) == "hello"
+    assert heuristic_truncate("hello", 10) == "hello"
+
+def test_truncate_cjk_cuts_inside_a_run():
+    text = "自然言語処理は人工知能の一分野です"
+    truncated = heuristic_truncate(text, 5)
+    assert truncated == text[:5]
+    assert count_tokens(truncated) <= 5
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import zipfile
+import pytest
+from models import db, User, PDF, UploadSession
+from utils import uploads
+from utils.uploads import (UploadError, check_pdf, start_upload, write_part, complete_upload,
+                           import_zip, part_path, discard_upload)
+
+PDF_DATA = b'%PDF-1.4\n' + b'0123456789' * 100
+
+class FailingStream:
+    """Yields some data, then fails like a dropped connection"""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        block = self.data.read(size)
+        if not block:
+            raise OSError('connection reset')
+        return block
+
+@pytest.fixture
+def user(app):
+    user = User(username='reader', email='reader@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def upload(app, user, filename='doc.pdf', data=PDF_DATA, part_size=300):
+    session = start_upload(user.id, filename, len(data), app.config)
+    for part_number, start in enumerate(range(0, len(data), part_size)):
+        assert write_part(session, part_number, io.BytesIO(data[start:start + part_size]), app.config)
+    return session
+
+def received(app, session):
+    with open(part_path(app.config['UPLOAD_FOLDER'], session.id), 'rb') as file:
+        return file.read()
+
+def test_start_upload_checks_name_and_size(app, user):
+    with pytest.raises(UploadError):
+        start_upload(user.id, 'notes.txt', 10, app.config)
+    with pytest.raises(UploadError) as too_large:
+        start_upload(user.id, 'big.pdf', app.config['MAX_UPLOAD_SIZE'] + 1, app.config)
+    assert too_large.value.status_code == 413
+
+def test_parts_are_appended_in_order(app, user):
+    session = upload(app, user)
+    assert session.received_size == len(PDF_DATA) and session.next_part == 4
+    assert received(app, session) == PDF_DATA
+
+def test_resent_part_is_a_no_op_and_gaps_are_refused(app, user):
+    session = start_upload(user.id, 'doc.pdf', len(PDF_DATA), app.config)
+    assert write_part(session, 0, io.BytesIO(PDF_DATA[:300]), app.config)
+    assert not write_part(session, 0, io.BytesIO(b'x' * 300), app.config)
+    with pytest.raises(UploadError) as gap:
+        write_part(session, 2, io.BytesIO(PDF_DATA[600:900]), app.config)
+    assert gap.value.status_code == 409
+    assert session.received_size == 300 and received(app, session) == PDF_DATA[:300]
+
+def test_failed_part_is_cut_off_and_can_be_retried(app, user):
+    session = start_upload(user.id, 'doc.pdf', len(PDF_DATA), app.config)
+    write_part(session, 0, io.BytesIO(PDF_DATA[:300]), app.config)
+    with pytest.raises(OSError):
+        write_part(session, 1, FailingStream(PDF_DATA[300:500]), app.config)
+    assert session.received_size == 300 and session.next_part == 1
+    assert received(app, session) == PDF_DATA[:300]
+    write_part(session, 1, io.BytesIO(PDF_DATA[300:]), app.config)
+    pdfs, archive_path = complete_upload(session, app.config)
+    assert archive_path is None
+    assert pdfs[0].content_hash == hashlib.sha256(PDF_DATA).hexdigest()
+
+def test_oversized_upload_is_refused_part_way(app, user):
+    app.config['MAX_UPLOAD_SIZE'] = 500
+    session = start_upload(user.id, 'doc.pdf', None, app.config)
+    write_part(session, 0, io.BytesIO(PDF_DATA[:300]), app.config)
+    with pytest.raises(UploadError) as too_large:
+        write_part(session, 1, io.BytesIO(PDF_DATA[300:]), app.config)
+    assert too_large.value.status_code == 413
+    assert received(app, session) == PDF_DATA[:300]
+
+def test_complete_hashes_from_disk_when_the_running_hash_is_lost(app, user):
+    session = upload(app, user)
+    # As if the upload had been resumed in another process
+    uploads._forget(session.id)
+    pdfs, _ = complete_upload(session, app.config)
+    db.session.commit()
+    assert pdfs[0].content_hash == hashlib.sha256(PDF_DATA).hexdigest()
+    assert pdfs[0].status == PDF.STATUS_QUEUED
+    with open(pdfs[0].file_path, 'rb') as file:
+        assert file.read() == PDF_DATA
+    assert UploadSession.query.count() == 0
+
+def test_complete_checks_size_and_signature(app, user):
+    session = start_upload(user.id, 'doc.pdf', len(PDF_DATA), app.config)
+    write_part(session, 0, io.BytesIO(PDF_DATA[:300]), app.config)
+    with pytest.raises(UploadError) as short:
+        complete_upload(session, app.config)
+    assert short.value.status_code == 409
+
+    session = upload(app, user, data=b'not a pdf at all')
+    with pytest.raises(UploadError):
+        complete_upload(session, app.config)
+
+def test_discard_removes_session_and_data(app, user):
+    session = upload(app, user)
+    path = part_path(app.config['UPLOAD_FOLDER'], session.id)
+    discard_upload(session, app.config)
+    assert UploadSession.query.count() == 0 and not os.path.exists(path)
+
+def test_check_pdf():
+    check_pdf(io.BytesIO(PDF_DATA))
+    with pytest.raises(UploadError):
+        check_pdf(io.BytesIO(b'<html>'))
+
+def test_import_zip_skips_what_is_not_a_pdf(app, user, tmp_path):
+    zip_path = str(tmp_path / 'docs.zip')
+    with zipfile.ZipFile(zip_path, 'w') as archive:
+        archive.writestr('a.pdf', PDF_DATA)
+        archive.writestr('folder/b.pdf', PDF_DATA + b'b')
+        archive.writestr('fake.pdf', b'not a pdf')
+        archive.writestr('notes.txt', b'text')
+        archive.writestr('__MACOSX/._a.pdf', b'resource fork')
+    pdfs, skipped = import_zip(zip_path, user.id, app.config)
+    assert sorted(pdf.original_filename for pdf in pdfs) == ['a.pdf', 'b.pdf']
+    assert sorted(skipped) == ['fake.pdf', 'notes.txt']
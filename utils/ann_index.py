@@ -0,0 +1,357 @@
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from flask import current_app
+from config import Config
+from models import PDF
+from utils.chunk_store import open_chunks, open_embeddings, content_version
+from utils.embeddings import get_embedder
+
+# Approximate nearest-neighbour search over all chunks of a user's library.
+#
+# IVF (inverted file) index: the embedding space is split into Voronoi cells by
+# k-means centroids and every chunk vector is filed under its nearest centroid.
+# A query is only compared with the vectors of the ANN_NPROBE cells whose
+# centroids are closest to it, instead of every chunk in the library.
+#
+# The centroids are persisted per user (INDEX_FOLDER/users/<id>/ivf.npz); the
+# cells are rebuilt in memory from the stored chunk embeddings on first use and
+# then maintained incrementally as PDFs are added and deleted. Before a library
+# is large enough to train on, the index has a single cell (exact search).
+#
+# Entries are (PDF id, chunk number), so each PDF's entries are tied to the
+# version of its chunks and embeddings they were read from; a re-chunked PDF
+# is removed and added again. PDFs without embeddings yet are skipped (their
+# embeddings are computed in the background) and looked at again once the
+# files change or EMBED_RETRY_SECONDS have passed.
+IVF_FILE = 'ivf.npz'
+
+# Vectors sampled per centroid when training
+TRAIN_SAMPLE_PER_LIST = 64
+
+def kmeans(vectors, num_clusters, iterations=10, seed=0):
+    """
+    Spherical k-means on L2-normalized vectors
+
+    Returns:
+        ndarray: (num_clusters, dim) normalized centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        # Re-seed empty clusters with random vectors
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+class IVFIndex:
+    """
+    In-memory IVF-Flat index of (key, row) -> vector entries, where key identifies a PDF
+
+    Not thread-safe on its own; LibraryIndex serializes access.
+    """
+
+    def __init__(self, dim, centroids=None):
+        self.dim = dim
+        self.centroids = centroids
+        self.trained_size = 0
+        self._reset_lists()
+
+    def _reset_lists(self):
+        num_lists = 1 if self.centroids is None else len(self.centroids)
+        # Each cell holds blocks of (vectors, keys, rows), consolidated on search
+        self._lists = [[] for _ in range(num_lists)]
+        self.size = 0
+
+    @property
+    def num_lists(self):
+        return len(self._lists)
+
+    def _assign(self, vectors):
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def add(self, key, vectors):
+        """File the rows of vectors under their nearest centroids"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        assignment = self._assign(vectors)
+        rows = np.arange(len(vectors), dtype=np.int32)
+        for cell in np.unique(assignment):
+            mask = assignment == cell
+            self._lists[cell].append((vectors[mask], np.full(int(mask.sum()), key, dtype=np.int64), rows[mask]))
+        self.size += len(vectors)
+
+    def remove(self, key):
+        """Drop every entry of key"""
+        for cell, blocks in enumerate(self._lists):
+            kept = []
+            for vectors, keys, rows in blocks:
+                mask = keys != key
+                if mask.all():
+                    kept.append((vectors, keys, rows))
+                elif mask.any():
+                    kept.append((vectors[mask], keys[mask], rows[mask]))
+                self.size -= int((~mask).sum())
+            self._lists[cell] = kept
+
+    def _cell(self, cell):
+        blocks = self._lists[cell]
+        if len(blocks) > 1:
+            blocks[:] = [tuple(np.concatenate(parts) for parts in zip(*blocks))]
+        return blocks[0] if blocks else None
+
+    def entries(self):
+        """Return every (vectors, keys, rows) block"""
+        return [self._cell(cell) for cell in range(self.num_lists) if self._lists[cell]]
+
+    def train(self, num_lists, seed=0):
+        """Learn num_lists centroids from the indexed vectors and re-file every entry"""
+        blocks = self.entries()
+        if not blocks:
+            return
+        vectors, keys, rows = (np.concatenate(parts) for parts in zip(*blocks))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), num_lists * TRAIN_SAMPLE_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        self.centroids = kmeans(sample, min(num_lists, sample_size), seed=seed)
+        self.trained_size = len(vectors)
+
+        self._reset_lists()
+        assignment = self._assign(vectors)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.num_lists + 1))
+        for cell in range(self.num_lists):
+            selected = order[bounds[cell]:bounds[cell + 1]]
+            if len(selected):
+                self._lists[cell].append((vectors[selected], keys[selected], rows[selected]))
+        self.size = len(vectors)
+
+    def search(self, query_vector, k, nprobe):
+        """
+        Find approximately the k entries most similar to query_vector
+
+        Returns:
+            list: (score, key, row) tuples, best first
+        """
+        if self.centroids is None:
+            cells = [0]
+        else:
+            nprobe = min(nprobe, self.num_lists)
+            cells = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+
+        scores, keys, rows = [], [], []
+        for cell in cells:
+            block = self._cell(cell)
+            if block is None:
+                continue
+            scores.append(block[0] @ query_vector)
+            keys.append(block[1])
+            rows.append(block[2])
+        if not scores:
+            return []
+
+        scores, keys, rows = np.concatenate(scores), np.concatenate(keys), np.concatenate(rows)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(float(scores[i]), int(keys[i]), int(rows[i])) for i in best]
+
+def num_lists_for(size):
+    """
+    Number of IVF cells for a library of size vectors (about sqrt(size))
+    """
+    return max(1, min(Config.ANN_MAX_LISTS, int(np.sqrt(size))))
+
+class LibraryIndex:
+    """
+    IVF index over every ready PDF of one user, keyed by PDF id
+    """
+
+    def __init__(self, user_id, directory, embedder_name):
+        self.user_id = user_id
+        self.directory = directory
+        self.embedder_name = embedder_name
+        self.pdf_ids = set()
+        self.versions = {}  # pdf id -> content version its entries were read from
+        self.unavailable = {}  # pdf id -> (content version, time) of the last failed add
+        self.lock = threading.Lock()
+        self.index = None
+        self._load_centroids()
+
+    def _load_centroids(self):
+        path = os.path.join(self.directory, IVF_FILE)
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            # Centroids from another embedder live in a different vector space
+            if str(data['embedder']) != self.embedder_name:
+                return
+            self.index = IVFIndex(data['centroids'].shape[1], data['centroids'])
+            self.index.trained_size = int(data['trained_size'])
+
+    def _save_centroids(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, IVF_FILE)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as ivf_file:
+            np.savez(ivf_file, centroids=self.index.centroids,
+                     trained_size=self.index.trained_size, embedder=self.embedder_name)
+        os.replace(temp_path, path)
+
+    def _add(self, pdf_id, content_hash):
+        version = content_version(content_hash)
+        chunk_set = open_chunks(content_hash)
+        matrix = open_embeddings(chunk_set, self.embedder_name) if chunk_set is not None else None
+        if matrix is None:
+            self.unavailable[pdf_id] = (version, time.monotonic())
+            return False
+        if self.index is None:
+            self.index = IVFIndex(matrix.shape[1])
+        self.index.add(pdf_id, matrix)
+        self.pdf_ids.add(pdf_id)
+        self.versions[pdf_id] = version
+        self.unavailable.pop(pdf_id, None)
+        return True
+
+    def _remove(self, pdf_id):
+        self.index.remove(pdf_id)
+        self.pdf_ids.discard(pdf_id)
+        self.versions.pop(pdf_id, None)
+
+    def _recently_unavailable(self, pdf_id, version):
+        failed = self.unavailable.get(pdf_id)
+        return (failed is not None and failed[0] == version
+                and time.monotonic() - failed[1] < Config.EMBED_RETRY_SECONDS)
+
+    def _maybe_train(self):
+        # Train once the library is big enough, and again whenever it has grown 4x
+        size = self.index.size if self.index is not None else 0
+        if size < Config.ANN_MIN_TRAIN_SIZE or (self.index.trained_size and size < 4 * self.index.trained_size):
+            return
+        self.index.train(num_lists_for(size))
+        self._save_centroids()
+
+    def add_pdf(self, pdf_id, content_hash):
+        with self.lock:
+            if pdf_id not in self.pdf_ids and self._add(pdf_id, content_hash):
+                self._maybe_train()
+
+    def remove_pdf(self, pdf_id):
+        with self.lock:
+            self.unavailable.pop(pdf_id, None)
+            if pdf_id in self.pdf_ids:
+                self._remove(pdf_id)
+
+    def sync(self, pdfs):
+        """
+        Bring the index in line with the user's ready PDFs: [(pdf_id, content_hash)]
+
+        Catches changes made by other processes since this index was loaded,
+        including re-chunked PDFs.
+        """
+        with self.lock:
+            current = dict(pdfs)
+            versions = {pdf_id: content_version(content_hash) for pdf_id, content_hash in current.items()}
+            for pdf_id in list(self.pdf_ids):
+                if pdf_id not in current or self.versions.get(pdf_id) != versions[pdf_id]:
+                    self._remove(pdf_id)
+            for pdf_id in list(self.unavailable):
+                if pdf_id not in current:
+                    del self.unavailable[pdf_id]
+            added = False
+            for pdf_id, content_hash in current.items():
+                if pdf_id not in self.pdf_ids and not self._recently_unavailable(pdf_id, versions[pdf_id]):
+                    added = self._add(pdf_id, content_hash) or added
+            if added:
+                self._maybe_train()
+
+    def search(self, query_vector, k, nprobe=None):
+        with self.lock:
+            if self.index is None:
+                return []
+            return self.index.search(query_vector, k, nprobe or Config.ANN_NPROBE)
+
+# Loaded library indexes by user id
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+def library_dir(user_id, index_folder=None):
+    index_folder = index_folder or current_app.config['INDEX_FOLDER']
+    return os.path.join(index_folder, 'users', str(user_id))
+
+def get_library(user_id, index_folder=None):
+    """
+    Return the library index of a user, loading it on first use
+    """
+    embedder_name = Config.EMBEDDER
+    with _libraries_lock:
+        library = _libraries.get(user_id)
+        if library is None or library.embedder_name != embedder_name:
+            library = _libraries[user_id] = LibraryIndex(user_id, library_dir(user_id, index_folder),
+                                                         embedder_name)
+    return library
+
+def ready_pdfs(user_id):
+    return PDF.query.with_entities(PDF.id, PDF.content_hash).filter(
+        PDF.user_id == user_id, PDF.status == PDF.STATUS_READY, PDF.content_hash.isnot(None)
+    ).all()
+
+def search_library(user_id, query, k, index_folder=None):
+    """
+    Find the chunks of a user's whole library most similar to a query
+
+    Args:
+        user_id (int): Owner of the library
+        query (str): The user's message
+        k (int): Number of chunks to return
+        index_folder (str, optional): Root of the index store. Defaults to the app's INDEX_FOLDER.
+
+    Returns:
+        list: (score, pdf_id, chunk number) tuples, best first
+    """
+    library = get_library(user_id, index_folder)
+    library.sync(ready_pdfs(user_id))
+    query_vector = get_embedder(library.embedder_name).embed([query])[0]
+    return library.search(query_vector, k)
+
+def library_add_pdf(pdf):
+    """
+    Add a newly processed PDF to its owner's library index, if that index is loaded
+    """
+    with _libraries_lock:
+        library = _libraries.get(pdf.user_id)
+    if library is not None and pdf.content_hash:
+        try:
+            library.add_pdf(pdf.id, pdf.content_hash)
+        except Exception as e:
+            print(f"Error adding PDF {pdf.id} to the library index: {e}")
+
+def library_remove_pdf(pdf):
+    """
+    Remove a deleted PDF from its owner's library index, if that index is loaded
+    """
+    with _libraries_lock:
+        library = _libraries.get(pdf.user_id)
+    if library is not None:
+        library.remove_pdf(pdf.id)
+
+def drop_library(user_id, index_folder=None):
+    """
+    Forget a user's library index, e.g. when the user is deleted
+    """
+    with _libraries_lock:
+        _libraries.pop(user_id, None)
+    shutil.rmtree(library_dir(user_id, index_folder), ignore_errors=True)
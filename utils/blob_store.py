@@ -0,0 +1,80 @@
+import hashlib
+import os
+import tempfile
+from models import PDF
+
+# Uploads are stored once per distinct file content:
+#   <UPLOAD_FOLDER>/<h[0:2]>/<h[2:4]>/<sha256>.pdf
+# Incoming data is written to a temporary file first and hashed on the way in.
+INCOMING_DIR = '.incoming'
+BLOCK_SIZE = 1024 * 1024
+
+def file_sha256(file_path, block_size=BLOCK_SIZE):
+    """
+    Compute the SHA-256 hex digest of a file without loading it into memory
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def blob_path(upload_folder, content_hash):
+    """
+    Return the sharded storage path of a blob
+    """
+    return os.path.join(upload_folder, content_hash[:2], content_hash[2:4], f"{content_hash}.pdf")
+
+def save_blob(stream, upload_folder):
+    """
+    Stream an upload to content-addressed storage
+
+    Args:
+        stream (file-like): Readable binary stream of the upload
+        upload_folder (str): Root of the blob store
+
+    Returns:
+        tuple: (content_hash, file_path). An identical file that is already stored is reused.
+    """
+    incoming = os.path.join(upload_folder, INCOMING_DIR)
+    os.makedirs(incoming, exist_ok=True)
+
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=incoming, delete=False) as temp:
+        for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+            digest.update(block)
+            temp.write(block)
+
+    return store_file(temp.name, digest.hexdigest(), upload_folder)
+
+def store_file(temp_path, content_hash, upload_folder):
+    """
+    Move an already hashed file into the blob store, discarding it if the blob exists
+
+    Returns:
+        tuple: (content_hash, file_path)
+    """
+    file_path = blob_path(upload_folder, content_hash)
+    if os.path.exists(file_path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(temp_path, file_path)
+    return content_hash, file_path
+
+def release_blob(pdf):
+    """
+    Remove a deleted PDF's file once no other PDF references the same content
+
+    Call after the deletion of the PDF row has been committed.
+
+    Returns:
+        bool: True if this was the last reference to the content
+    """
+    if not PDF.query.filter_by(file_path=pdf.file_path).count():
+        try:
+            os.remove(pdf.file_path)
+        except OSError:
+            pass
+
+    return not (pdf.content_hash and PDF.query.filter_by(content_hash=pdf.content_hash).count())
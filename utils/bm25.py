@@ -0,0 +1,246 @@
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+import numpy as np
+
+# BM25 inverted index over the chunks of one file content, stored next to the
+# chunks as bm25.npz in CSR layout:
+#   terms        sorted vocabulary
+#   indptr       postings of terms[i] are entries indptr[i]:indptr[i + 1]
+#   doc_ids      chunk number of each posting (ascending within a term)
+#   tfs          term frequency of each posting
+#   doc_lengths  number of indexed tokens per chunk
+# A query only touches the postings of its own terms, and several indexes (the
+# PDFs of a chat) are searched as one corpus with merged document frequencies.
+INDEX_FILE = 'bm25.npz'
+
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.5
+B = 0.75
+
+# Longer "words" are almost always extraction noise (hashes, run-together text)
+MAX_TERM_LENGTH = 40
+
+_TOKEN = re.compile(r'\w+')
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further
+had has have having he her here hers herself him himself his how i if in into is it its itself
+just me more most my myself no nor not now of off on once only or other our ours ourselves out
+over own same she should so some such than that the their theirs them themselves then there
+these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms, without stopwords
+    """
+    return [token for token in _TOKEN.findall(text.lower())
+            if token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH]
+
+class IndexBuilder:
+    """
+    Collects postings chunk by chunk; chunk numbers are assigned in the order added
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._doc_lengths = array('i')
+
+    def add(self, text):
+        doc_id = len(self._doc_lengths)
+        counts = Counter(tokenize(text))
+        self._doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('i'), array('i'))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+
+    def arrays(self):
+        """Return the index as the CSR arrays stored in INDEX_FILE"""
+        terms = sorted(self._postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, tfs = array('i'), array('i')
+        for i, term in enumerate(terms):
+            term_docs, term_tfs = self._postings[term]
+            doc_ids.extend(term_docs)
+            tfs.extend(term_tfs)
+            indptr[i + 1] = len(doc_ids)
+        return {
+            'terms': np.array(terms, dtype=str),
+            'indptr': indptr,
+            'doc_ids': np.frombuffer(doc_ids, dtype=np.int32) if doc_ids else np.zeros(0, np.int32),
+            'tfs': np.frombuffer(tfs, dtype=np.int32) if tfs else np.zeros(0, np.int32),
+            'doc_lengths': np.frombuffer(self._doc_lengths, dtype=np.int32)
+                           if self._doc_lengths else np.zeros(0, np.int32),
+        }
+
+    def build(self):
+        return InvertedIndex(**self.arrays())
+
+    def save(self, directory):
+        """Write the index to directory, replacing any previous one atomically"""
+        path = os.path.join(directory, INDEX_FILE)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as index_file:
+            np.savez(index_file, **self.arrays())
+        os.replace(temp_path, path)
+
+class InvertedIndex:
+    """
+    In-memory BM25 index of one chunk set
+    """
+
+    def __init__(self, terms, indptr, doc_ids, tfs, doc_lengths):
+        self.terms = terms
+        self.vocabulary = {str(term): i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.total_length = int(doc_lengths.sum())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    @classmethod
+    def from_texts(cls, texts):
+        builder = IndexBuilder()
+        for text in texts:
+            builder.add(text)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def postings(self, term):
+        """Return (doc_ids, tfs) of a term, or None if it does not occur"""
+        i = self.vocabulary.get(term)
+        if i is None:
+            return None
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.doc_ids[start:stop], self.tfs[start:stop]
+
+    def df(self, term):
+        i = self.vocabulary.get(term)
+        return 0 if i is None else int(self.indptr[i + 1] - self.indptr[i])
+
+def merge_arrays(indexes):
+    """
+    Concatenate several indexes into the CSR arrays of one index
+
+    Chunk numbers of indexes[n] are offset by the chunks of the indexes before it.
+    Vectorized: postings are re-labelled with merged term numbers and stably
+    sorted by term, which keeps chunk numbers ascending within each term.
+    """
+    if not indexes:
+        return IndexBuilder().arrays()
+    terms = np.unique(np.concatenate([index.terms for index in indexes]))
+    term_rows, doc_ids, tfs = [], [], []
+    offset = 0
+    for index in indexes:
+        term_rows.append(np.repeat(np.searchsorted(terms, index.terms), np.diff(index.indptr)))
+        doc_ids.append(index.doc_ids.astype(np.int32) + offset)
+        tfs.append(index.tfs)
+        offset += len(index)
+    term_rows = np.concatenate(term_rows)
+    order = np.argsort(term_rows, kind='stable')
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_rows, minlength=len(terms)), out=indptr[1:])
+    return {
+        'terms': terms,
+        'indptr': indptr,
+        'doc_ids': np.concatenate(doc_ids)[order],
+        'tfs': np.concatenate(tfs).astype(np.int32)[order],
+        'doc_lengths': np.concatenate([index.doc_lengths for index in indexes]).astype(np.int32),
+    }
+
+def drop_range(index, start, stop):
+    """
+    Return the CSR arrays of index without chunks start..stop-1
+
+    Later chunk numbers shift down to close the gap; terms left without
+    postings are dropped.
+    """
+    term_rows = np.repeat(np.arange(len(index.terms)), np.diff(index.indptr))
+    keep = (index.doc_ids < start) | (index.doc_ids >= stop)
+    doc_ids = index.doc_ids[keep]
+    doc_ids = np.where(doc_ids >= stop, doc_ids - (stop - start), doc_ids).astype(np.int32)
+    counts = np.bincount(term_rows[keep], minlength=len(index.terms))
+    used = counts > 0
+    indptr = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+    np.cumsum(counts[used], out=indptr[1:])
+    return {
+        'terms': index.terms[used],
+        'indptr': indptr,
+        'doc_ids': doc_ids,
+        'tfs': index.tfs[keep],
+        'doc_lengths': np.concatenate([index.doc_lengths[:start], index.doc_lengths[stop:]]),
+    }
+
+def idf(df, num_docs):
+    return math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+def search(query, indexes, top_k=10):
+    """
+    Score the chunks of several indexes against a query with BM25, as one corpus
+
+    Args:
+        query (str): The query text
+        indexes (list): InvertedIndex objects searched together
+        top_k (int, optional): Number of results. Defaults to 10.
+
+    Returns:
+        list: (score, index number, chunk number) tuples, best first
+              (document order among equal scores). Chunks without a query term are left out.
+    """
+    num_docs = sum(len(index) for index in indexes)
+    if not num_docs:
+        return []
+    avg_length = max(sum(index.total_length for index in indexes) / num_docs, 1)
+
+    matches = [[] for _ in indexes]
+    for term in set(tokenize(query)):
+        df = sum(index.df(term) for index in indexes)
+        if not df:
+            continue
+        term_idf = idf(df, num_docs)
+        for n, index in enumerate(indexes):
+            postings = index.postings(term)
+            if postings is None:
+                continue
+            doc_ids, tfs = postings
+            norm = K1 * (1 - B + B * index.doc_lengths[doc_ids] / avg_length)
+            matches[n].append((doc_ids, term_idf * tfs * (K1 + 1) / (tfs + norm)))
+
+    index_numbers, doc_ids, scores = [], [], []
+    for n, parts in enumerate(matches):
+        if not parts:
+            continue
+        # Sum the per-term contributions of every chunk into a dense score row
+        row = np.bincount(np.concatenate([part[0] for part in parts]),
+                          weights=np.concatenate([part[1] for part in parts]), minlength=len(indexes[n]))
+        matched = np.flatnonzero(row)
+        index_numbers.append(np.full(len(matched), n))
+        doc_ids.append(matched)
+        scores.append(row[matched])
+    if not scores:
+        return []
+
+    index_numbers, doc_ids, scores = (np.concatenate(parts) for parts in (index_numbers, doc_ids, scores))
+    if len(scores) > top_k:
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        best = np.arange(len(scores))
+    # Best first; ties in (index, chunk) order
+    best = best[np.lexsort((best, -scores[best]))]
+    return [(float(scores[i]), int(index_numbers[i]), int(doc_ids[i])) for i in best]
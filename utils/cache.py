@@ -0,0 +1,281 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Small caching toolkit: an in-process LRU bounded by bytes, an optional
+# SQLite tier shared by every process on the host, and a two-tier front.
+# Values must be JSON-serializable. Entries carry tags (e.g. content hashes)
+# so everything derived from a document can be dropped at once. Both tiers can
+# expire entries after a time to live (ttl, seconds; None keeps them).
+
+def json_size(value):
+    """
+    Approximate memory cost of a value: the length of its JSON encoding
+    """
+    return len(json.dumps(value, separators=(',', ':')))
+
+class CacheStats:
+    """
+    Hit/miss/eviction counters of one cache
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache holding at most max_bytes of values
+    """
+
+    def __init__(self, max_bytes, sizeof=json_size, ttl=None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size, tags, expiry time or None)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] is not None and entry[3] <= time.time():
+                # Expired
+                del self._entries[key]
+                self.bytes -= entry[1]
+                self.stats.evictions += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, key, value, tags=()):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            expiry = time.time() + self.ttl if self.ttl else None
+            self._entries[key] = (value, size, frozenset(tags), expiry)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def invalidate(self, tag):
+        """Drop every entry carrying tag"""
+        with self._lock:
+            keys = [key for key, (_, _, tags, _) in self._entries.items() if tag in tags]
+            for key in keys:
+                self.bytes -= self._entries.pop(key)[1]
+            self.stats.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        return {**self.stats.as_dict(), 'entries': len(self._entries), 'bytes': self.bytes,
+                'max_bytes': self.max_bytes}
+
+class SQLiteCache:
+    """
+    Cache table in a SQLite file, shared by every process that opens the same path
+
+    With max_bytes, the oldest entries are deleted once the stored values
+    exceed it; the size is checked every EVICT_EVERY writes, so the table can
+    briefly run over.
+    """
+    EVICT_EVERY = 64
+
+    def __init__(self, path, table='cache', ttl=None, max_bytes=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, tags TEXT NOT NULL, "
+                               "created_at REAL NOT NULL)")
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {table}_tags ("
+                               "tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_created ON {table} (created_at)")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections must not be shared across threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key, default=None):
+        try:
+            row = self._connect().execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?",
+                                          (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading cache {self.path}: {e}")
+            row = None
+        if row is not None and self.ttl and row[1] + self.ttl <= time.time():
+            # Expired; deleted by the next eviction pass
+            row = None
+        if row is None:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value, tags=()):
+        try:
+            with self._connect() as connection:
+                connection.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                                   (key, json.dumps(value), json.dumps(sorted(tags)), time.time()))
+                connection.executemany(f"INSERT OR IGNORE INTO {self.table}_tags VALUES (?, ?)",
+                                       [(tag, key) for tag in tags])
+        except sqlite3.Error as e:
+            print(f"Error writing cache {self.path}: {e}")
+            return
+        self._writes += 1
+        if (self.ttl or self.max_bytes) and self._writes % self.EVICT_EVERY == 1:
+            self.evict()
+
+    def evict(self):
+        """Delete expired entries, then the oldest ones while the values exceed max_bytes"""
+        try:
+            with self._connect() as connection:
+                keys = []
+                if self.ttl:
+                    keys += [row[0] for row in connection.execute(
+                        f"SELECT key FROM {self.table} WHERE created_at <= ?", (time.time() - self.ttl,))]
+                if self.max_bytes:
+                    expired = set(keys)
+                    excess = (connection.execute(
+                        f"SELECT COALESCE(SUM(length(value)), 0) FROM {self.table}").fetchone()[0]
+                        - self.max_bytes)
+                    rows = connection.execute(f"SELECT key, length(value) FROM {self.table} ORDER BY created_at")
+                    for key, size in rows:
+                        if excess <= 0:
+                            break
+                        if key not in expired:
+                            keys.append(key)
+                        excess -= size
+                connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in keys])
+                connection.executemany(f"DELETE FROM {self.table}_tags WHERE key = ?", [(key,) for key in keys])
+            self.stats.evictions += len(keys)
+        except sqlite3.Error as e:
+            print(f"Error evicting from cache {self.path}: {e}")
+
+    def invalidate(self, tag):
+        """Drop every entry carrying tag"""
+        try:
+            with self._connect() as connection:
+                keys = [row[0] for row in connection.execute(
+                    f"SELECT key FROM {self.table}_tags WHERE tag = ?", (tag,))]
+                connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in keys])
+                connection.executemany(f"DELETE FROM {self.table}_tags WHERE key = ?", [(key,) for key in keys])
+            self.stats.invalidations += len(keys)
+        except sqlite3.Error as e:
+            print(f"Error invalidating cache {self.path}: {e}")
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute(f"DELETE FROM {self.table}")
+            connection.execute(f"DELETE FROM {self.table}_tags")
+
+    def info(self):
+        try:
+            entries = self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {**self.stats.as_dict(), 'entries': entries, 'path': self.path, 'max_bytes': self.max_bytes}
+
+class TieredCache:
+    """
+    In-process LRU in front of an optional shared SQLite cache
+
+    Shared hits are copied into the LRU.
+    """
+
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+        self.stats = CacheStats()
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                # The tags are not needed to serve the entry, only to invalidate it
+                self.memory.put(key, value, self.shared_tags(key))
+        if value is None:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        return value
+
+    def shared_tags(self, key):
+        try:
+            row = self.shared._connect().execute(
+                f"SELECT tags FROM {self.shared.table} WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return ()
+        return json.loads(row[0]) if row else ()
+
+    def put(self, key, value, tags=()):
+        self.memory.put(key, value, tags)
+        if self.shared is not None:
+            self.shared.put(key, value, tags)
+
+    def invalidate(self, tag):
+        self.memory.invalidate(tag)
+        if self.shared is not None:
+            self.shared.invalidate(tag)
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def info(self):
+        info = {**self.stats.as_dict(), 'memory': self.memory.info()}
+        if self.shared is not None:
+            info['shared'] = self.shared.info()
+        return info
@@ -0,0 +1,541 @@
+import logging
+import mmap
+import os
+import shutil
+import threading
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from flask import current_app
+from config import Config
+from models import db
+from utils.blob_store import file_sha256
+from utils.bm25 import INDEX_FILE, IndexBuilder, InvertedIndex
+from utils.embeddings import EMBEDDINGS_FILE, get_embedder, write_embeddings, read_embeddings_stamp
+from utils.pdf_processor import iter_pages, iter_segments, iter_chunks
+from utils.retrieval_cache import invalidate_content
+from utils.llm_cache import invalidate_responses
+from utils.summarizer import invalidate_summaries
+from utils.tokenizer import get_tokenizer
+
+# Chunks are keyed by the SHA-256 of the file content, so every PDF row that
+# references the same blob shares a single processed copy. Each content gets
+# a directory under INDEX_FOLDER holding:
+#   pages.txt / pages.npy    raw text of every page, as extracted from the PDF
+#   chunks.txt / chunks.npy  chunks built from the pages
+#   chunks.stamp             the chunking parameters the chunks were built with
+#   bm25.npz                 inverted index of the chunks (see utils.bm25)
+#   embeddings.npy / .stamp  chunk embeddings (see utils.embeddings)
+# A .txt file holds the record texts as UTF-8, back to back; the matching .npy
+# holds one (offset, length, page, tokens) record per entry, where tokens is
+# precomputed for chunks so prompts can be packed against a token budget. Both are memory-mapped on
+# read, so a request only decodes the records it uses. Changing the chunking
+# parameters rebuilds chunks from pages.txt without touching the PDF again.
+PAGES = 'pages'
+CHUNKS = 'chunks'
+STAMP_FILE = 'chunks.stamp'
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('length', '<i4'), ('page', '<i4'), ('tokens', '<i4')])
+
+# Bump when the chunking algorithm or record format changes, to force a rebuild
+CHUNK_FORMAT_VERSION = 3
+
+logger = logging.getLogger(__name__)
+
+def content_dir(content_hash, index_folder=None):
+    """
+    Return the directory holding the processed data of a file content
+    """
+    index_folder = index_folder or current_app.config['INDEX_FOLDER']
+    return os.path.join(index_folder, content_hash[:2], content_hash)
+
+def chunk_params(config):
+    """
+    Return the chunking parameters selected by the application config
+
+    The overlap is clamped to at most half the chunk size: with an overlap
+    close to CHUNK_SIZE every chunk would repeat nearly all of the previous one.
+    """
+    max_chunk_size = config['CHUNK_SIZE']
+    return {
+        'max_chunk_size': max_chunk_size,
+        'overlap': max(0, min(config['CHUNK_OVERLAP'], max_chunk_size // 2)),
+        'segmenter': config['SENTENCE_SEGMENTER'],
+        'tokenizer': config['TOKENIZER'],
+        'embedder': config['EMBEDDER'],
+    }
+
+def chunk_stamp(params):
+    """
+    Return the version stamp identifying chunks built with params
+    """
+    return (f"v{CHUNK_FORMAT_VERSION}:size={params['max_chunk_size']}"
+            f":overlap={params['overlap']}:segmenter={params['segmenter']}"
+            f":tokenizer={params['tokenizer']}")
+
+class RecordWriter:
+    """
+    Streams (text, page) records to <name>.txt / <name>.npy in a content directory
+
+    Files are written under temporary names and only moved into place by close().
+    Token counts are only computed when a tokenizer name is given.
+    """
+
+    def __init__(self, directory, name, tokenizer=None):
+        os.makedirs(directory, exist_ok=True)
+        self.text_path = os.path.join(directory, name + '.txt')
+        self.index_path = os.path.join(directory, name + '.npy')
+        # Unique temporary names: two uploads of the same file may be processed at once
+        self.suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        self._text_file = open(self.text_path + self.suffix, 'wb')
+        self._tokenizer = get_tokenizer(tokenizer) if tokenizer else None
+        self._offsets, self._lengths, self._pages, self._tokens = array('q'), array('i'), array('i'), array('i')
+        self._offset = 0
+
+    def add(self, text, page):
+        data = text.encode('utf-8')
+        self._text_file.write(data)
+        self._offsets.append(self._offset)
+        self._lengths.append(len(data))
+        self._pages.append(page or 0)
+        self._tokens.append(self._tokenizer.count(text) if self._tokenizer else 0)
+        self._offset += len(data)
+
+    def close(self):
+        """Publish the records and return how many were written"""
+        self._text_file.close()
+        index = np.zeros(len(self._offsets), dtype=INDEX_DTYPE)
+        index['offset'] = self._offsets
+        index['length'] = self._lengths
+        index['page'] = self._pages
+        index['tokens'] = self._tokens
+        with open(self.index_path + self.suffix, 'wb') as index_file:
+            np.save(index_file, index)
+
+        # The index is moved last: its presence marks a complete record set
+        os.replace(self.text_path + self.suffix, self.text_path)
+        os.replace(self.index_path + self.suffix, self.index_path)
+        return len(index)
+
+    def abort(self):
+        self._text_file.close()
+        for path in (self.text_path + self.suffix, self.index_path + self.suffix):
+            if os.path.exists(path):
+                os.remove(path)
+
+def _write_chunks(directory, pages, params):
+    """
+    Chunk (page_number, text) pages into the chunk record set and stamp it
+
+    Returns:
+        int: Number of chunks written
+    """
+    writer = RecordWriter(directory, CHUNKS, params['tokenizer'])
+    index_builder = IndexBuilder()
+    try:
+        segments = iter_segments(pages, params['segmenter'])
+        for text, page in iter_chunks(segments, params['max_chunk_size'], params['overlap']):
+            writer.add(text, page)
+            index_builder.add(text)
+    except Exception:
+        writer.abort()
+        raise
+    count = writer.close()
+    index_builder.save(directory)
+    write_stamp(directory, params)
+    embed_chunks(directory, params['embedder'])
+    return count
+
+def build_chunks(file_path, directory, workers, params):
+    """
+    Extract, cache and chunk a PDF file. Touches no database state, so it can run in a worker process
+
+    Page texts are recorded as they stream past, so the chunks can later be
+    rebuilt without re-parsing the PDF.
+
+    Returns:
+        int: Number of chunks stored (nothing is stored when no text could be extracted)
+    """
+    page_writer = RecordWriter(directory, PAGES)
+
+    def recorded_pages():
+        for page_number, text in iter_pages(file_path, workers):
+            page_writer.add(text, page_number)
+            yield page_number, text
+
+    chunk_writer = RecordWriter(directory, CHUNKS, params['tokenizer'])
+    index_builder = IndexBuilder()
+    try:
+        segments = iter_segments(recorded_pages(), params['segmenter'])
+        for text, page in iter_chunks(segments, params['max_chunk_size'], params['overlap']):
+            chunk_writer.add(text, page)
+            index_builder.add(text)
+    except Exception:
+        page_writer.abort()
+        chunk_writer.abort()
+        raise
+
+    # Pages are published before chunks, so a complete chunk set always has its pages
+    page_writer.close()
+    count = chunk_writer.close()
+    index_builder.save(directory)
+    write_stamp(directory, params)
+
+    if not count:
+        shutil.rmtree(directory, ignore_errors=True)
+    else:
+        embed_chunks(directory, params['embedder'])
+    return count
+
+def embed_chunks(directory, embedder_name):
+    """
+    Compute the embeddings of a content's chunks in batches
+
+    A failing embedder (e.g. the Ollama server is down) does not fail ingestion:
+    retrieval falls back to BM25 and the embeddings are queued again when a
+    search finds them missing (see queue_embeddings).
+
+    Returns:
+        bool: True if the embeddings were stored
+    """
+    try:
+        chunk_set = RecordSet(directory)
+        if not len(chunk_set):
+            return False
+        texts = (chunk_set.text(i) for i in range(len(chunk_set)))
+        write_embeddings(directory, texts, len(chunk_set), get_embedder(embedder_name))
+        return True
+    except Exception as e:
+        logger.warning("Error embedding chunks in %s: %s", directory, e)
+        return False
+
+def rechunk(directory, params, file_path=None):
+    """
+    Rebuild the chunks of a content directory with new parameters
+
+    Uses the cached page texts; only content processed before pages were cached
+    falls back to re-extracting file_path. Safe to run in a worker process.
+
+    Returns:
+        int: Number of chunks written
+    """
+    if os.path.exists(os.path.join(directory, PAGES + '.npy')):
+        return _write_chunks(directory, RecordSet(directory, PAGES).records(), params)
+    return build_chunks(file_path, directory, 1, params)
+
+def write_stamp(directory, params):
+    """
+    Record the parameters the chunks of a content directory were built with
+    """
+    with open(os.path.join(directory, STAMP_FILE), 'w') as stamp_file:
+        stamp_file.write(chunk_stamp(params))
+
+def read_stamp(directory):
+    """
+    Return the chunk stamp of a content directory ('' when missing)
+    """
+    try:
+        with open(os.path.join(directory, STAMP_FILE)) as stamp_file:
+            return stamp_file.read().strip()
+    except OSError:
+        return ''
+
+class RecordSet:
+    """
+    Read-only, memory-mapped view of one record set (chunks or pages) of a file content
+    """
+
+    def __init__(self, directory, name=CHUNKS):
+        self.directory = directory
+        # Content directories are named after the content hash
+        self.content_hash = os.path.basename(os.path.normpath(directory))
+        index_path = os.path.join(directory, name + '.npy')
+        # Changes whenever the records are rebuilt, e.g. by re-chunking
+        self.version = os.stat(index_path).st_mtime_ns
+        self.index = np.load(index_path, mmap_mode='r')
+        with open(os.path.join(directory, name + '.txt'), 'rb') as text_file:
+            if os.fstat(text_file.fileno()).st_size:
+                self._buffer = mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = b''
+        self._view = memoryview(self._buffer)
+
+    def __len__(self):
+        return len(self.index)
+
+    def text(self, i):
+        """Decode record i, slicing it out of the mapped blob without copying the rest"""
+        entry = self.index[i]
+        offset = entry['offset']
+        return str(self._view[offset:offset + entry['length']], 'utf-8')
+
+    def tokens(self, i):
+        """Return the precomputed token count of record i"""
+        if 'tokens' not in self.index.dtype.names:
+            # Written before token counts were stored; rebuilt by the re-chunk job
+            return get_tokenizer().count(self.text(i))
+        return int(self.index['tokens'][i])
+
+    def texts(self):
+        """Decode every record in document order"""
+        return [self.text(i) for i in range(len(self))]
+
+    def records(self):
+        """Lazily yield (page, text) for every record in document order"""
+        for i, page in enumerate(self.index['page']):
+            yield int(page), self.text(i)
+
+    def handle(self, i):
+        """Return a lightweight handle to record i"""
+        return ChunkHandle(self, i, int(self.index['page'][i]))
+
+    def handles(self):
+        """Return a lightweight handle per record in document order"""
+        return [ChunkHandle(self, i, int(page)) for i, page in enumerate(self.index['page'])]
+
+class ChunkHandle(namedtuple('ChunkHandle', ['chunk_set', 'index', 'page'])):
+    """
+    Reference to one stored chunk; the text is only decoded when accessed
+    """
+    __slots__ = ()
+
+    @property
+    def text(self):
+        return self.chunk_set.text(self.index)
+
+    @property
+    def tokens(self):
+        return self.chunk_set.tokens(self.index)
+
+# Open chunk sets, validated against the index file's modification time
+_open_sets = {}
+_open_sets_lock = threading.Lock()
+
+def open_chunks(content_hash, index_folder=None):
+    """
+    Return the chunk RecordSet of a file content, or None if it has not been processed
+    """
+    directory = content_dir(content_hash, index_folder)
+    try:
+        mtime = os.stat(os.path.join(directory, CHUNKS + '.npy')).st_mtime_ns
+    except OSError:
+        return None
+
+    with _open_sets_lock:
+        cached = _open_sets.get(directory)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        chunk_set = RecordSet(directory)
+        _open_sets[directory] = (mtime, chunk_set)
+        return chunk_set
+
+# Open search indexes, validated the same way
+_open_indexes = {}
+
+def open_search_index(chunk_set):
+    """
+    Return the BM25 index of a chunk set
+
+    Content processed before indexes were stored (or whose index no longer
+    matches its chunks) is indexed on first use.
+    """
+    path = os.path.join(chunk_set.directory, INDEX_FILE)
+    with _open_sets_lock:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        cached = _open_indexes.get(chunk_set.directory)
+        if cached and cached[0] == mtime and len(cached[1]) == len(chunk_set):
+            return cached[1]
+
+    index = InvertedIndex.load(path) if mtime is not None else None
+    if index is None or len(index) != len(chunk_set):
+        builder = IndexBuilder()
+        for text in chunk_set.texts():
+            builder.add(text)
+        builder.save(chunk_set.directory)
+        index = builder.build()
+        mtime = os.stat(path).st_mtime_ns
+
+    with _open_sets_lock:
+        _open_indexes[chunk_set.directory] = (mtime, index)
+    return index
+
+# Open embedding matrices, validated by modification time and embedder
+_open_embeddings = {}
+
+def open_embeddings(chunk_set, embedder_name=None):
+    """
+    Return the memory-mapped embedding matrix of a chunk set, or None while there is none
+
+    Embeddings are computed at ingest. Ones that are missing or were computed
+    by another embedder are queued to be (re)computed in the background, so a
+    request never embeds a whole document; callers fall back to BM25 meanwhile.
+    """
+    embedder = get_embedder(embedder_name)
+    path = os.path.join(chunk_set.directory, EMBEDDINGS_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    if mtime is not None:
+        with _open_sets_lock:
+            cached = _open_embeddings.get(chunk_set.directory)
+            if cached and cached[0] == mtime and cached[1] == embedder.name:
+                return cached[2]
+        if read_embeddings_stamp(chunk_set.directory) == embedder.name:
+            matrix = np.load(path, mmap_mode='r')
+            if len(matrix) == len(chunk_set):
+                with _open_sets_lock:
+                    _open_embeddings[chunk_set.directory] = (mtime, embedder.name, matrix)
+                return matrix
+
+    queue_embeddings(chunk_set.directory, embedder_name)
+    return None
+
+# Background embedding of contents found without usable embeddings: jobs queued
+# or running, and when the last attempt per (directory, embedder) failed
+_embedding_pool = None
+_embedding_jobs = set()
+_embedding_failures = {}
+
+def queue_embeddings(directory, embedder_name):
+    """
+    Compute a content's embeddings in a background thread, unless already queued or recently failed
+
+    Args:
+        directory (str): The content directory
+        embedder_name (str): 'ollama' or 'hashing'; None for the configured EMBEDDER
+
+    Returns:
+        bool: True if a job was queued
+    """
+    global _embedding_pool
+    key = (directory, get_embedder(embedder_name).name)
+    with _open_sets_lock:
+        if key in _embedding_jobs:
+            return False
+        failed_at = _embedding_failures.get(key)
+        if failed_at is not None and time.monotonic() - failed_at < Config.EMBED_RETRY_SECONDS:
+            return False
+        _embedding_jobs.add(key)
+        if _embedding_pool is None:
+            # One thread: the embedding server is better served one document at a time
+            _embedding_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embed')
+    _embedding_pool.submit(_run_embeddings, directory, embedder_name)
+    return True
+
+def _run_embeddings(directory, embedder_name):
+    key = (directory, get_embedder(embedder_name).name)
+    stored = False
+    try:
+        stored = embed_chunks(directory, embedder_name)
+    finally:
+        with _open_sets_lock:
+            _embedding_jobs.discard(key)
+            if stored:
+                _embedding_failures.pop(key, None)
+            else:
+                _embedding_failures[key] = time.monotonic()
+
+def has_chunks(content_hash, index_folder=None):
+    """
+    Check whether a file content has already been processed
+    """
+    return os.path.exists(os.path.join(content_dir(content_hash, index_folder), CHUNKS + '.npy'))
+
+def content_version(content_hash, index_folder=None):
+    """
+    Return the (chunks, embeddings) modification times of a content, None for missing files
+
+    Changes whenever the content is re-chunked or its embeddings are written.
+    """
+    directory = content_dir(content_hash, index_folder)
+    version = []
+    for name in (CHUNKS + '.npy', EMBEDDINGS_FILE):
+        try:
+            version.append(os.stat(os.path.join(directory, name)).st_mtime_ns)
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+def delete_chunks(content_hash, index_folder=None):
+    """
+    Remove every stored chunk (and cached page) of a file content
+    """
+    directory = content_dir(content_hash, index_folder)
+    with _open_sets_lock:
+        _open_sets.pop(directory, None)
+        _open_indexes.pop(directory, None)
+        _open_embeddings.pop(directory, None)
+    invalidate_content(content_hash)
+    invalidate_responses(content_hash)
+    invalidate_summaries(content_hash)
+    shutil.rmtree(directory, ignore_errors=True)
+
+def mark_ready(pdf):
+    """
+    Flag a PDF whose content has been processed as ready for chat
+    """
+    pdf.is_processed = True
+    pdf.status = pdf.STATUS_READY
+    pdf.status_message = None
+
+def ingest_pdf(pdf):
+    """
+    Extract, chunk and store a PDF so later requests never re-parse it
+
+    Content that was already processed for another upload is reused as is.
+    This runs in the caller's thread; uploads go through utils.ingest instead.
+
+    Args:
+        pdf (PDF): The PDF record to ingest
+
+    Returns:
+        bool: True if the PDF is ready, False if no text could be extracted (it is marked failed)
+    """
+    if not pdf.content_hash:
+        # PDFs uploaded before content addressing are hashed on first use
+        pdf.content_hash = file_sha256(pdf.file_path)
+
+    if not has_chunks(pdf.content_hash):
+        count = build_chunks(pdf.file_path,
+                             content_dir(pdf.content_hash),
+                             current_app.config['PDF_EXTRACT_WORKERS'],
+                             chunk_params(current_app.config))
+        if not count:
+            # build_chunks left nothing behind; a ready PDF without chunks would look empty
+            pdf.is_processed = False
+            pdf.status = pdf.STATUS_FAILED
+            pdf.status_message = 'No text could be extracted from this PDF'
+            db.session.commit()
+            return False
+
+    mark_ready(pdf)
+    db.session.commit()
+    return True
+
+def get_chunks(pdf):
+    """
+    Return handles to the stored chunks of a PDF
+
+    Nothing is extracted on this path: a PDF that is not processed yet (or
+    failed) has no chunks and gets an empty list.
+
+    Args:
+        pdf (PDF): The PDF record to read
+
+    Returns:
+        list: ChunkHandle objects in document order
+    """
+    chunk_set = open_chunks(pdf.content_hash) if pdf.content_hash else None
+    return chunk_set.handles() if chunk_set is not None else []
+
+def get_chunk_texts(pdf):
+    """
+    Return the stored chunk strings of a PDF in document order
+    """
+    return [chunk.text for chunk in get_chunks(pdf)]
@@ -0,0 +1,115 @@
+from config import Config
+from utils.tokenizer import get_tokenizer
+
+# Prompt assembly against a per-model token budget:
+#   context window = system prompt + history + documents + answer reserve
+# Chat messages cost a few tokens of framing on top of their content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def context_window(model):
+    """
+    Return the context window (in tokens) configured for model
+    """
+    return Config.MODEL_CONTEXT_TOKENS.get(model, Config.DEFAULT_CONTEXT_TOKENS)
+
+def model_options(model):
+    """
+    Return the generation options that make the backend use the window we budget for
+    """
+    return {
+        "num_ctx": context_window(model),
+        "num_predict": Config.ANSWER_RESERVE_TOKENS,
+    }
+
+def count_tokens(text):
+    """
+    Count tokens with the configured tokenizer
+    """
+    return get_tokenizer(Config.TOKENIZER).count(text)
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cut text down to at most max_tokens tokens
+    """
+    return get_tokenizer(Config.TOKENIZER).truncate(text, max_tokens)
+
+def chunk_tokens(chunk):
+    """
+    Token count of a chunk: precomputed for stored chunk handles, counted for strings
+    """
+    if isinstance(chunk, str):
+        return count_tokens(chunk)
+    return chunk.tokens
+
+def chunk_text(chunk):
+    """
+    Text of a chunk given as a string or a stored chunk handle
+    """
+    return chunk if isinstance(chunk, str) else chunk.text
+
+def messages_tokens(messages):
+    """
+    Token cost of a list of chat messages
+    """
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+def document_budget(model, messages):
+    """
+    Tokens left for document content once messages and the answer reserve are accounted for
+    """
+    return context_window(model) - Config.ANSWER_RESERVE_TOKENS - messages_tokens(messages)
+
+def pack_chunks(chunks, budget, separator_tokens=2):
+    """
+    Take chunks in the given order while they fit in budget tokens
+
+    Chunks that do not fit are skipped so smaller ones later in the order can
+    still fill the remaining budget. If not even the first chunk fits, it is
+    truncated to the budget.
+
+    Args:
+        chunks (list): Chunks (strings or handles), most important first
+        budget (int): Token budget for the chunks
+        separator_tokens (int, optional): Cost of the separator between chunks. Defaults to 2.
+
+    Returns:
+        list: (index into chunks, text) pairs in selection order
+    """
+    packed = []
+    used = 0
+    for i, chunk in enumerate(chunks):
+        cost = chunk_tokens(chunk) + separator_tokens
+        if used + cost <= budget:
+            packed.append((i, chunk_text(chunk)))
+            used += cost
+        elif not packed and i == 0:
+            packed.append((i, truncate_to_tokens(chunk_text(chunk), budget - separator_tokens)))
+            used = budget
+    return packed
+
+def pack_text(chunks, budget):
+    """
+    Join chunks in document order into one text of at most budget tokens
+
+    Args:
+        chunks (list or str): Chunks (strings or handles), or already joined text
+
+    Returns:
+        str: The packed text
+    """
+    if isinstance(chunks, str):
+        return truncate_to_tokens(chunks, budget)
+
+    texts = []
+    used = 0
+    for chunk in chunks:
+        cost = chunk_tokens(chunk) + 1
+        if used + cost > budget:
+            # Fill the remainder with the start of the chunk that no longer fits
+            remainder = truncate_to_tokens(chunk_text(chunk), budget - used - 1)
+            if remainder:
+                texts.append(remainder)
+            break
+        texts.append(chunk_text(chunk))
+        used += cost
+    return " ".join(texts)
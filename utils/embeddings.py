@@ -0,0 +1,156 @@
+import os
+import threading
+import zlib
+from collections import Counter
+import numpy as np
+from config import Config
+from utils.llm_client import get_client
+from utils.bm25 import tokenize
+
+# Chunk embeddings, stored next to the chunks of each file content as
+#   embeddings.npy    float32 matrix, one L2-normalized row per chunk
+#   embeddings.stamp  the embedder the rows were computed with
+# Rows are normalized, so cosine similarity against every chunk of a PDF is a
+# single matrix-vector product.
+EMBEDDINGS_FILE = 'embeddings.npy'
+EMBEDDINGS_STAMP = 'embeddings.stamp'
+
+def normalize(vectors):
+    """
+    Scale each row to unit length (all-zero rows are left as they are)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: signed feature hashing of terms
+
+    Needs no model or server, so it works offline and in tests. It only captures
+    shared vocabulary, not meaning.
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self.name = f'hashing:{dim}'
+        self.batch_size = 256
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in Counter(tokenize(text)).items():
+                # crc32 is stable across processes, unlike hash()
+                h = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * (1.0 + np.log(count))
+        return normalize(vectors)
+
+class OllamaEmbedder:
+    """
+    Embeds through the Ollama /api/embed endpoint, several texts per request
+    """
+
+    def __init__(self, model, url, batch_size=32, timeout=120):
+        self.model = model
+        self.url = url
+        self.name = f'ollama:{model}'
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def embed(self, texts):
+        response = get_client().post(self.url, json={"model": self.model, "input": list(texts)},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return normalize(response.json()["embeddings"])
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+def get_embedder(name=None):
+    """
+    Return the (cached) embedder selected by name: 'ollama' or 'hashing'
+    """
+    name = name or Config.EMBEDDER
+    with _embedders_lock:
+        if name not in _embedders:
+            if name == 'ollama':
+                _embedders[name] = OllamaEmbedder(Config.EMBEDDING_MODEL, Config.OLLAMA_EMBED_URL,
+                                                  Config.EMBED_BATCH_SIZE)
+            elif name == 'hashing':
+                _embedders[name] = HashingEmbedder(Config.HASHING_EMBEDDING_DIM)
+            else:
+                raise ValueError(f"Unknown embedder '{name}'. Available: ollama, hashing")
+        return _embedders[name]
+
+def embed_texts(embedder, texts, count, path):
+    """
+    Embed count texts batch by batch, streaming the rows into a .npy file at path
+
+    The matrix is written under a temporary name and moved into place when complete.
+    """
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    matrix = None
+    row = 0
+    batch = []
+    try:
+        for text in texts:
+            batch.append(text)
+            if len(batch) < embedder.batch_size and row + len(batch) < count:
+                continue
+            vectors = embedder.embed(batch)
+            if matrix is None:
+                # The dimension is only known once the first batch comes back
+                matrix = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32,
+                                                   shape=(count, vectors.shape[1]))
+            matrix[row:row + len(batch)] = vectors
+            row += len(batch)
+            batch = []
+        if matrix is None or row != count:
+            raise ValueError(f'Embedded {row} of {count} chunks')
+        matrix.flush()
+        del matrix
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_embeddings(directory, texts, count, embedder):
+    """
+    Compute and store the embeddings of a content's chunks with their stamp
+    """
+    embed_texts(embedder, texts, count, os.path.join(directory, EMBEDDINGS_FILE))
+    with open(os.path.join(directory, EMBEDDINGS_STAMP), 'w') as stamp_file:
+        stamp_file.write(embedder.name)
+
+def read_embeddings_stamp(directory):
+    try:
+        with open(os.path.join(directory, EMBEDDINGS_STAMP)) as stamp_file:
+            return stamp_file.read().strip()
+    except OSError:
+        return ''
+
+def top_k(query_vector, matrices, k):
+    """
+    Find the rows most similar to a query across several embedding matrices
+
+    Args:
+        query_vector (ndarray): Normalized query embedding
+        matrices (list): Normalized float32 matrices (one per chunk set)
+        k (int): Number of results
+
+    Returns:
+        list: (score, matrix number, row) tuples, best first
+    """
+    if not matrices or not sum(len(matrix) for matrix in matrices):
+        return []
+    scores = np.concatenate([matrix @ query_vector for matrix in matrices])
+    owners = np.repeat(np.arange(len(matrices)), [len(matrix) for matrix in matrices])
+    starts = np.cumsum([0] + [len(matrix) for matrix in matrices])
+
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    return [(float(scores[i]), int(owners[i]), int(i - starts[owners[i]])) for i in best]
@@ -0,0 +1,151 @@
+import html
+import re
+import threading
+from sqlalchemy import text
+from config import Config
+from models import db
+from utils.bm25 import tokenize
+from utils.chunk_store import open_chunks
+
+# Full-text search over the chunks of every PDF, in an SQLite FTS5 virtual
+# table inside the application database:
+#   text   chunk text (porter-stemmed unicode61 tokens)
+#   owner  'u<user id>', so a query only visits its owner's postings
+#   page   page number of the chunk (not indexed)
+# The rowid packs (PDF id, chunk number), so a PDF's rows are one contiguous
+# rowid range that is deleted without scanning the table. Rows are added when
+# a PDF becomes ready and removed when it is deleted.
+#
+# Ranking (BM25) costs a few microseconds per matching chunk, so a query
+# matching more than FULLTEXT_RANK_WINDOW chunks only ranks the newest ones.
+FTS_TABLE = 'chunk_fts'
+
+# Chunk number bits of the rowid (up to 16M chunks per PDF)
+CHUNK_BITS = 24
+
+# Snippet markers, replaced by <mark> tags after HTML-escaping the snippet
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_TOKEN = re.compile(r'\w+')
+
+# Whether the table is available, by database URL
+_tables = {}
+_tables_lock = threading.Lock()
+
+def fulltext_available():
+    """
+    Create the FTS5 table on first use; False if the database cannot provide one
+    """
+    url = str(db.engine.url)
+    with _tables_lock:
+        if url in _tables:
+            return _tables[url]
+        available = False
+        if db.engine.dialect.name == 'sqlite':
+            try:
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                        "text, owner, page UNINDEXED, tokenize='porter unicode61')")
+                available = True
+            except Exception as e:
+                print(f"Error creating the full-text index: {e}")
+        _tables[url] = available
+        return available
+
+def _rowid_range(pdf_id):
+    return pdf_id << CHUNK_BITS, ((pdf_id + 1) << CHUNK_BITS) - 1
+
+def index_pdf(pdf):
+    """
+    Add (or replace) the chunks of a ready PDF in the full-text index and commit
+
+    Errors are reported, not raised: the PDF stays usable for chat without search.
+    """
+    if not pdf.content_hash or not fulltext_available():
+        return
+    chunk_set = open_chunks(pdf.content_hash)
+    if chunk_set is None:
+        return
+    try:
+        unindex_pdf(pdf.id)
+        first_rowid = _rowid_range(pdf.id)[0]
+        owner = f'u{pdf.user_id}'
+        rows = [{'rowid': first_rowid + i, 'text': chunk.text, 'owner': owner, 'page': chunk.page}
+                for i, chunk in enumerate(chunk_set.handles())]
+        if rows:
+            db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, text, owner, page) "
+                                    "VALUES (:rowid, :text, :owner, :page)"), rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error indexing PDF {pdf.id} for search: {e}")
+
+def unindex_pdf(pdf_id):
+    """
+    Remove the chunks of a PDF from the full-text index; the caller commits
+    """
+    if not fulltext_available():
+        return
+    first, last = _rowid_range(pdf_id)
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN :first AND :last"),
+                       {'first': first, 'last': last})
+
+def is_indexed(pdf_id):
+    first, last = _rowid_range(pdf_id)
+    return db.session.execute(text(f"SELECT 1 FROM {FTS_TABLE} WHERE rowid BETWEEN :first AND :last LIMIT 1"),
+                              {'first': first, 'last': last}).first() is not None
+
+def match_expression(query, user_id):
+    """
+    Turn free text into an FTS5 query: every word must occur, within the user's chunks
+
+    Stopwords are dropped unless the query has nothing else: they match nearly
+    every chunk and barely affect the ranking. Words are quoted, so FTS5
+    operators typed by the user are searched as plain words.
+    """
+    tokens = tokenize(query) or _TOKEN.findall(query.lower())
+    if not tokens:
+        return None
+    words = ' '.join(f'"{token}"' for token in tokens)
+    return f'owner : "u{user_id}" AND text : ({words})'
+
+def format_snippet(snippet):
+    """HTML-escape a snippet and highlight the matched words"""
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+def search_chunks(user_id, query, limit=20):
+    """
+    Search the chunks of a user's PDFs
+
+    Args:
+        user_id (int): Owner of the PDFs
+        query (str): Free-text query
+        limit (int, optional): Number of results. Defaults to 20.
+
+    Returns:
+        list: dicts with pdf_id, chunk, page, snippet (HTML) and score, best first
+    """
+    expression = match_expression(query, user_id)
+    if expression is None or not fulltext_available():
+        return []
+    # Lowest rowid of the ranking window: the newest FULLTEXT_RANK_WINDOW matches
+    window = db.session.execute(text(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :expression "
+        "ORDER BY rowid DESC LIMIT 1 OFFSET :offset"
+    ), {'expression': expression, 'offset': Config.FULLTEXT_RANK_WINDOW - 1}).first()
+    # BM25 over the chunk text only; the owner column is a filter
+    rows = db.session.execute(text(
+        f"SELECT rowid, page, snippet({FTS_TABLE}, 0, :start, :end, '…', 16), "
+        f"bm25({FTS_TABLE}, 1.0, 0.0) AS score FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :expression AND rowid >= :first ORDER BY score LIMIT :limit"
+    ), {'start': _MARK_START, 'end': _MARK_END, 'expression': expression,
+        'first': window[0] if window else 0, 'limit': limit}).all()
+    return [{
+        'pdf_id': rowid >> CHUNK_BITS,
+        'chunk': rowid & ((1 << CHUNK_BITS) - 1),
+        'page': page,
+        'snippet': format_snippet(snippet),
+        # FTS5 returns negated BM25 scores
+        'score': round(-score, 4),
+    } for rowid, page, snippet, score in rows]
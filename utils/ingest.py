@@ -0,0 +1,274 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from models import db, PDF
+from utils.ann_index import library_add_pdf, library_remove_pdf
+from utils.blob_store import file_sha256
+from utils.chunk_store import (build_chunks, rechunk, content_dir, has_chunks, mark_ready, delete_chunks,
+                               chunk_params, chunk_stamp, read_stamp)
+from utils.fulltext import index_pdf, unindex_pdf, is_indexed, fulltext_available
+from utils.retrieval_cache import invalidate_content
+from utils.llm_cache import invalidate_responses
+from utils.summarizer import invalidate_summaries
+from utils.session_index import sync_session_index
+from utils.uploads import import_zip
+
+# Extraction runs in worker processes so PyPDF2/NLTK never hold a web worker.
+# A dispatcher thread per worker process tracks status in the database.
+_lock = threading.Lock()
+_process_pool = None
+_dispatch_pool = None
+
+def _get_pools(max_workers):
+    global _process_pool, _dispatch_pool
+    with _lock:
+        if _process_pool is None:
+            # spawn avoids forking a multi-threaded web server
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _dispatch_pool = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix='pdf-ingest'
+            )
+    return _process_pool, _dispatch_pool
+
+def _pdf_deleted(pdf_id):
+    # Whether another request deleted the PDF's row since this job loaded it
+    with db.session.no_autoflush:
+        return db.session.query(PDF.id).filter_by(id=pdf_id).first() is None
+
+def _discard_ingest(pdf_id, user_id, content_hash):
+    """
+    Undo the work of an ingestion whose PDF was deleted while it ran
+
+    The deletion could not see the chunks, search rows and library index entry
+    made after it, so they are removed here; the chunks only if no other PDF
+    shares the content.
+    """
+    try:
+        unindex_pdf(pdf_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error removing deleted PDF {pdf_id} from search: {e}")
+    # Only the id and owner are read
+    library_remove_pdf(PDF(id=pdf_id, user_id=user_id))
+    if content_hash and not PDF.query.filter_by(content_hash=content_hash).count():
+        delete_chunks(content_hash)
+
+def _run_ingest(app, pdf_id):
+    """
+    Move one PDF through processing -> ready/failed
+    """
+    process_pool, _ = _get_pools(app.config['INGEST_WORKERS'])
+    with app.app_context():
+        pdf = db.session.get(PDF, pdf_id)
+        if pdf is None:
+            return
+
+        user_id = pdf.user_id
+        content_hash = pdf.content_hash
+        pdf.status = PDF.STATUS_PROCESSING
+        db.session.commit()
+
+        try:
+            if not content_hash:
+                content_hash = file_sha256(pdf.file_path)
+                pdf.content_hash = content_hash
+            
+            # Identical content uploaded earlier (by anyone) is already processed
+            if not has_chunks(content_hash):
+                # The worker streams chunks straight into the chunk store
+                count = process_pool.submit(
+                    build_chunks, pdf.file_path, content_dir(content_hash),
+                    app.config['PDF_EXTRACT_WORKERS'], chunk_params(app.config)
+                ).result()
+                if not count:
+                    raise ValueError('No text could be extracted from this PDF')
+            
+            # The PDF may have been deleted while its chunks were built
+            if _pdf_deleted(pdf_id):
+                _discard_ingest(pdf_id, user_id, content_hash)
+                return
+            mark_ready(pdf)
+            db.session.commit()
+            
+            # Make it searchable library-wide straight away
+            library_add_pdf(pdf)
+            index_pdf(pdf)
+            if _pdf_deleted(pdf_id):
+                _discard_ingest(pdf_id, user_id, content_hash)
+        except Exception as e:
+            db.session.rollback()
+            # A deletion that lands after the check fails the commit or the reload of the row
+            if _pdf_deleted(pdf_id):
+                _discard_ingest(pdf_id, user_id, content_hash)
+                return
+            print(f"Error ingesting PDF {pdf_id}: {e}")
+            try:
+                pdf.status = PDF.STATUS_FAILED
+                pdf.status_message = str(e)[:255]
+                pdf.is_processed = False
+                db.session.commit()
+            except Exception as e:
+                # Deleted in the meantime after all
+                db.session.rollback()
+                print(f"Error marking PDF {pdf_id} failed: {e}")
+
+def queue_pdfs(app, pdf_ids):
+    """
+    Hand PDFs to the background ingestion pool and return immediately
+
+    Args:
+        app (Flask): The application, used to open an app context in the worker thread
+        pdf_ids (list): IDs of PDF records already committed with status 'queued'
+    """
+    _, dispatch_pool = _get_pools(app.config['INGEST_WORKERS'])
+    for pdf_id in pdf_ids:
+        dispatch_pool.submit(_run_ingest, app, pdf_id)
+
+def requeue_unfinished(app):
+    """
+    Queue again the PDFs whose ingestion never finished
+
+    The queue lives in process memory, so PDFs left queued or processing by a
+    stopped server would otherwise wait forever. PDFs uploaded before status
+    tracking (no status) are queued too, to be hashed and chunked.
+
+    Returns:
+        list: IDs of the queued PDFs
+    """
+    with app.app_context():
+        pdfs = PDF.query.filter(db.or_(
+            PDF.status.in_([PDF.STATUS_QUEUED, PDF.STATUS_PROCESSING]), PDF.status.is_(None)
+        )).all()
+        for pdf in pdfs:
+            if pdf.status == PDF.STATUS_PROCESSING:
+                pdf.status = PDF.STATUS_QUEUED
+        db.session.commit()
+        pdf_ids = [pdf.id for pdf in pdfs]
+    queue_pdfs(app, pdf_ids)
+    return pdf_ids
+
+def start_processing(app, pdfs):
+    """
+    Start processing committed PDF records; content processed before is searchable right away
+    """
+    queue_pdfs(app, [pdf.id for pdf in pdfs if pdf.status == PDF.STATUS_QUEUED])
+    for pdf in pdfs:
+        if pdf.status == PDF.STATUS_READY:
+            library_add_pdf(pdf)
+            index_pdf(pdf)
+
+def _run_archive_import(app, zip_path, user_id):
+    with app.app_context():
+        try:
+            pdfs, skipped = import_zip(zip_path, user_id, app.config)
+            db.session.commit()
+        except Exception as e:
+            print(f"Error importing archive {zip_path}: {e}")
+            db.session.rollback()
+            return
+        finally:
+            os.remove(zip_path)
+        if skipped:
+            print(f"Skipped {len(skipped)} files in an archive of user {user_id} "
+                  f"that could not be imported as PDFs: {', '.join(skipped[:10])}")
+        start_processing(app, pdfs)
+
+def queue_archive_import(app, zip_path, user_id):
+    """
+    Import the PDFs of an uploaded ZIP archive in the background, then queue them for ingestion
+
+    A large archive takes a while to unpack and hash, so it is not done in the
+    request; its PDFs appear on the dashboard as soon as the import finishes.
+    The archive file is removed afterwards.
+    """
+    _, dispatch_pool = _get_pools(app.config['INGEST_WORKERS'])
+    return dispatch_pool.submit(_run_archive_import, app, zip_path, user_id)
+
+def _run_rechunk(app, directory, params, file_path):
+    """
+    Rebuild one content's chunks in a worker process; PDFs stay ready meanwhile
+    """
+    process_pool, _ = _get_pools(app.config['INGEST_WORKERS'])
+    try:
+        process_pool.submit(rechunk, directory, params, file_path).result()
+    except Exception as e:
+        print(f"Error re-chunking {directory}: {e}")
+    # Cached results, summaries, search rows and library index entries name chunks of the old chunking
+    content_hash = os.path.basename(directory)
+    invalidate_content(content_hash)
+    invalidate_responses(content_hash)
+    invalidate_summaries(content_hash)
+    with app.app_context():
+        for pdf in PDF.query.filter_by(content_hash=content_hash, status=PDF.STATUS_READY).all():
+            index_pdf(pdf)
+            library_remove_pdf(pdf)
+            library_add_pdf(pdf)
+
+def queue_stale_rechunks(app):
+    """
+    Queue a rebuild of every processed content whose chunk stamp differs from the current config
+
+    Only the chunking step is redone, from the cached page texts.
+
+    Returns:
+        list: Futures of the queued jobs
+    """
+    _, dispatch_pool = _get_pools(app.config['INGEST_WORKERS'])
+    params = chunk_params(app.config)
+    stamp = chunk_stamp(params)
+    index_folder = app.config['INDEX_FOLDER']
+
+    with app.app_context():
+        contents = db.session.query(PDF.content_hash, db.func.min(PDF.file_path)).filter(
+            PDF.content_hash.isnot(None)
+        ).group_by(PDF.content_hash).all()
+
+    futures = []
+    for content_hash, file_path in contents:
+        directory = content_dir(content_hash, index_folder)
+        if has_chunks(content_hash, index_folder) and read_stamp(directory) != stamp:
+            futures.append(dispatch_pool.submit(_run_rechunk, app, directory, params, file_path))
+    return futures
+
+def _backfill_fulltext(app):
+    with app.app_context():
+        if not fulltext_available():
+            return 0
+        count = 0
+        for pdf in PDF.query.filter_by(status=PDF.STATUS_READY).all():
+            if not is_indexed(pdf.id):
+                index_pdf(pdf)
+                count += 1
+        return count
+
+def queue_fulltext_backfill(app):
+    """
+    Index ready PDFs missing from the full-text index (e.g. processed before it existed)
+
+    Returns:
+        Future: Resolves to the number of PDFs indexed
+    """
+    _, dispatch_pool = _get_pools(app.config['INGEST_WORKERS'])
+    return dispatch_pool.submit(_backfill_fulltext, app)
+
+def _run_session_index(app, chat_id):
+    with app.app_context():
+        try:
+            sync_session_index(chat_id)
+        except Exception as e:
+            print(f"Error indexing chat session {chat_id}: {e}")
+
+def queue_session_index(app, chat_id):
+    """
+    Build or update the session index of a large chat in the background
+
+    A message sent meanwhile waits for the build to finish.
+    """
+    _, dispatch_pool = _get_pools(app.config['INGEST_WORKERS'])
+    return dispatch_pool.submit(_run_session_index, app, chat_id)
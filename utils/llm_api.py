@@ -0,0 +1,265 @@
+from config import Config
+from utils.llm_providers import get_provider
+from utils.llm_cache import cached_chat
+from utils.llm_gateway import llm_slot, GatewayRejected
+from utils.context import model_options, document_budget, count_tokens, pack_chunks, pack_text
+from utils.retrieval import select_chunks
+from utils.summarizer import summarize_document, PARTIAL_KINDS
+
+# Prompts for the document tasks, sent to the LLM backend chosen by LLM_PROVIDER
+MODEL = Config.LLM_MODEL
+
+def generation_options(temperature):
+    """
+    Generation options for MODEL: the temperature plus the budgeted context window and answer length
+    """
+    return {"temperature": temperature, **model_options(MODEL)}
+
+def ask_question(question, context, tags=(), user_id=None):
+    """
+    Ask a question to the LLM and return the response
+    
+    The answer is deterministic, so it is cached (see utils.llm_cache).
+    
+    Args:
+        question (str): The question to ask
+        context (str or list): The context to consider when answering the question,
+            as text or as document chunks (strings or chunk handles) in document order
+        tags (iterable, optional): Content hashes of the documents, to drop the cached answer with them
+        user_id (int, optional): Whose request it is, for the LLM gateway's per-user queue
+    
+    Returns:
+        str: The answer from the LLM
+    
+    Raises:
+        GatewayRejected: If the model is too busy to take the question
+    """
+    system_message = """You are a document assistant that ONLY answers questions based on the provided context. 
+        If the question is not directly answerable from the document, respond with: 
+        "I can only answer questions related to the document content. This question cannot be answered based on the provided document."
+        Never use external knowledge or make assumptions beyond what's explicitly stated in the document."""
+    
+    # Fit as much of the document as the model's token budget allows
+    def build_messages(context_text):
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": f"Context from document:\n{context_text}\n\nQuestion: {question}"}
+        ]
+    messages = build_messages(pack_text(context, document_budget(MODEL, build_messages(""))))
+    
+    try:
+        # Lower temperature for more deterministic responses
+        return cached_chat(get_provider(), messages, generation_options(0.0), tags, user_id)
+    except GatewayRejected:
+        raise
+    except Exception as e:
+        print(f"Error in ask_question: {e}")
+        return f"I encountered an error while trying to answer your question: {str(e)}"
+
+# Summarization prompts: a whole document, a section of a long document, and
+# the summaries of consecutive sections combined part way up or at the top
+SUMMARY_SYSTEM_MESSAGE = "You are a document summarization assistant. Provide a concise but comprehensive summary of the text provided, focusing ONLY on information explicitly stated in the document."
+SUMMARY_PROMPTS = {
+    'document': "Please summarize the following document:\n\n{text}",
+    'section': "Please summarize the following section of a longer document:\n\n{text}",
+    'merge': "The following are summaries of consecutive sections of a longer document. Combine them into one summary of those sections:\n\n{text}",
+    'final': "The following are summaries of consecutive sections of a document. Combine them into one summary of the whole document:\n\n{text}",
+}
+
+def summarize_text(text, tags=(), user_id=None):
+    """
+    Generate a summary of the provided text
+    
+    Documents longer than one prompt are summarized section by section and the
+    section summaries combined (see utils.summarizer). Section summaries and
+    the final summary are cached and tagged with tags. Every model call takes
+    its own LLM gateway slot, so the sections summarized in parallel count
+    against the global limit; a call that finds the user's queue full waits
+    for room rather than failing the summary half way.
+    
+    Args:
+        text (str or list): The text to summarize, or document chunks (strings or chunk handles)
+        tags (iterable, optional): Content hashes of the documents, to drop the cached summary with them
+        user_id (int, optional): Whose request it is, for the LLM gateway's per-user queue
+    
+    Returns:
+        str: The summary from the LLM
+    
+    Raises:
+        GatewayRejected: If one of the calls found no room or no slot within LLM_QUEUE_TIMEOUT
+    """
+    def build_messages(kind, document_text):
+        return [
+            {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
+            {"role": "user", "content": SUMMARY_PROMPTS[kind].format(text=document_text)}
+        ]
+    
+    def summarize(kind, document_text):
+        options = generation_options(0.1)  # Low temperature for more consistent summaries
+        if kind in PARTIAL_KINDS:
+            # Keep section summaries short so many fit in the next prompt
+            options["num_predict"] = Config.SUMMARY_PART_TOKENS
+            # Cached by the summarizer
+            with llm_slot(user_id, wait_for_place=True):
+                return get_provider().chat(build_messages(kind, document_text), options)
+        return cached_chat(get_provider(), build_messages(kind, document_text), options, tags, user_id,
+                           wait_for_place=True)
+    
+    budgets = {kind: document_budget(MODEL, build_messages(kind, "")) for kind in SUMMARY_PROMPTS}
+    cache_namespace = [get_provider().name, model_options(MODEL), Config.SUMMARY_PART_TOKENS, SUMMARY_SYSTEM_MESSAGE, SUMMARY_PROMPTS]
+    
+    # More parts at once than a user may queue would only wait for room
+    workers = max(1, min(Config.SUMMARY_WORKERS, Config.LLM_QUEUE_PER_USER))
+    
+    try:
+        return summarize_document(text, summarize, budgets, cache_namespace, workers, tags)
+    except GatewayRejected:
+        raise
+    except Exception as e:
+        print(f"Error in summarize_text: {e}")
+        return f"I encountered an error while trying to summarize the text: {str(e)}"
+
+def chat_messages(message, pdf_contents, chat_history=None, pdf_sources=None, presorted=False,
+                  term_index=None):
+    """
+    Build the chat prompt: relevant PDF chunks within the token budget, history and the message
+    
+    Args:
+        message (str): The user's message
+        pdf_contents (list): List of PDF chunks, as strings or chunk handles with a .text attribute
+        chat_history (list, optional): Chat history. Defaults to None.
+        pdf_sources (list, optional): List indicating which PDF each chunk belongs to. Defaults to None.
+        presorted (bool, optional): pdf_contents are already ordered by relevance. Defaults to False.
+        term_index (InvertedIndex, optional): The chat session's merged BM25 index over pdf_contents.
+            Defaults to None (the PDFs' own indexes are searched).
+    
+    Returns:
+        list: The messages to send to the LLM
+    """
+    if chat_history is None:
+        chat_history = []
+    
+    if pdf_sources is None:
+        # If no sources provided, assume one chunk per PDF
+        pdf_sources = list(range(len(pdf_contents)))
+    
+    # Prepare system message with strict instructions
+    system_message = """You are a document assistant that ONLY answers questions based on the provided document content.
+Follow these strict rules:
+1. ONLY answer questions that can be directly answered from the document content provided.
+2. If a question cannot be answered with information from the documents, respond with: 
+   "I can only answer questions related to the document content. Your question cannot be answered based on the documents provided."
+3. Do not use any external knowledge beyond what's in the documents.
+4. Do not make assumptions or inferences beyond what is explicitly stated.
+5. If asked for opinions, judgments, advice, or anything outside the document scope, politely redirect to document content only.
+6. Refuse to engage with any requests that are not about understanding or extracting information from the documents.
+7. When referencing the documents, be clear about the true number of source PDFs - there are only as many actual documents as there are unique document numbers in the context.
+8. If asked about the number of documents, always count the number of unique document numbers, not the number of content chunks.
+"""
+    
+    MAX_HISTORY_ITEMS = 4      # Limit chat history to most recent exchanges
+    
+    # Limit chat history to most recent exchanges
+    limited_history = chat_history[-MAX_HISTORY_ITEMS:] if len(chat_history) > MAX_HISTORY_ITEMS else chat_history
+    
+    num_sources = len(set(pdf_sources))
+    content_intro = "Here are the document contents to reference:\n\n"
+    count_note = f"IMPORTANT NOTE: There are {num_sources} documents (PDFs) in total.\n\n"
+    
+    def build_messages(pdf_content_text, history):
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": content_intro + pdf_content_text},
+            {"role": "assistant", "content": "I'll help you with questions about these documents, but I can only respond based on their content."}
+        ]
+        for entry in history:
+            if entry.get('is_user', False):
+                messages.append({"role": "user", "content": entry["content"]})
+            else:
+                messages.append({"role": "assistant", "content": entry["content"]})
+        # Add current message
+        messages.append({"role": "user", "content": message})
+        return messages
+    
+    # Token budget for document content: the context window minus the system prompt,
+    # history, current message, answer reserve and the per-document headers
+    header_tokens = count_tokens(f"\n\n---\n\nDocument {num_sources} (PDF):\n")
+    budget = document_budget(MODEL, build_messages(count_note, limited_history)) - header_tokens * num_sources
+    # Drop the oldest history first if it leaves no room for documents
+    while budget <= 0 and limited_history:
+        limited_history = limited_history[1:]
+        budget = document_budget(MODEL, build_messages(count_note, limited_history)) - header_tokens * num_sources
+    
+    # Pick relevant, non-redundant chunks that fit in the token budget
+    # (BM25 and embedding rankings fused, then diversified with MMR)
+    selected = select_chunks(message, pdf_contents, max(budget, 0),
+                             ranked=list(range(len(pdf_contents))) if presorted else None,
+                             term_index=term_index)
+    packed = pack_chunks([pdf_contents[i] for i in selected], max(budget, 0))
+    
+    # Format PDF contents for the API
+    if packed:
+        # Group chunks by PDF source
+        pdf_contents_grouped = {}
+        for rank, content in packed:
+            pdf_idx = pdf_sources[selected[rank]]
+            if pdf_idx not in pdf_contents_grouped:
+                pdf_contents_grouped[pdf_idx] = []
+            pdf_contents_grouped[pdf_idx].append(content)
+        
+        # Format grouped content
+        pdf_sections = []
+        
+        # Add metadata about the total number of documents
+        pdf_content_text = f"IMPORTANT NOTE: There are {len(pdf_contents_grouped)} documents (PDFs) in total.\n\n"
+        
+        for pdf_idx, contents in pdf_contents_grouped.items():
+            section = f"Document {pdf_idx + 1} (PDF):\n" + "\n\n".join(contents)
+            pdf_sections.append(section)
+        
+        pdf_content_text += "\n\n---\n\n".join(pdf_sections)
+    else:
+        pdf_content_text = "No relevant document content found."
+    
+    return build_messages(pdf_content_text, limited_history)
+
+def chat_with_pdfs(message, pdf_contents, chat_history=None, pdf_sources=None, presorted=False,
+                   term_index=None, user_id=None):
+    """
+    Generate a response based on PDF contents and chat history
+    
+    Takes the same arguments as chat_messages, plus the user_id whose LLM
+    gateway queue the model call waits in. Only the model call holds a slot;
+    chunk selection and prompt packing run before it.
+    
+    Returns:
+        str: The response from the LLM
+    
+    Raises:
+        GatewayRejected: If the model is too busy to take the message
+    """
+    messages = chat_messages(message, pdf_contents, chat_history, pdf_sources, presorted, term_index)
+    
+    try:
+        # Zero temperature for more deterministic responses
+        with llm_slot(user_id):
+            return get_provider().chat(messages, generation_options(0.0))
+    except GatewayRejected:
+        raise
+    except Exception as e:
+        print(f"Error in chat_with_pdfs: {e}")
+        return f"I encountered an error while processing your request: {str(e)}"
+
+def stream_chat(messages):
+    """
+    Generate a response to messages built by chat_messages, yielding its tokens as the model produces them
+    
+    Closing the generator closes the connection to the backend, which stops the generation.
+    
+    Yields:
+        str: Pieces of the response text
+    
+    Raises:
+        Exception: If the request fails or the backend reports an error
+    """
+    yield from get_provider().stream(messages, generation_options(0.0))
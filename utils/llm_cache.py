@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+import weakref
+from config import Config
+from utils.cache import LRUCache, SQLiteCache, TieredCache
+from utils.llm_gateway import llm_slot
+
+# Cache of LLM responses to deterministic requests (document summaries and
+# questions about one document, at temperature 0-0.1): the same prompt to the
+# same model with the same options gets the same answer, so it is generated once.
+#
+# Key: provider name (backend and model), generation options and the hash of
+# the messages. Entries live in an in-process LRU of LLM_CACHE_BYTES in front of
+# a SQLite file (LLM_CACHE_DB) shared by all workers and kept across restarts.
+# Both tiers expire entries after LLM_CACHE_TTL seconds, and the file is kept
+# under LLM_CACHE_DB_BYTES by deleting its oldest entries. Entries are tagged
+# with the content hash of their document and dropped when it is deleted.
+#
+# Concurrent requests for the same key in one process wait for the first one
+# instead of all calling the model. Only a miss takes a slot of the LLM gateway
+# (utils.llm_gateway); a cached answer never queues.
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Lock per key being generated; an entry lives while some request holds it
+_key_locks = weakref.WeakValueDictionary()
+_key_locks_lock = threading.Lock()
+
+def get_cache():
+    """
+    Return the process-wide LLM response cache, creating it on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            ttl = Config.LLM_CACHE_TTL or None
+            shared = (SQLiteCache(Config.LLM_CACHE_DB, 'llm_responses', ttl=ttl,
+                                  max_bytes=Config.LLM_CACHE_DB_BYTES or None)
+                      if Config.LLM_CACHE_DB else None)
+            _cache = TieredCache(LRUCache(Config.LLM_CACHE_BYTES, ttl=ttl), shared)
+        return _cache
+
+def cache_enabled():
+    return bool(Config.LLM_CACHE_BYTES or Config.LLM_CACHE_DB)
+
+def response_key(provider_name, messages, options):
+    key = json.dumps([provider_name, options, messages], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _key_lock(key):
+    with _key_locks_lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _key_locks[key] = lock
+        return lock
+
+def cached_chat(provider, messages, options, tags=(), user_id=None, wait_for_place=False):
+    """
+    Answer chat messages through the response cache
+
+    Args:
+        provider (Provider): The LLM backend
+        messages (list): Chat messages
+        options (dict): Generation options
+        tags (iterable, optional): Content hashes of the documents in the prompt
+        user_id (int, optional): Whose request it is, for the gateway's per-user queue
+        wait_for_place (bool, optional): Wait for room in a full queue instead of being refused
+
+    Returns:
+        str: The cached or newly generated response (failed calls raise and are not cached)
+
+    Raises:
+        GatewayRejected: If a model call is needed and the gateway refuses it
+    """
+    if not cache_enabled():
+        with llm_slot(user_id, wait_for_place):
+            return provider.chat(messages, options)
+    cache = get_cache()
+    key = response_key(provider.name, messages, options)
+    response = cache.get(key)
+    if response is not None:
+        return response
+    with _key_lock(key):
+        # Another request may have generated it while this one waited
+        response = cache.get(key)
+        if response is None:
+            with llm_slot(user_id, wait_for_place):
+                response = provider.chat(messages, options)
+            cache.put(key, response, tags)
+    return response
+
+def invalidate_responses(content_hash):
+    """
+    Drop every cached response about a file content
+    """
+    if content_hash and cache_enabled():
+        get_cache().invalidate(content_hash)
+
+def llm_cache_stats():
+    """
+    Return the hit/miss counters of the LLM response cache
+    """
+    return get_cache().info()
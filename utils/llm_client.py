@@ -0,0 +1,245 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+# Shared HTTP client for every LLM call (Ollama chat, embeddings, hosted APIs):
+#   pool      one requests.Session per process whose keep-alive connection pool
+#             is reused by all calls, instead of a new TCP connection per call
+#   timeouts  (connect, read) on every request; the read timeout is the longest
+#             wait for the next bytes, so streamed answers may take longer overall
+#   retries   connection failures and 429/502/503/504 responses are retried with
+#             exponential backoff and full jitter. Read timeouts are not: the
+#             server accepted the request and is busy, and a retry only adds load.
+#             A streamed response is never retried once it has started.
+#   breaker   per backend host: after LLM_BREAKER_FAILURES failed calls in a row
+#             the circuit opens and calls fail at once with CircuitOpenError for
+#             LLM_BREAKER_RESET seconds. Then a single trial call is let
+#             through, which closes the circuit again or reopens it.
+#   stats     call/retry/failure counters, latency percentiles (time to the
+#             response headers) and pool usage, for the admin statistics page
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Latencies kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+class CircuitOpenError(Exception):
+    """The backend failed repeatedly; calls are refused until the circuit closes"""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker: closed -> open -> half-open -> closed
+    """
+
+    def __init__(self, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at < self.reset_seconds:
+            return 'open'
+        return 'half-open'
+
+    def allow(self, name):
+        """
+        Let a call through or raise CircuitOpenError
+        """
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return
+            wait = max(0.0, self.reset_seconds - (self.clock() - self.opened_at))
+            raise CircuitOpenError(f"{name} is unavailable after {self.failures} failed calls "
+                                   f"(retrying in {wait:.1f}s)")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+class LLMClient:
+    """
+    Pooled HTTP client with timeouts, retries and a circuit breaker per host
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=300, max_retries=2, backoff_base=0.5,
+                 backoff_max=8.0, pool_size=16, breaker_failures=5, breaker_reset=30):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+
+        self.session = requests.Session()
+        # Retries are handled here, not by urllib3, so they show in the stats and respect the breaker
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.counters = {'calls': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def breaker(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+            return self.breakers[host]
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def backoff(self, attempt):
+        """Full jitter: a random wait up to the exponential backoff of this attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post(self, url, json=None, headers=None, stream=False, timeout=None):
+        """
+        POST to an LLM backend through the shared pool
+
+        Args:
+            url (str): Endpoint URL
+            json (dict, optional): Request body
+            headers (dict, optional): Extra headers (e.g. authorization)
+            stream (bool, optional): Return as soon as the headers arrive and read the body lazily. Defaults to False.
+            timeout (float or tuple, optional): Overrides the configured (connect, read) timeouts
+
+        Returns:
+            requests.Response: The response; 4xx responses are returned for the caller to raise
+
+        Raises:
+            CircuitOpenError: If the backend's circuit is open
+            requests.RequestException: If the request still fails after the retries
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        try:
+            breaker.allow(host)
+        except CircuitOpenError:
+            self.count('rejected')
+            raise
+        self.count('calls')
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url, json=json, headers=headers, stream=stream,
+                                             timeout=timeout or self.timeout)
+                error = None
+            except requests.ConnectionError as e:
+                # Includes connect timeouts (ConnectTimeout is both); read timeouts are not retried
+                response, error = None, e
+            except Exception:
+                self.count('failures')
+                breaker.record_failure()
+                raise
+
+            if error is None and response.status_code not in RETRY_STATUSES:
+                with self.lock:
+                    self.latencies.append(time.perf_counter() - start)
+                if response.status_code >= 500:
+                    self.count('failures')
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                return response
+
+            if attempt >= self.max_retries:
+                self.count('failures')
+                breaker.record_failure()
+                if error is not None:
+                    raise error
+                return response
+
+            if response is not None:
+                response.close()
+            attempt += 1
+            self.count('retries')
+            time.sleep(self.backoff(attempt - 1))
+
+    def stats(self):
+        """
+        Return counters, latency percentiles (ms), breaker states and pool usage
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            latencies = np.array(self.latencies) * 1000
+            breakers = {host: {'state': breaker.state, 'failures': breaker.failures}
+                        for host, breaker in self.breakers.items()}
+        for q in (50, 95, 99):
+            stats[f'latency_ms_p{q}'] = round(float(np.percentile(latencies, q)), 1) if len(latencies) else None
+        stats['breakers'] = breakers
+
+        # Connections per host pool: opened over the pool's lifetime and idle right now
+        pools = [pool for pool in map(self.adapter.poolmanager.pools.get, self.adapter.poolmanager.pools.keys())
+                 if pool is not None]
+        stats['pool'] = {
+            'hosts': len(pools),
+            'max_per_host': self.adapter._pool_maxsize,
+            'connections_opened': sum(pool.num_connections for pool in pools),
+            'requests': sum(pool.num_requests for pool in pools),
+            # The pool queue is padded with None up to its size
+            'idle': sum(1 for pool in pools if pool.pool is not None for connection in list(pool.pool.queue) if connection),
+        }
+        return stats
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Return the process-wide LLM client, creating it on first use
+
+    A forked worker process gets its own client rather than sharing the parent's sockets.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = LLMClient(
+                connect_timeout=Config.LLM_CONNECT_TIMEOUT,
+                read_timeout=Config.LLM_READ_TIMEOUT,
+                max_retries=Config.LLM_MAX_RETRIES,
+                backoff_base=Config.LLM_BACKOFF_BASE,
+                backoff_max=Config.LLM_BACKOFF_MAX,
+                pool_size=Config.LLM_POOL_SIZE,
+                breaker_failures=Config.LLM_BREAKER_FAILURES,
+                breaker_reset=Config.LLM_BREAKER_RESET,
+            )
+            _client_pid = os.getpid()
+        return _client
+
+def llm_stats():
+    """
+    Return the statistics of this process's LLM client
+    """
+    return get_client().stats()
@@ -0,0 +1,249 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import Config
+
+# Admission control in front of the LLM. A single model server generates a few
+# answers at a time; past that, concurrent requests only slow each other down
+# until they all time out. Requests that use the model (a chat answer, a
+# summary, a question) first take one of LLM_MAX_CONCURRENCY slots:
+#   - a free slot is taken at once
+#   - otherwise the request waits in its user's queue. Freed slots go to the
+#     users in turn (round robin), so one user's burst cannot starve the rest
+#   - a request is refused at once with 429 if its user already has
+#     LLM_QUEUE_PER_USER requests waiting, and with 503 if LLM_QUEUE_SIZE
+#     requests are waiting in total or no slot freed up within LLM_QUEUE_TIMEOUT.
+#     The calls of a summary wait for room in the queue instead (within the same
+#     timeout), so a summary is not refused half way through its sections
+# Waiting requests can report their position (1 = next).
+#
+# The gateway lives in the process: with several worker processes, each one
+# admits up to LLM_MAX_CONCURRENCY requests.
+
+class GatewayRejected(Exception):
+    """
+    A request was refused admission; status is the HTTP status to answer with
+    """
+
+    def __init__(self, message, status, retry_after=5):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class Ticket:
+    """
+    One request's place in the gateway
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+        self.released = False
+
+class Gateway:
+    """
+    Concurrency limit with a bounded, per-user round-robin wait queue
+    """
+
+    def __init__(self, max_concurrency, max_queue, max_per_user):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.active = 0
+        self.queues = {}  # user id -> deque of waiting tickets
+        self.rotation = deque()  # Users with waiting tickets, next to be served first
+        self.condition = threading.Condition()
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected_user': 0, 'rejected_full': 0, 'timeouts': 0}
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _rejection(self, user_id):
+        # The counter and error of a request that could neither take a slot nor wait for one
+        if self.active < self.max_concurrency and not self.rotation:
+            return None
+        if len(self.queues.get(user_id, ())) >= self.max_per_user:
+            return 'rejected_user', GatewayRejected("You already have several requests waiting for the model. "
+                                                    "Please wait for them to finish.", 429)
+        if self.waiting >= self.max_queue:
+            return 'rejected_full', GatewayRejected("The model is busy right now. Please try again shortly.", 503)
+        return None
+
+    def _admissible(self, user_id, timeout=0):
+        # Raise the rejection for a request that finds no room, after waiting up to timeout seconds for some
+        deadline = time.monotonic() + timeout
+        while True:
+            rejection = self._rejection(user_id)
+            if rejection is None:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                counter, error = rejection
+                self.counters[counter] += 1
+                raise error
+            self.condition.wait(remaining)
+
+    def check(self, user_id):
+        """
+        Refuse a request now if it would be refused when it enqueues, without taking anything
+
+        Lets a request that does other work before calling the model (saving a
+        message, retrieval) fail fast, and enqueue only right before the call.
+
+        Raises:
+            GatewayRejected: If the user's queue or the whole queue is full
+        """
+        with self.condition:
+            self._admissible(user_id)
+
+    def enqueue(self, user_id, timeout=0):
+        """
+        Take a slot or a place in the queue
+
+        Args:
+            user_id: Whose queue the request waits in
+            timeout (float, optional): Seconds to wait for room when the queue is
+                full, instead of refusing at once. Defaults to 0.
+
+        Returns:
+            Ticket: Granted if a slot was free, otherwise waiting
+
+        Raises:
+            GatewayRejected: If the user's queue or the whole queue is full
+        """
+        with self.condition:
+            self._admissible(user_id, timeout)
+            ticket = Ticket(user_id)
+            if self.active < self.max_concurrency and not self.rotation:
+                self.active += 1
+                ticket.granted = True
+                self.counters['admitted'] += 1
+                return ticket
+            if user_id not in self.queues:
+                self.queues[user_id] = deque()
+                self.rotation.append(user_id)
+            self.queues[user_id].append(ticket)
+            self.counters['queued'] += 1
+            return ticket
+
+    def _dispatch(self):
+        # Hand free slots to the waiting users in turn
+        while self.active < self.max_concurrency and self.rotation:
+            user_id = self.rotation.popleft()
+            ticket = self.queues[user_id].popleft()
+            if self.queues[user_id]:
+                self.rotation.append(user_id)
+            else:
+                del self.queues[user_id]
+            ticket.granted = True
+            self.active += 1
+            self.counters['admitted'] += 1
+        self.condition.notify_all()
+
+    def wait(self, ticket, timeout=None):
+        """
+        Wait up to timeout seconds for the ticket's slot; True once it is granted
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: ticket.granted, timeout)
+
+    def position(self, ticket):
+        """
+        Number of slots to be handed out up to and including this ticket's (0 once granted)
+        """
+        with self.condition:
+            if ticket.granted or ticket.user_id not in self.queues:
+                return 0
+            depth = self.queues[ticket.user_id].index(ticket)
+            turn = self.rotation.index(ticket.user_id)
+            # Every user gets one slot per round: the rounds before this ticket's,
+            # then the users ahead of it in the rotation during its own round
+            position = sum(min(len(self.queues[user_id]), depth) for user_id in self.rotation)
+            position += sum(1 for user_id in list(self.rotation)[:turn] if len(self.queues[user_id]) > depth)
+            return position + 1
+
+    def release(self, ticket):
+        """
+        Free the ticket's slot, or give up its place in the queue
+        """
+        with self.condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self.active -= 1
+            else:
+                queue = self.queues[ticket.user_id]
+                queue.remove(ticket)
+                if not queue:
+                    del self.queues[ticket.user_id]
+                    self.rotation.remove(ticket.user_id)
+            self._dispatch()
+
+    def timed_out(self, ticket):
+        """
+        Give up a ticket that waited too long and return the rejection to answer with
+        """
+        with self.condition:
+            self.counters['timeouts'] += 1
+        self.release(ticket)
+        return GatewayRejected("The model is busy right now. Please try again shortly.", 503)
+
+    @contextmanager
+    def slot(self, user_id, timeout=None, wait_for_place=False):
+        """
+        Hold a slot for the duration of the block
+
+        With wait_for_place, a full queue is waited on like a busy model, within
+        the same timeout, instead of refusing the request at once.
+
+        Raises:
+            GatewayRejected: If the request is refused or waits longer than timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ticket = self.enqueue(user_id, (timeout or 0) if wait_for_place else 0)
+        try:
+            if not self.wait(ticket, None if deadline is None else max(deadline - time.monotonic(), 0)):
+                raise self.timed_out(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self.condition:
+            return {
+                **self.counters,
+                'active': self.active,
+                'max_concurrency': self.max_concurrency,
+                'waiting': self.waiting,
+                'max_queue': self.max_queue,
+                'waiting_users': len(self.queues),
+            }
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway():
+    """
+    Return the process-wide gateway, creating it on first use
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = Gateway(Config.LLM_MAX_CONCURRENCY, Config.LLM_QUEUE_SIZE, Config.LLM_QUEUE_PER_USER)
+        return _gateway
+
+def llm_slot(user_id, wait_for_place=False):
+    """
+    Hold one of the gateway's slots for a block that uses the LLM
+
+    wait_for_place is for the calls of a request that already did part of its
+    work (a summary's sections): they wait for room in a full queue rather than
+    failing the whole request half way.
+    """
+    return get_gateway().slot(user_id, Config.LLM_QUEUE_TIMEOUT, wait_for_place)
+
+def gateway_stats():
+    return get_gateway().stats()
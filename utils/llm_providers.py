@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from config import Config
+from utils.llm_client import get_client
+
+# LLM backends behind one interface, selected by LLM_PROVIDER:
+#   ollama  Ollama's /api/chat, streamed as one JSON object per line
+#   openai  any OpenAI-compatible /chat/completions endpoint (vLLM, llama.cpp
+#           server, hosted APIs), streamed as server-sent events
+#   fake    a deterministic in-process model that simulates time to first token
+#           and generation speed, for development and load tests without a GPU
+#
+# Providers take chat messages and generation options (temperature, num_ctx:
+# context window, num_predict: maximum answer tokens), each translated to the
+# backend's own parameters. Every provider answers in one piece (chat) or as a
+# stream of text pieces (stream), blocking or with asyncio (achat, astream).
+# The HTTP providers send their requests through the shared LLM client; their
+# asyncio methods run those blocking requests in worker threads.
+
+class Provider:
+    """
+    Base class: chat and the asyncio methods are derived from stream
+    """
+    name = 'provider'
+
+    def stream(self, messages, options):
+        raise NotImplementedError
+
+    def chat(self, messages, options):
+        return ''.join(self.stream(messages, options))
+
+    async def achat(self, messages, options):
+        return await asyncio.to_thread(self.chat, messages, options)
+
+    async def astream(self, messages, options):
+        # The blocking stream runs in a thread and hands its pieces over through a queue
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+
+        def produce():
+            try:
+                for token in self.stream(messages, options):
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        producer = loop.run_in_executor(None, produce)
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await producer
+
+class OllamaProvider(Provider):
+    """
+    Ollama chat API
+    """
+
+    def __init__(self, model, url):
+        self.model = model
+        self.url = url
+        self.name = f'ollama:{model}'
+
+    def payload(self, messages, options, stream):
+        return {"model": self.model, "messages": messages, "options": options, "stream": stream}
+
+    def chat(self, messages, options):
+        response = get_client().post(self.url, json=self.payload(messages, options, False))
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+
+    def stream(self, messages, options):
+        # Closing the generator closes the connection, which stops the generation
+        with get_client().post(self.url, json=self.payload(messages, options, True), stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                token = data.get("message", {}).get("content")
+                if token:
+                    yield token
+                if data.get("done"):
+                    break
+
+class OpenAIProvider(Provider):
+    """
+    OpenAI-compatible chat completions API
+    """
+
+    def __init__(self, model, url, api_key=''):
+        self.model = model
+        self.url = url
+        self.api_key = api_key
+        self.name = f'openai:{model}'
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+
+    def payload(self, messages, options, stream):
+        # The context window is fixed by the server, not per request
+        payload = {"model": self.model, "messages": messages, "stream": stream}
+        if "temperature" in options:
+            payload["temperature"] = options["temperature"]
+        if "num_predict" in options:
+            payload["max_tokens"] = options["num_predict"]
+        return payload
+
+    def chat(self, messages, options):
+        response = get_client().post(self.url, json=self.payload(messages, options, False), headers=self.headers())
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    def stream(self, messages, options):
+        with get_client().post(self.url, json=self.payload(messages, options, True), headers=self.headers(),
+                               stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                for choice in chunk.get("choices", []):
+                    token = (choice.get("delta") or {}).get("content")
+                    if token:
+                        yield token
+
+class FakeProvider(Provider):
+    """
+    Deterministic stand-in model: the answer is drawn from the words of the
+    prompt, seeded by the prompt, after a fixed first-token latency and at a
+    fixed token rate. At most `parallel` requests generate at once, the rest
+    wait, like requests queued on a single GPU.
+    """
+
+    def __init__(self, latency=0.2, tokens_per_second=50, parallel=1, answer_tokens=64):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.parallel = parallel
+        self.answer_tokens = answer_tokens
+        self.name = 'fake'
+        self.slots = threading.BoundedSemaphore(parallel)
+        # asyncio semaphores belong to one event loop
+        self.async_slots = {}
+
+    def answer(self, messages, options):
+        """The answer's pieces (one word each) for a prompt"""
+        prompt = json.dumps(messages, sort_keys=True)
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        words = re.findall(r'\w+', ' '.join(message["content"] for message in messages)) or ['answer']
+        length = min(self.answer_tokens, options.get("num_predict", self.answer_tokens))
+        return [rng.choice(words) + ' ' for _ in range(length)]
+
+    def stream(self, messages, options):
+        tokens = self.answer(messages, options)
+        with self.slots:
+            time.sleep(self.latency)
+            for token in tokens:
+                time.sleep(1 / self.tokens_per_second)
+                yield token
+
+    async def astream(self, messages, options):
+        tokens = self.answer(messages, options)
+        loop = asyncio.get_running_loop()
+        slots = self.async_slots.setdefault(loop, asyncio.Semaphore(self.parallel))
+        async with slots:
+            await asyncio.sleep(self.latency)
+            for token in tokens:
+                await asyncio.sleep(1 / self.tokens_per_second)
+                yield token
+
+    async def achat(self, messages, options):
+        return ''.join([token async for token in self.astream(messages, options)])
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_provider(name=None):
+    """
+    Return the (cached) provider selected by name: 'ollama', 'openai' or 'fake'
+    """
+    name = name or Config.LLM_PROVIDER
+    with _providers_lock:
+        if name not in _providers:
+            if name == 'ollama':
+                _providers[name] = OllamaProvider(Config.LLM_MODEL, Config.OLLAMA_API_URL)
+            elif name == 'openai':
+                _providers[name] = OpenAIProvider(Config.LLM_MODEL, Config.OPENAI_API_URL, Config.LLM_API_KEY)
+            elif name == 'fake':
+                _providers[name] = FakeProvider(Config.FAKE_LLM_LATENCY, Config.FAKE_LLM_TOKENS_PER_SECOND,
+                                                Config.FAKE_LLM_PARALLEL, Config.FAKE_LLM_ANSWER_TOKENS)
+            else:
+                raise ValueError(f"Unknown LLM provider '{name}'. Available: ollama, openai, fake")
+        return _providers[name]
@@ -1,30 +1,75 @@
-import os
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import PyPDF2
-import nltk
-from nltk.tokenize import sent_tokenize
+from utils.segmenters import get_segmenter
 
-# Download necessary NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+# Documents with fewer pages than this are always extracted serially;
+# below it the cost of starting worker processes outweighs the speedup
+PARALLEL_MIN_PAGES = 40
 
-def extract_text_from_pdf(pdf_path):
+# Pages extracted per worker task in parallel mode. Only a few batches are in
+# flight at once, so memory stays bounded regardless of document length.
+PAGE_BATCH_SIZE = 16
+
+# A finished chunk and the (1-based) page it starts on
+Chunk = namedtuple('Chunk', ['text', 'page'])
+
+def extract_page_range(pdf_path, start, stop):
     """
-    Extract text from a PDF file
+    Extract the text of pages [start, stop) of a PDF file
     """
-    text = ""
-    try:
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[page_num].extract_text() for page_num in range(start, stop)]
+
+def split_page_ranges(num_pages, batch_size):
+    """
+    Split a page count into contiguous [start, stop) ranges of at most batch_size pages
+    """
+    batch_size = max(1, batch_size)
+    return [(start, min(start + batch_size, num_pages)) for start in range(0, num_pages, batch_size)]
+
+def iter_pages(pdf_path, workers=1, min_pages=PARALLEL_MIN_PAGES):
+    """
+    Lazily yield (page_number, text) for every page of a PDF, in page order
+
+    With workers > 1 and at least min_pages pages, page batches are extracted in
+    worker processes with a bounded number of batches in flight.
+    """
+    with open(pdf_path, 'rb') as file:
+        num_pages = len(PyPDF2.PdfReader(file).pages)
+
+    if workers <= 1 or num_pages < min_pages:
         with open(pdf_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
+            for page_num in range(num_pages):
+                yield page_num + 1, pdf_reader.pages[page_num].extract_text()
+        return
+
+    batch_size = min(PAGE_BATCH_SIZE, -(-num_pages // workers))
+    ranges = deque(split_page_ranges(num_pages, batch_size))
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        in_flight = deque()
+        while ranges or in_flight:
+            # Keep every worker busy plus one batch of look-ahead each
+            while ranges and len(in_flight) < workers * 2:
+                start, stop = ranges.popleft()
+                in_flight.append((start, executor.submit(extract_page_range, pdf_path, start, stop)))
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+
+def extract_text_from_pdf(pdf_path, workers=1, min_pages=PARALLEL_MIN_PAGES):
+    """
+    Extract text from a PDF file
+    """
+    try:
+        return "".join(text + "\n" for _, text in iter_pages(pdf_path, workers, min_pages))
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return None
-    
-    return text
 
 def preprocess_text(text):
     """
@@ -32,68 +77,125 @@ def preprocess_text(text):
     """
     if not text:
         return ""
-    
-    # Basic preprocessing
-    text = text.replace('\n', ' ')
-    text = ' '.join(text.split())
-    
-    return text
 
-def chunk_text(text, max_chunk_size=2000):
+    # Collapse newlines and runs of whitespace in a single pass
+    return ' '.join(text.split())
+
+def iter_segments(pages, segmenter=None):
+    """
+    Lazily clean and split pages into (page_number, sentence) segments
+
+    The last sentence of each page is held back and joined with the next page,
+    since sentences often continue across page breaks. segmenter is a name
+    registered in utils.segmenters or a callable returning a list of sentences.
+    """
+    if not callable(segmenter):
+        segmenter = get_segmenter(segmenter)
+    carry, carry_page = "", None
+    for page_number, text in pages:
+        cleaned = preprocess_text(text)
+        if not cleaned:
+            continue
+        first_page = page_number
+        if carry:
+            cleaned = carry + " " + cleaned
+            first_page = carry_page
+
+        sentences = segmenter(cleaned)
+        if not sentences:
+            carry = ""
+            continue
+
+        for i, sentence in enumerate(sentences[:-1]):
+            yield (first_page if i == 0 else page_number), sentence
+        carry = sentences[-1]
+        carry_page = first_page if len(sentences) == 1 else page_number
+
+    if carry:
+        yield carry_page, carry
+
+def _overlap_tail(parts, pages, overlap):
+    """
+    Return the trailing parts (and their pages) that fit in overlap characters
+    """
+    length = 0
+    start = len(parts)
+    while start > 0 and length + len(parts[start - 1]) + 1 <= overlap:
+        start -= 1
+        length += len(parts[start]) + 1
+    return parts[start:], pages[start:], length
+
+def iter_chunks(segments, max_chunk_size=2000, overlap=0):
+    """
+    Lazily group (page_number, sentence) segments into Chunks of at most max_chunk_size characters
+
+    With overlap > 0, each chunk starts with the trailing sentences of the previous
+    chunk that fit in overlap characters.
+    """
+    parts, pages, length = [], [], 0
+
+    for segment_page, sentence in segments:
+        # If adding this sentence stays under the limit, extend the current chunk
+        if length + len(sentence) < max_chunk_size:
+            parts.append(sentence)
+            pages.append(segment_page)
+            length += len(sentence) + 1
+            continue
+
+        # Otherwise emit the current chunk, keeping its tail as overlap if the sentence still fits
+        if parts:
+            yield Chunk(" ".join(parts), pages[0])
+            parts, pages, length = _overlap_tail(parts, pages, overlap)
+            if parts and length + len(sentence) < max_chunk_size:
+                parts.append(sentence)
+                pages.append(segment_page)
+                length += len(sentence) + 1
+                continue
+            parts, pages, length = [], [], 0
+
+        if len(sentence) > max_chunk_size:
+            # Split a sentence longer than max_chunk_size into parts (by words)
+            for word in sentence.split():
+                if length + len(word) + 1 < max_chunk_size:
+                    parts.append(word)
+                    length += len(word) + 1
+                else:
+                    if parts:
+                        yield Chunk(" ".join(parts), segment_page)
+                    parts, length = [word], len(word) + 1
+            pages = [segment_page] * len(parts)
+        else:
+            # Start new chunk with this sentence
+            parts, pages, length = [sentence], [segment_page], len(sentence) + 1
+
+    # Emit the last chunk if it's not empty
+    if parts:
+        yield Chunk(" ".join(parts), pages[0])
+
+def chunk_text(text, max_chunk_size=2000, segmenter=None, overlap=0):
     """
     Split text into manageable chunks for AI processing
     """
     if not text:
         return []
-    
-    sentences = sent_tokenize(text)
-    chunks = []
-    current_chunk = ""
-    
-    for sentence in sentences:
-        # If adding this sentence would exceed the limit, save the current chunk and start a new one
-        if len(current_chunk) + len(sentence) < max_chunk_size:
-            current_chunk += sentence + " "
-        else:
-            # If the current chunk is not empty, add it to the list
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                
-            # If the sentence itself is longer than max_chunk_size, split it
-            if len(sentence) > max_chunk_size:
-                # Split long sentence into parts (by words)
-                words = sentence.split()
-                part = ""
-                for word in words:
-                    if len(part) + len(word) + 1 < max_chunk_size:
-                        part += word + " "
-                    else:
-                        chunks.append(part.strip())
-                        part = word + " "
-                
-                if part:
-                    current_chunk = part
-                else:
-                    current_chunk = ""
-            else:
-                # Start new chunk with this sentence
-                current_chunk = sentence + " "
-    
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    
-    return chunks
-
-def process_pdf(pdf_path):
+
+    segments = iter_segments([(1, text)], segmenter)
+    return [chunk.text for chunk in iter_chunks(segments, max_chunk_size, overlap)]
+
+def iter_pdf_chunks(pdf_path, workers=1, max_chunk_size=2000, segmenter=None, overlap=0):
+    """
+    Stream a PDF through extract -> clean -> chunk, yielding Chunks as they are completed
+    """
+    segments = iter_segments(iter_pages(pdf_path, workers), segmenter)
+    return iter_chunks(segments, max_chunk_size, overlap)
+
+def process_pdf(pdf_path, workers=1, segmenter=None, max_chunk_size=2000, overlap=0):
     """
     Process a PDF file: extract text, preprocess, and chunk
     """
-    text = extract_text_from_pdf(pdf_path)
-    if not text:
+    try:
+        chunks = iter_pdf_chunks(pdf_path, workers, max_chunk_size, segmenter, overlap)
+        return [chunk.text for chunk in chunks]
+    except Exception as e:
+        print(f"Error extracting text from PDF: {e}")
         return []
-    
-    processed_text = preprocess_text(text)
-    text_chunks = chunk_text(processed_text)
-    
-    return text_chunks 
\ No newline at end of file
@@ -0,0 +1,318 @@
+import numpy as np
+from config import Config
+from utils.bm25 import InvertedIndex, search
+from utils.chunk_store import open_search_index, open_embeddings
+from utils.context import chunk_tokens
+from utils.embeddings import get_embedder, top_k as vector_top_k
+from utils.retrieval_cache import get_cache, cache_key
+
+# Retrieval stage between the chunk store and prompt packing:
+#   1. candidates from the BM25 indexes and the embedding matrices
+#   2. reciprocal-rank fusion of the two rankings ('hybrid' mode)
+#   3. maximal-marginal-relevance selection under the token budget, so
+#      near-duplicate chunks do not crowd out other information
+RETRIEVAL_MODES = ('hybrid', 'semantic', 'bm25')
+
+# Reciprocal-rank fusion constant: a chunk at rank r contributes 1 / (RRF_K + r)
+RRF_K = 60
+
+def group_chunks(chunks):
+    """
+    Group chunks by the chunk set (file content) they belong to
+
+    Returns:
+        tuple: (chunk sets, positions, loose) where positions[n] maps a chunk
+               number of chunk_sets[n] to its positions in chunks, and loose lists
+               the positions of plain string chunks
+    """
+    groups = {}
+    loose = []
+    for position, chunk in enumerate(chunks):
+        if isinstance(chunk, str):
+            loose.append(position)
+            continue
+        key = id(chunk.chunk_set)
+        if key not in groups:
+            groups[key] = (chunk.chunk_set, {})
+        groups[key][1].setdefault(chunk.index, []).append(position)
+    chunk_sets = [chunk_set for chunk_set, _ in groups.values()]
+    positions = [mapping for _, mapping in groups.values()]
+    return chunk_sets, positions, loose
+
+def bm25_hits(query, chunks, top_k, term_index=None):
+    """
+    Rank chunks lexically: the persisted indexes of their PDFs are searched as one corpus
+
+    Args:
+        term_index (InvertedIndex, optional): Index whose chunk numbers are positions
+            in chunks (a chat session's merged index), searched instead
+
+    Returns:
+        list: Positions into chunks, best first (matching chunks only)
+    """
+    if term_index is not None:
+        return [doc_id for _, _, doc_id in search(query, [term_index], top_k)]
+
+    chunk_sets, positions, loose = group_chunks(chunks)
+    indexes = [open_search_index(chunk_set) for chunk_set in chunk_sets]
+    if loose:
+        # Plain string chunks are indexed on the fly
+        indexes.append(InvertedIndex.from_texts([chunks[position] for position in loose]))
+        positions.append({doc_id: [position] for doc_id, position in enumerate(loose)})
+
+    hits = []
+    for _, index_number, doc_id in search(query, indexes, top_k):
+        hits.extend(positions[index_number].get(doc_id, []))
+    return hits
+
+def embedding_matrices(chunks):
+    """
+    Return the embedding matrices covering chunks, or None if embeddings are unavailable
+
+    Returns:
+        tuple: (matrices, positions) with positions[n] mapping a row of
+               matrices[n] to positions in chunks
+    """
+    chunk_sets, positions, loose = group_chunks(chunks)
+    try:
+        matrices = [open_embeddings(chunk_set) for chunk_set in chunk_sets]
+        if any(matrix is None for matrix in matrices):
+            return None
+        if loose:
+            matrices.append(get_embedder().embed([chunks[position] for position in loose]))
+            positions.append({row: [position] for row, position in enumerate(loose)})
+    except Exception as e:
+        print(f"Error loading embeddings: {e}")
+        return None
+    return matrices, positions
+
+def semantic_hits(query, chunks, top_k, matrices=None):
+    """
+    Rank chunks by cosine similarity of their embeddings to the query
+
+    Returns:
+        list: Positions into chunks, best first, or None if embeddings are unavailable
+    """
+    matrices = matrices or embedding_matrices(chunks)
+    if matrices is None:
+        return None
+    matrices, positions = matrices
+    try:
+        query_vector = get_embedder().embed([query])[0]
+    except Exception as e:
+        print(f"Error embedding query: {e}")
+        return None
+
+    hits = []
+    for _, matrix_number, row in vector_top_k(query_vector, matrices, top_k):
+        hits.extend(positions[matrix_number].get(row, []))
+    return hits
+
+def chunk_vectors(chunks, selected, matrices):
+    """
+    Gather the embedding rows of the chunks at the selected positions into one matrix
+    """
+    matrices, positions = matrices
+    lookup = {}
+    for matrix_number, mapping in enumerate(positions):
+        for row, chunk_positions in mapping.items():
+            for position in chunk_positions:
+                lookup[position] = (matrix_number, row)
+    return np.stack([np.asarray(matrices[lookup[position][0]][lookup[position][1]], dtype=np.float32)
+                     for position in selected])
+
+def fuse_rankings(rankings, k=RRF_K):
+    """
+    Reciprocal-rank fusion of several rankings of the same items
+
+    Returns:
+        tuple: (items best first, fused scores)
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    # Ties keep the order items were first seen in
+    items = sorted(scores, key=lambda item: -scores[item])
+    return items, np.array([scores[item] for item in items], dtype=np.float32)
+
+def mmr_select(relevance, vectors, costs, budget, diversity):
+    """
+    Maximal-marginal-relevance selection under a token budget
+
+    Each step takes the candidate that fits the remaining budget and maximizes
+    (1 - diversity) * relevance - diversity * (highest similarity to an already
+    selected candidate). One matrix-vector product per selected chunk.
+
+    Args:
+        relevance (ndarray): Relevance of each candidate, scaled to [0, 1]
+        vectors (ndarray): Normalized embedding of each candidate
+        costs (ndarray): Token cost of each candidate
+        budget (int): Token budget
+        diversity (float): 0 ranks by relevance only, higher values favour novelty
+
+    Returns:
+        list: Candidate numbers in selection order
+    """
+    available = np.ones(len(relevance), dtype=bool)
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    selected = []
+    remaining = budget
+    while True:
+        candidates = available & (costs <= remaining)
+        if not candidates.any():
+            return selected
+        scores = (1 - diversity) * relevance - diversity * max_similarity
+        scores[~candidates] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        remaining -= costs[best]
+        np.maximum(max_similarity, vectors @ vectors[best], out=max_similarity)
+
+def _candidates(query, chunks, top_k=None, mode=None, term_index=None):
+    """
+    Return (candidate positions best first, their relevance in [0, 1], embeddings or None)
+    """
+    top_k = top_k or Config.RETRIEVAL_TOP_K
+    mode = mode or Config.RETRIEVAL_MODE
+
+    matrices = embedding_matrices(chunks) if mode in ('hybrid', 'semantic') else None
+    rankings = []
+    if mode in ('hybrid', 'bm25') or matrices is None:
+        # BM25 is always available, so it is also the fallback without embeddings
+        rankings.append(bm25_hits(query, chunks, top_k, term_index))
+    if matrices is not None:
+        semantic = semantic_hits(query, chunks, top_k, matrices)
+        if semantic is None:
+            matrices = None
+            if not rankings:
+                rankings.append(bm25_hits(query, chunks, top_k, term_index))
+        else:
+            rankings.append(semantic)
+
+    ranked, scores = fuse_rankings(rankings)
+    relevance = scores / scores[0] if len(scores) else scores
+    return ranked, relevance, matrices
+
+def _cached_candidates(query, chunks, top_k=None, mode=None, term_index=None):
+    """
+    _candidates through the retrieval cache (see utils.retrieval_cache)
+    """
+    top_k = top_k or Config.RETRIEVAL_TOP_K
+    mode = mode or Config.RETRIEVAL_MODE
+    chunk_sets, positions, loose = group_chunks(chunks)
+    # Plain string chunks have no content hash to key on
+    key = cache_key(query, chunk_sets, top_k, mode) if Config.RETRIEVAL_CACHE_BYTES and not loose else None
+    if key is None:
+        return _candidates(query, chunks, top_k, mode, term_index)
+
+    cache = get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        # Map chunk ids back to positions; a chunk listed twice (two PDFs with
+        # the same content) appears once per position, as when it was ranked
+        unused = {chunk_set.content_hash: {index: iter(chunk_positions) for index, chunk_positions in mapping.items()}
+                  for chunk_set, mapping in zip(chunk_sets, positions)}
+        ranked, relevance = [], []
+        for (content_hash, index), score in zip(cached['ids'], cached['relevance']):
+            position = next(unused.get(content_hash, {}).get(index, iter(())), None)
+            if position is not None:
+                ranked.append(position)
+                relevance.append(score)
+        matrices = embedding_matrices(chunks) if mode in ('hybrid', 'semantic') else None
+        return ranked, np.array(relevance, dtype=np.float32), matrices
+
+    ranked, relevance, matrices = _candidates(query, chunks, top_k, mode, term_index)
+    # Results that fell back to BM25 are not cached: embeddings may be available next time
+    if mode == 'bm25' or matrices is not None:
+        ids = [[chunks[position].chunk_set.content_hash, int(chunks[position].index)] for position in ranked]
+        cache.put(key, {'ids': ids, 'relevance': [float(score) for score in relevance]},
+                  tags={chunk_set.content_hash for chunk_set in chunk_sets})
+    return ranked, relevance, matrices
+
+def _with_rest(ranked, count):
+    # Unmatched chunks keep document order so the remaining budget is still used
+    matched = set(ranked)
+    return list(ranked) + [position for position in range(count) if position not in matched]
+
+def rank_chunks(query, chunks, top_k=None, mode=None, term_index=None):
+    """
+    Order chunks for a query: the top matches first, best first, then the rest in document order
+
+    Args:
+        query (str): The user's message
+        chunks (list): Chunks as chunk handles or strings
+        top_k (int, optional): Number of ranked matches per ranking. Defaults to Config.RETRIEVAL_TOP_K.
+        mode (str, optional): 'hybrid', 'semantic' or 'bm25'. Defaults to Config.RETRIEVAL_MODE.
+        term_index (InvertedIndex, optional): Merged BM25 index over chunks (see utils.session_index)
+
+    Returns:
+        list: Positions into chunks, most relevant first
+    """
+    ranked, _, _ = _cached_candidates(query, chunks, top_k, mode, term_index)
+    return _with_rest(ranked, len(chunks))
+
+def select_chunks(query, chunks, budget, top_k=None, mode=None, diversity=None, ranked=None,
+                  separator_tokens=2, term_index=None):
+    """
+    Choose the chunks to put in a prompt: relevant, diverse and within budget tokens
+
+    Candidates from the configured rankings are fused and picked by MMR while
+    they fit the budget; any budget left is filled with other chunks in
+    document order. Without embeddings, candidates are taken in rank order.
+
+    Args:
+        query (str): The user's message
+        chunks (list): Chunks as chunk handles or strings
+        budget (int): Token budget for the chunks
+        top_k (int, optional): Candidates per ranking. Defaults to Config.RETRIEVAL_TOP_K.
+        mode (str, optional): 'hybrid', 'semantic' or 'bm25'. Defaults to Config.RETRIEVAL_MODE.
+        diversity (float, optional): MMR trade-off. Defaults to Config.MMR_DIVERSITY.
+        ranked (list, optional): Positions already ranked by the caller (e.g. library search),
+            used as the candidates instead of searching again
+        separator_tokens (int, optional): Cost of the separator between chunks. Defaults to 2.
+        term_index (InvertedIndex, optional): Merged BM25 index over chunks (see utils.session_index)
+
+    Returns:
+        list: Positions into chunks in selection order (the first one may need truncating
+              if not even it fits the budget)
+    """
+    diversity = Config.MMR_DIVERSITY if diversity is None else diversity
+    if ranked is None:
+        candidates, relevance, matrices = _cached_candidates(query, chunks, top_k, mode, term_index)
+    else:
+        candidates = list(ranked)
+        relevance = 1.0 / (RRF_K + np.arange(1, len(candidates) + 1, dtype=np.float32)) * (RRF_K + 1)
+        matrices = embedding_matrices(chunks)
+
+    costs = np.array([chunk_tokens(chunks[position]) + separator_tokens for position in candidates],
+                     dtype=np.int64)
+    if matrices is not None and diversity > 0 and candidates:
+        vectors = chunk_vectors(chunks, candidates, matrices)
+        order = mmr_select(relevance, vectors, costs, budget, diversity)
+    else:
+        order, used = [], 0
+        for i, cost in enumerate(costs):
+            if used + cost <= budget:
+                order.append(i)
+                used += cost
+    selected = [candidates[i] for i in order]
+
+    # Fill the rest of the budget in document order
+    used = int(sum(costs[i] for i in order))
+    taken = set(candidates)
+    for position in range(len(chunks)):
+        if budget - used <= separator_tokens:
+            break
+        if position in taken:
+            continue
+        cost = chunk_tokens(chunks[position]) + separator_tokens
+        if used + cost <= budget:
+            selected.append(position)
+            used += cost
+
+    if not selected and chunks:
+        # Nothing fits: the best chunk is truncated when packed
+        selected = [candidates[0] if candidates else 0]
+    return selected
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import re
+import threading
+from config import Config
+from utils.cache import LRUCache, SQLiteCache, TieredCache
+
+# Cache of retrieval results. Ranking a query against a session's chunks
+# (BM25 search plus the query embedding round-trip) is the expensive part of
+# retrieval, and the same or a trivially rephrased question is often asked again.
+#
+# Key: the content hashes of the chunk sets searched together with the version
+# of each (modification time of its chunk index, so re-processing changes it),
+# the retrieval settings and the normalized query. Value: the candidate chunk
+# ids, (content hash, chunk number), best first, with their relevance. The
+# budget-dependent MMR selection runs on top of the cached candidates.
+#
+# Entries are tagged with their content hashes and dropped when a PDF is deleted.
+
+_NORMALIZE_PATTERN = re.compile(r'\w+')
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Return the process-wide retrieval cache, creating it on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            shared = SQLiteCache(Config.RETRIEVAL_CACHE_DB, 'retrieval') if Config.RETRIEVAL_CACHE_DB else None
+            _cache = TieredCache(LRUCache(Config.RETRIEVAL_CACHE_BYTES), shared)
+        return _cache
+
+def normalize_query(query):
+    """
+    Case-fold a query and drop punctuation and extra whitespace
+    """
+    return ' '.join(_NORMALIZE_PATTERN.findall(query.lower()))
+
+def cache_key(query, chunk_sets, top_k, mode):
+    """
+    Return the cache key of a query against chunk sets, or None if it cannot be cached
+    """
+    versions = sorted((chunk_set.content_hash, chunk_set.version) for chunk_set in chunk_sets)
+    if not versions:
+        return None
+    key = json.dumps([versions, mode, top_k, Config.EMBEDDER, normalize_query(query)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def invalidate_content(content_hash):
+    """
+    Drop every cached result involving a file content
+    """
+    if content_hash and Config.RETRIEVAL_CACHE_BYTES:
+        get_cache().invalidate(content_hash)
+
+def cache_stats():
+    """
+    Return the hit/miss counters of the retrieval cache
+    """
+    return get_cache().info()
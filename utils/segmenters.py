@@ -0,0 +1,75 @@
+import re
+
+# Sentence segmenters: callables that take cleaned text and return a list of
+# sentences. Select one by name with get_segmenter().
+
+DEFAULT_SEGMENTER = 'regex'
+
+# Sentence end punctuation (plus closing quotes/brackets) followed by whitespace
+# and something that can start a sentence
+_BOUNDARY = re.compile(r'[.!?]+["\'”’)\]]*\s+(?=["\'“‘(\[]?[A-Z0-9])')
+
+# Words that end with a period without ending the sentence
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'vs', 'etc', 'inc',
+    'ltd', 'co', 'corp', 'dept', 'univ', 'no', 'vol', 'fig', 'figs', 'eq', 'sec',
+    'ch', 'pp', 'approx', 'e.g', 'i.e', 'cf', 'al', 'jan', 'feb', 'mar', 'apr',
+    'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec', 'u.s', 'u.k'
+}
+
+def regex_segment(text):
+    """
+    Split text into sentences with a rule-based splitter (no external data needed)
+    """
+    sentences = []
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        # Look at the word that carries the period, e.g. "Dr." or "J."
+        head = text[start:match.start()]
+        last_word = head[head.rfind(' ') + 1:].lower()
+        if text[match.start()] == '.' and (
+                last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha())):
+            continue
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+_nltk_sent_tokenize = None
+
+def nltk_segment(text):
+    """
+    Split text into sentences with NLTK's punkt model
+
+    NLTK is imported (and punkt fetched if missing) on first use only.
+    """
+    global _nltk_sent_tokenize
+    if _nltk_sent_tokenize is None:
+        import nltk
+        from nltk.tokenize import sent_tokenize
+        try:
+            nltk.data.find('tokenizers/punkt')
+        except LookupError:
+            nltk.download('punkt', quiet=True)
+        _nltk_sent_tokenize = sent_tokenize
+    return _nltk_sent_tokenize(text)
+
+SEGMENTERS = {
+    'regex': regex_segment,
+    'nltk': nltk_segment,
+}
+
+def get_segmenter(name=None):
+    """
+    Return the segmenter registered under name (defaults to DEFAULT_SEGMENTER)
+    """
+    name = name or DEFAULT_SEGMENTER
+    try:
+        return SEGMENTERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown sentence segmenter '{name}'. Available: {', '.join(SEGMENTERS)}")
@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from flask import current_app
+from config import Config
+from models import PDF, PDFChatSession
+from utils.bm25 import InvertedIndex, merge_arrays, drop_range
+from utils.cache import LRUCache
+from utils.chunk_store import open_chunks, open_search_index
+
+# Retrieval structure of one chat session, built when the chat is created and
+# loaded as a whole on every message:
+#   parts       the session's PDFs in chunk order: PDF id, content hash, chunk
+#               set version and chunk count
+#   term index  the BM25 indexes of the parts merged into one CSR
+#               term-document matrix whose chunk numbers are positions in the
+#               session's chunk list, so a message is scored with one postings
+#               slice per query term however many PDFs the session spans
+#
+# Stored as INDEX_FOLDER/sessions/<chat id>/terms.npz. Before use it is synced
+# with the PDFs linked to the chat: parts of PDFs that were removed or
+# re-processed are cut out of the matrix and PDFs added (or still processing
+# when the chat was created) are appended, without rebuilding the rest.
+SESSION_INDEX_FILE = 'terms.npz'
+
+class SessionIndex:
+    """
+    Chunk list, chunk sources and merged term index of one chat session
+    """
+
+    def __init__(self, parts, term_index, chunk_sets):
+        self.parts = parts
+        self.term_index = term_index
+        self.chunks = []
+        self.sources = []  # Part number (document number in the prompt) of each chunk
+        for number, chunk_set in enumerate(chunk_sets):
+            self.chunks.extend(chunk_set.handles())
+            self.sources.extend([number] * len(chunk_set))
+
+    @property
+    def pdf_ids(self):
+        return [part['pdf_id'] for part in self.parts]
+
+    def nbytes(self):
+        arrays = (self.term_index.indptr, self.term_index.doc_ids, self.term_index.tfs,
+                  self.term_index.doc_lengths, self.term_index.terms)
+        # Roughly 100 bytes per chunk handle and vocabulary entry
+        return sum(array.nbytes for array in arrays) + 100 * (len(self.chunks) + len(self.term_index.vocabulary))
+
+def part_key(part):
+    return (part['pdf_id'], part['content_hash'], part['version'], part['count'])
+
+def session_dir(chat_id, index_folder=None):
+    index_folder = index_folder or current_app.config['INDEX_FOLDER']
+    return os.path.join(index_folder, 'sessions', str(chat_id))
+
+# Loaded session indexes by chat id, and a lock per chat so one build runs at a time
+_sessions = LRUCache(Config.SESSION_INDEX_CACHE_BYTES, sizeof=SessionIndex.nbytes)
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _chat_lock(chat_id):
+    with _locks_lock:
+        return _locks.setdefault(chat_id, threading.Lock())
+
+def linked_pdfs(chat_id):
+    """
+    Return the ready PDFs linked to a chat with their chunk sets
+
+    PDFs still queued, being processed or failed are skipped; nothing is
+    extracted here. A PDF whose stored chunks cannot be read is skipped too,
+    so one broken document does not take the rest of the chat down with it.
+
+    Returns:
+        list: (PDF, RecordSet) in link order
+    """
+    pdfs = [link.pdf for link in PDFChatSession.query.filter_by(chat_session_id=chat_id)
+            .order_by(PDFChatSession.id).all()]
+    linked = []
+    for pdf in pdfs:
+        if pdf.status != PDF.STATUS_READY or not pdf.content_hash:
+            continue
+        try:
+            chunk_set = open_chunks(pdf.content_hash)
+        except Exception as e:
+            print(f"Error opening chunks of PDF {pdf.id}: {e}")
+            continue
+        if chunk_set is not None and len(chunk_set):
+            linked.append((pdf, chunk_set))
+    return linked
+
+def _load(chat_id, index_folder):
+    path = os.path.join(session_dir(chat_id, index_folder), SESSION_INDEX_FILE)
+    if not os.path.exists(path):
+        return None, None
+    with np.load(path) as data:
+        parts = json.loads(str(data['parts']))
+        index = InvertedIndex(**{name: data[name] for name in data.files if name != 'parts'})
+    return parts, index
+
+def _save(chat_id, parts, index, index_folder):
+    directory = session_dir(chat_id, index_folder)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, SESSION_INDEX_FILE)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as index_file:
+        np.savez(index_file, parts=json.dumps(parts), terms=index.terms, indptr=index.indptr,
+                 doc_ids=index.doc_ids, tfs=index.tfs, doc_lengths=index.doc_lengths)
+    os.replace(temp_path, path)
+
+def sync_session_index(chat_id, linked=None, index_folder=None):
+    """
+    Return the session index of a chat, updating it to match the PDFs linked to the chat
+
+    Args:
+        chat_id (int): The chat session
+        linked (list, optional): (PDF, RecordSet) pairs as returned by linked_pdfs. Defaults to querying them.
+        index_folder (str, optional): Root of the index store. Defaults to the app's INDEX_FOLDER.
+
+    Returns:
+        SessionIndex: The up-to-date session index
+    """
+    linked = linked_pdfs(chat_id) if linked is None else linked
+    wanted = [{'pdf_id': pdf.id, 'content_hash': chunk_set.content_hash,
+               'version': chunk_set.version, 'count': len(chunk_set)} for pdf, chunk_set in linked]
+    chunk_sets = {part_key(part): chunk_set for part, (_, chunk_set) in zip(wanted, linked)}
+
+    with _chat_lock(chat_id):
+        session = _sessions.get(chat_id)
+        if session is not None and {part_key(part) for part in session.parts} == set(chunk_sets):
+            return session
+
+        if session is not None:
+            parts, index = session.parts, session.term_index
+        else:
+            parts, index = _load(chat_id, index_folder)
+        if parts is None:
+            parts, index = [], InvertedIndex(**merge_arrays([]))
+        changed = {part_key(part) for part in parts} != set(chunk_sets)
+
+        # Cut out the parts of PDFs that are gone or were re-processed, last first
+        # so the offsets of the earlier parts stay valid
+        offsets = np.cumsum([0] + [part['count'] for part in parts])
+        kept = []
+        for number in reversed(range(len(parts))):
+            if part_key(parts[number]) in chunk_sets:
+                kept.insert(0, parts[number])
+            else:
+                index = InvertedIndex(**drop_range(index, int(offsets[number]), int(offsets[number + 1])))
+
+        # Append new parts
+        kept_keys = {part_key(part) for part in kept}
+        added = [part for part in wanted if part_key(part) not in kept_keys]
+        if added:
+            index = InvertedIndex(**merge_arrays(
+                [index] + [open_search_index(chunk_sets[part_key(part)]) for part in added]))
+        parts = kept + added
+
+        if len(index) != sum(part['count'] for part in parts):
+            # Stored index out of line with its parts (e.g. an interrupted write): start over
+            parts = wanted
+            index = InvertedIndex(**merge_arrays([open_search_index(chunk_set) for chunk_set in chunk_sets.values()]))
+            changed = True
+
+        if changed:
+            _save(chat_id, parts, index, index_folder)
+        session = SessionIndex(parts, index, [chunk_sets[part_key(part)] for part in parts])
+        _sessions.put(chat_id, session)
+        return session
+
+def delete_session_index(chat_id, index_folder=None):
+    """
+    Remove the stored index of a deleted chat session
+    """
+    _sessions.delete(chat_id)
+    with _locks_lock:
+        _locks.pop(chat_id, None)
+    shutil.rmtree(session_dir(chat_id, index_folder), ignore_errors=True)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils.cache import LRUCache, SQLiteCache, TieredCache
+from utils.context import chunk_text, chunk_tokens, count_tokens, pack_text
+
+# Hierarchical (map-reduce) summarization of documents longer than one prompt:
+#   map     the chunks are grouped in document order into prompts that fit the
+#           model's budget ('section'), and each group is summarized on its own
+#   reduce  the partial summaries are grouped the same way and summarized again
+#           ('merge'), level by level, until they all fit in one last prompt
+#           ('final'). A document that fits in one prompt is summarized directly
+#           ('document').
+# The summaries of one level are requested concurrently from a bounded pool.
+#
+# Group boundaries are content-defined: besides when the budget is full, a group
+# ends after an anchor item, chosen by its own text hash and token count only
+# (with probability tokens / budget). Nothing document-wide enters the choice, so
+# editing a document only moves the boundaries around the edit, and the
+# partial summaries of every other group are found in the cache, which is keyed
+# by the caller's model settings, the prompt kind and the hash of the group text.
+# Cached summaries expire after SUMMARY_CACHE_TTL seconds and are tagged with the
+# content hash of their document, so deleting or re-chunking it drops them.
+
+PARTIAL_KINDS = ('section', 'merge')
+
+# Anchors compare the first 8 hex digits of an item's hash against this range
+ANCHOR_HASH_SPACE = 16 ** 8
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Return the process-wide cache of partial summaries, creating it on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            ttl = Config.SUMMARY_CACHE_TTL or None
+            shared = SQLiteCache(Config.SUMMARY_CACHE_DB, 'summaries', ttl=ttl) if Config.SUMMARY_CACHE_DB else None
+            _cache = TieredCache(LRUCache(Config.SUMMARY_CACHE_BYTES, ttl=ttl), shared)
+        return _cache
+
+def invalidate_summaries(content_hash):
+    """
+    Drop every cached partial summary of a file content
+    """
+    if content_hash:
+        get_cache().invalidate(content_hash)
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def group_items(items, budget):
+    """
+    Split (text or chunk, tokens) items into consecutive groups of at most budget tokens
+
+    Groups also end at anchor items (about one per budget's worth of tokens).
+    Whether an item is an anchor depends on nothing but the item itself, so
+    boundaries follow content rather than position, and an edit elsewhere in
+    the document does not move them. An item larger than the budget forms a
+    group of its own.
+
+    Returns:
+        list: Lists of items
+    """
+    groups = [[]]
+    used = 0
+    for item, tokens in items:
+        if groups[-1] and used + tokens + 1 > budget:
+            groups.append([])
+            used = 0
+        groups[-1].append((item, tokens))
+        used += tokens + 1
+        if int(text_hash(chunk_text(item))[:8], 16) * budget < (tokens + 1) * ANCHOR_HASH_SPACE:
+            groups.append([])
+            used = 0
+    return [group for group in groups if group]
+
+def summarize_document(chunks, summarize, budgets, cache_namespace, workers=None, tags=()):
+    """
+    Summarize a document of any length with map-reduce over its chunks
+
+    Args:
+        chunks (list or str): Chunks in document order (strings or chunk handles), or the text
+        summarize (callable): summarize(kind, text) -> summary, one LLM call; raises on failure
+        budgets (dict): Token budget of the text in each prompt kind
+        cache_namespace (list): Everything besides the text that changes a summary
+            (model, options, prompts), part of the cache key of partial summaries
+        workers (int, optional): Concurrent summaries. Defaults to SUMMARY_WORKERS.
+        tags (iterable, optional): Content hashes of the document, to drop its partial summaries with it
+
+    Returns:
+        str: The summary
+    """
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    items = [(chunk, chunk_tokens(chunk)) for chunk in chunks]
+    cache = get_cache()
+
+    def summarize_part(kind, text):
+        key = text_hash(json.dumps([cache_namespace, kind, text]))
+        summary = cache.get(key)
+        if summary is None:
+            summary = summarize(kind, text)
+            cache.put(key, summary, tags)
+        return summary
+
+    with ThreadPoolExecutor(max_workers=workers or Config.SUMMARY_WORKERS) as pool:
+        level = 0
+        while True:
+            final_kind = 'document' if level == 0 else 'final'
+            if sum(tokens + 1 for _, tokens in items) <= budgets[final_kind] or len(items) == 1:
+                return summarize(final_kind, pack_text([item for item, _ in items], budgets[final_kind]))
+
+            kind = PARTIAL_KINDS[min(level, 1)]
+            groups = group_items(items, budgets[kind])
+            if len(groups) == len(items):
+                # Every summary fills a prompt on its own: merge them pairwise so each level shrinks
+                groups = [items[i:i + 2] for i in range(0, len(items), 2)]
+
+            texts = [pack_text([item for item, _ in group], budgets[kind]) for group in groups]
+            summaries = list(pool.map(lambda text: summarize_part(kind, text), texts))
+            items = [(summary, count_tokens(summary)) for summary in summaries]
+            level += 1
+
+def summary_cache_stats():
+    """
+    Return the hit/miss counters of the partial summary cache
+    """
+    return get_cache().info()
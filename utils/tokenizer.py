@@ -0,0 +1,103 @@
+import math
+import re
+import threading
+
+# Local token counting for context budgeting. The default 'heuristic' counter
+# approximates a BPE vocabulary (common words are one token, long words and
+# numbers split into several) and errs on the high side, so packed prompts stay
+# inside the budget. Letters outside the Latin script (CJK, Cyrillic, Arabic...)
+# count one token each: BPE vocabularies hold few multi-character pieces of
+# them, and scripts such as CJK put no spaces between words.
+# Point TOKENIZER at a HuggingFace tokenizer.json matching
+# the served model to count exactly (needs the optional `tokenizers` package).
+DEFAULT_TOKENIZER = 'heuristic'
+
+_PIECES = re.compile(r'[^\W\d_]+|\d+|[^\w\s]|_')
+
+# Letters past Latin Extended-B
+_NON_LATIN = re.compile(r'[^\u0000-\u024f]')
+
+def _piece_tokens(piece):
+    if piece[0].isdigit():
+        return math.ceil(len(piece) / 3)  # Numbers split into groups of up to 3 digits
+    if piece[0].isalpha():
+        non_latin = len(_NON_LATIN.findall(piece))
+        return non_latin + math.ceil((len(piece) - non_latin) / 6)
+    return 1
+
+def heuristic_count(text):
+    """
+    Estimate the number of tokens in text
+    """
+    return sum(_piece_tokens(piece) for piece in _PIECES.findall(text))
+
+def heuristic_truncate(text, max_tokens):
+    """
+    Return the longest prefix of text that the heuristic counts as at most max_tokens
+    """
+    tokens = 0
+    for match in _PIECES.finditer(text):
+        piece = match.group()
+        piece_tokens = _piece_tokens(piece)
+        if tokens + piece_tokens > max_tokens:
+            if not _NON_LATIN.search(piece):
+                return text[:match.start()].rstrip()
+            # Text without spaces (e.g. CJK) is one long piece: keep as much of it as fits
+            low, high = 0, len(piece)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if _piece_tokens(piece[:middle]) <= max_tokens - tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            return text[:match.start() + low].rstrip()
+        tokens += piece_tokens
+    return text
+
+class Tokenizer:
+    """
+    Token counter backed by the heuristic or a tokenizer.json file
+    """
+
+    def __init__(self, name=None):
+        self.name = name or DEFAULT_TOKENIZER
+        self._model = None
+        if self.name != DEFAULT_TOKENIZER:
+            from tokenizers import Tokenizer as HFTokenizer
+            self._model = HFTokenizer.from_file(self.name)
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self._model is None:
+            return heuristic_count(text)
+        return len(self._model.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text, max_tokens):
+        if max_tokens <= 0:
+            return ''
+        if self._model is None:
+            return heuristic_truncate(text, max_tokens)
+        encoding = self._model.encode(text, add_special_tokens=False)
+        if len(encoding.ids) <= max_tokens:
+            return text
+        return text[:encoding.offsets[max_tokens - 1][1]].rstrip()
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+def get_tokenizer(name=None):
+    """
+    Return the (cached) tokenizer registered under name
+    """
+    name = name or DEFAULT_TOKENIZER
+    with _tokenizers_lock:
+        if name not in _tokenizers:
+            _tokenizers[name] = Tokenizer(name)
+        return _tokenizers[name]
+
+def count_tokens(text, tokenizer=None):
+    """
+    Count the tokens of text with the named tokenizer (default: heuristic)
+    """
+    return get_tokenizer(tokenizer).count(text)
@@ -0,0 +1,318 @@
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from werkzeug.utils import secure_filename
+from models import db, PDF, UploadSession
+from utils.blob_store import INCOMING_DIR, BLOCK_SIZE, file_sha256, save_blob, store_file
+from utils.chunk_store import has_chunks, mark_ready
+
+# Resumable uploads: a client opens an upload session, PUTs the file as numbered
+# parts (in order, each one small request streamed straight to disk) and then
+# completes the session, which moves the file into the blob store. A ZIP archive
+# completed this way (or posted to the upload form) is fanned out into one PDF
+# record per PDF it contains, in the background (see utils.ingest.queue_archive_import).
+PDF_MAGIC = b'%PDF-'
+
+class UploadError(Exception):
+    """
+    An upload request that cannot be honoured, with the HTTP status to answer with
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Running SHA-256 of each upload, valid for the first received_size bytes.
+# Uploads resumed in another process (or after a restart) are rehashed from disk on completion.
+_digests = {}
+_locks = {}
+_digests_lock = threading.Lock()
+
+def _upload_lock(upload_id):
+    with _digests_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+def _forget(upload_id):
+    with _digests_lock:
+        _digests.pop(upload_id, None)
+        _locks.pop(upload_id, None)
+
+def part_path(upload_folder, upload_id):
+    """
+    Return the path the data of an upload session is written to
+    """
+    return os.path.join(upload_folder, INCOMING_DIR, f"{upload_id}.part")
+
+def is_archive(filename, config):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in config['ARCHIVE_EXTENSIONS']
+
+def check_pdf(stream):
+    """
+    Reject a file that does not start with the PDF signature, before it is stored
+
+    Reads the first bytes of stream; a seekable upload must be rewound by the caller.
+
+    Raises:
+        UploadError: If the file is not a PDF
+    """
+    if stream.read(len(PDF_MAGIC)) != PDF_MAGIC:
+        raise UploadError('The file is not a PDF')
+
+def add_pdf(user_id, filename, content_hash, file_path):
+    """
+    Create the PDF record of a stored blob (not committed)
+
+    Content that was already processed for another upload is ready immediately,
+    anything else is left queued for ingestion.
+    """
+    pdf = PDF(
+        filename=os.path.basename(file_path),
+        original_filename=filename,
+        file_path=file_path,
+        content_hash=content_hash,
+        user_id=user_id,
+        is_processed=False,
+        status=PDF.STATUS_QUEUED
+    )
+    if has_chunks(content_hash):
+        mark_ready(pdf)
+    db.session.add(pdf)
+    return pdf
+
+def import_zip(zip_path, user_id, config):
+    """
+    Add every PDF inside a ZIP archive as its own PDF record (not committed)
+
+    Members are streamed into the blob store one at a time, so memory use does
+    not depend on the size of the archive.
+
+    Args:
+        zip_path (str): Path of the archive on disk
+        user_id (int): Owner of the new records
+        config (dict): Application config (upload folder and limits)
+
+    Returns:
+        tuple: (list of new PDF records, list of skipped member names)
+    """
+    pdfs, skipped = [], []
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise UploadError('The file is not a valid ZIP archive')
+
+    with archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or info.filename.startswith('__MACOSX/'):
+                continue
+            if not name.lower().endswith('.pdf'):
+                skipped.append(info.filename)
+                continue
+            if info.file_size > config['MAX_UPLOAD_SIZE'] or len(pdfs) >= config['MAX_ARCHIVE_FILES']:
+                skipped.append(info.filename)
+                continue
+
+            try:
+                with archive.open(info) as member:
+                    check_pdf(member)
+                with archive.open(info) as member:
+                    content_hash, file_path = save_blob(member, config['UPLOAD_FOLDER'])
+            except UploadError:
+                skipped.append(info.filename)
+                continue
+            except (zipfile.BadZipFile, RuntimeError, OSError, NotImplementedError) as e:
+                # Corrupt, encrypted or unsupported compression: import the rest of the archive
+                print(f"Error importing {info.filename} from archive: {e}")
+                skipped.append(info.filename)
+                continue
+
+            pdfs.append(add_pdf(user_id, secure_filename(name), content_hash, file_path))
+    return pdfs, skipped
+
+def check_archive(path):
+    """
+    Reject a file that is not a ZIP archive (removing it) before it is queued for import
+    """
+    if not zipfile.is_zipfile(path):
+        os.remove(path)
+        raise UploadError('The file is not a valid ZIP archive')
+
+def spool_archive(stream, config):
+    """
+    Spool an uploaded archive to disk for a background import
+
+    Returns:
+        str: Path of the archive, to be passed to utils.ingest.queue_archive_import
+    """
+    incoming = os.path.join(config['UPLOAD_FOLDER'], INCOMING_DIR)
+    os.makedirs(incoming, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=incoming, suffix='.zip', delete=False) as temp:
+        for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+            temp.write(block)
+    check_archive(temp.name)
+    return temp.name
+
+def expire_upload_sessions(config):
+    """
+    Discard upload sessions that have not received data within UPLOAD_SESSION_TTL
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=config['UPLOAD_SESSION_TTL'])
+    for session in UploadSession.query.filter(UploadSession.updated_at < cutoff).all():
+        discard_upload(session, config)
+
+def start_upload(user_id, filename, total_size, config):
+    """
+    Open a resumable upload session
+
+    Args:
+        user_id (int): Owner of the upload
+        filename (str): Name of the file being uploaded (.pdf or an archive)
+        total_size (int or None): Size announced by the client
+        config (dict): Application config
+
+    Returns:
+        UploadSession: The new (committed) session
+    """
+    filename = secure_filename(filename or '')
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if extension not in config['ALLOWED_EXTENSIONS'] and extension not in config['ARCHIVE_EXTENSIONS']:
+        raise UploadError('Only PDF files and ZIP archives of PDFs are allowed')
+    if total_size is not None and (total_size < 0 or total_size > config['MAX_UPLOAD_SIZE']):
+        raise UploadError('The file is larger than the maximum upload size', 413)
+
+    expire_upload_sessions(config)
+
+    session = UploadSession(id=uuid.uuid4().hex, user_id=user_id, filename=filename,
+                            total_size=total_size, received_size=0, next_part=0)
+    path = part_path(config['UPLOAD_FOLDER'], session.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    with _digests_lock:
+        _digests[session.id] = (0, hashlib.sha256())
+
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+def write_part(session, part_number, stream, config):
+    """
+    Append one part of an upload, streaming it to disk and into the running hash
+
+    Parts must arrive in order. Re-sending a part that was already stored is a
+    no-op, so a client can always retry the last part it is unsure about. A part
+    that fails half way is cut off again, leaving the upload where it was.
+
+    Returns:
+        bool: True if the part was stored, False if it had been stored before
+    """
+    if part_number < session.next_part:
+        return False
+    if part_number > session.next_part:
+        raise UploadError(f'Expected part {session.next_part}', 409)
+
+    path = part_path(config['UPLOAD_FOLDER'], session.id)
+    if not os.path.exists(path):
+        raise UploadError('Upload data is missing; start the upload again', 410)
+
+    with _upload_lock(session.id):
+        with _digests_lock:
+            cached = _digests.get(session.id)
+        # Update a copy so a failed part leaves the running hash untouched
+        digest = cached[1].copy() if cached and cached[0] == session.received_size else None
+
+        received = session.received_size
+        with open(path, 'r+b') as file:
+            file.truncate(received)
+            file.seek(received)
+            try:
+                for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+                    received += len(block)
+                    if received > config['MAX_UPLOAD_SIZE']:
+                        raise UploadError('The file is larger than the maximum upload size', 413)
+                    file.write(block)
+                    if digest is not None:
+                        digest.update(block)
+            except Exception:
+                file.truncate(session.received_size)
+                raise
+
+        with _digests_lock:
+            if digest is not None:
+                _digests[session.id] = (received, digest)
+            else:
+                _digests.pop(session.id, None)
+
+    session.received_size = received
+    session.next_part = part_number + 1
+    db.session.commit()
+    return True
+
+def complete_upload(session, config):
+    """
+    Finish an upload: move the file into the blob store and create its PDF record
+
+    A PDF becomes one record. An archive is only checked and set aside, to be
+    imported in the background. The session is removed. The caller commits,
+    queues the new record for ingestion and the archive for import.
+
+    Returns:
+        tuple: (list of new PDF records, path of the archive to import or None)
+    """
+    if session.total_size is not None and session.received_size != session.total_size:
+        raise UploadError(f'Received {session.received_size} of {session.total_size} bytes', 409)
+
+    path = part_path(config['UPLOAD_FOLDER'], session.id)
+    if not os.path.exists(path):
+        raise UploadError('Upload data is missing; start the upload again', 410)
+
+    if is_archive(session.filename, config):
+        check_archive(path)
+        archive_path = path[:-len('.part')] + '.zip'
+        os.replace(path, archive_path)
+        pdfs = []
+    else:
+        with open(path, 'rb') as file:
+            check_pdf(file)
+
+        with _digests_lock:
+            cached = _digests.get(session.id)
+        if cached and cached[0] == session.received_size:
+            content_hash = cached[1].hexdigest()
+        else:
+            content_hash = file_sha256(path)
+        content_hash, file_path = store_file(path, content_hash, config['UPLOAD_FOLDER'])
+        pdfs, archive_path = [add_pdf(session.user_id, session.filename, content_hash, file_path)], None
+
+    _forget(session.id)
+    db.session.delete(session)
+    return pdfs, archive_path
+
+def drop_upload(session):
+    """
+    Delete an upload session record without committing, for callers that manage the transaction
+
+    Remove its data with remove_upload_data once the deletion is committed.
+    """
+    _forget(session.id)
+    db.session.delete(session)
+
+def remove_upload_data(session, config):
+    """
+    Delete the data file of an upload session
+    """
+    try:
+        os.remove(part_path(config['UPLOAD_FOLDER'], session.id))
+    except OSError:
+        pass
+
+def discard_upload(session, config):
+    """
+    Abandon an upload session and its data
+    """
+    drop_upload(session)
+    db.session.commit()
+    remove_upload_data(session, config)